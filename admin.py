@@ -0,0 +1,291 @@
+"""
+Admin console for a running server.
+
+Operators used to type Python statements that the server exec()'d. The server now understands a
+fixed set of admin commands instead, typed on its stdin or sent over a local Unix socket
+(ADMIN_SOCKET, readable by the server's user only), so a live server can be inspected and profiled
+from another terminal:
+
+    python admin.py sessions          connected clients, their world and their outbound backlog
+    python admin.py stats             per-stage turn latency, queue waits and the loaded worlds
+    python admin.py flush             write every loaded world to disk now
+    python admin.py snapshot [dir]    copy every loaded world into a directory
+    python admin.py profile 30        sample every thread for 30 seconds and dump the stacks
+
+Each socket connection carries one command line and its reply, so anything that can write a line
+to a Unix socket (e.g. `socat - UNIX-CONNECT:admin.sock`) works as a client too.
+
+The profiler samples the stacks of all threads (turn pool, client threads, event loop, writers)
+rather than running cProfile, which in this Python only sees the thread that enables it. Samples
+are written in the collapsed-stack format that flamegraph.pl and speedscope read.
+"""
+import os
+import sys
+import time
+import stat
+import shlex
+import inspect
+import socket
+import threading
+import socketserver
+from collections import Counter
+
+from metrics import STAGE_SECONDS, QUEUE_WAIT_SECONDS
+
+ADMIN_SOCKET = 'admin.sock'
+SNAPSHOT_DIR = 'snapshots'  # Default parent directory of "snapshot" copies
+PROFILE_DIR = 'profiles'  # Where "profile" writes its stack dumps
+PROFILE_INTERVAL = 0.005  # Seconds between two stack samples
+MAX_PROFILE_SECONDS = 600
+MAX_COMMAND_BYTES = 4096
+REPLY_TIMEOUT = MAX_PROFILE_SECONDS + 30  # How long the command-line client waits for a reply
+
+
+def _format_seconds(value) -> str:
+    if value == float('inf'):
+        return 'inf'
+    return f'{value * 1000:.1f}ms' if value < 1 else f'{value:.2f}s'
+
+def _table(header, rows) -> str:
+    """ Left-aligned text table. """
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in [header] + rows)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+def sample_stacks(seconds: float, interval: float = PROFILE_INTERVAL) -> Counter:
+    """
+    Sample the Python stack of every other thread every `interval` seconds, for `seconds` seconds.
+
+    Returns:
+    Counter: Collapsed stack ("outer;...;inner") -> number of samples.
+    """
+    own = threading.get_ident()
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[';'.join(reversed(labels))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class AdminConsole:
+    """
+    The admin commands, run against the state of one server.
+
+    Args:
+    worlds (WorldRegistry): The worlds the server hosts.
+    outboxes (callable): Returns the outboxes of every connected client.
+    """
+
+    def __init__(self, worlds, outboxes):
+        self.worlds = worlds
+        self.outboxes = outboxes
+        self._profiling = threading.Lock()  # One capture at a time
+        self.commands = {
+            'help': (self.help, 'help: list the admin commands'),
+            'sessions': (self.sessions, 'sessions: connected clients, their world and outbound backlog'),
+            'stats': (self.stats, 'stats: per-stage turn latency, queue waits and the loaded worlds'),
+            'flush': (self.flush, 'flush: write every loaded world to disk now'),
+            'snapshot': (self.snapshot, f'snapshot [dir]: copy every loaded world into dir (default {SNAPSHOT_DIR}/<time>)'),
+            'profile': (self.profile, f'profile <seconds> [file]: sample every thread and dump the stacks (default {PROFILE_DIR}/<time>.folded)'),
+        }
+
+    def execute(self, line: str) -> str:
+        """ Run one command line and return its reply. Errors are reported in the reply, never raised. """
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            return f'Error: {e}'
+        if not words:
+            return ''
+        entry = self.commands.get(words[0].lower())
+        if entry is None:
+            return f'Unknown command: {words[0]}. Type "help" for the list.'
+        command, usage = entry
+        try:
+            inspect.signature(command).bind(*words[1:])
+        except TypeError:
+            return f'Usage: {usage}'
+        try:
+            return command(*words[1:])
+        except Exception as e:
+            return f'Error: {e}'
+
+    def help(self) -> str:
+        return '\n'.join(usage for _, usage in self.commands.values())
+
+    def sessions(self) -> str:
+        where = {outbox: world.name for world in self.worlds.loaded() for outbox in world.members()}
+        rows = []
+        for outbox in self.outboxes():
+            rows.append([outbox.name or '-', where.get(outbox, '-'), outbox.backlog(), f'{outbox.queued_bytes() / 1024:.1f}',
+                         'yes' if outbox.compress else 'no', 'yes' if outbox.streaming else 'no', outbox.evicted or ''])
+        if not rows:
+            return 'No clients connected.'
+        rows.sort(key=lambda row: (-row[2], row[0]))  # Largest backlogs first
+        return _table(['user', 'world', 'frames', 'KiB', 'zlib', 'stream', 'evicted'], rows)
+
+    def stats(self) -> str:
+        rows = []
+        for (stage,), stats in sorted(STAGE_SECONDS.summary().items()):
+            rows.append([stage, stats['count'], _format_seconds(stats['mean']), _format_seconds(stats['p50']),
+                         _format_seconds(stats['p95']), _format_seconds(stats['p99'])])
+        for _, stats in QUEUE_WAIT_SECONDS.summary().items():
+            rows.append(['(queue wait)', stats['count'], _format_seconds(stats['mean']), _format_seconds(stats['p50']),
+                         _format_seconds(stats['p95']), _format_seconds(stats['p99'])])
+        parts = [_table(['stage', 'count', 'mean', 'p50', 'p95', 'p99'], rows) if rows else 'No turns timed yet.']
+        worlds = [[world.name, len(world.players()), len(world.scheduler), len(world.keyword_pipeline),
+                   len(world.state.progress), world.state.dirty] for world in self.worlds.loaded()]
+        if worlds:
+            parts.append(_table(['world', 'players', 'queued', 'keyword jobs', 'turns', 'unsaved changes'], worlds))
+        return '\n\n'.join(parts)
+
+    def flush(self) -> str:
+        loaded = self.worlds.loaded()
+        written = sum(1 for world in loaded if world.state.flush())
+        return f'Flushed {written} of {len(loaded)} loaded worlds (the others had no unsaved changes).'
+
+    def snapshot(self, directory=None) -> str:
+        directory = directory or os.path.join(SNAPSHOT_DIR, time.strftime('%Y%m%d-%H%M%S'))
+        paths = []
+        for world in self.worlds.loaded():
+            paths.extend(world.state.snapshot(directory))
+        if not paths:
+            return 'No worlds loaded, nothing to snapshot.'
+        return f'Snapshot of {len(paths) // 4} worlds written to {directory}:\n' + '\n'.join(paths)
+
+    def profile(self, seconds, path=None) -> str:
+        seconds = float(seconds)
+        if not 0 < seconds <= MAX_PROFILE_SECONDS:
+            return f'Profile length must be between 0 and {MAX_PROFILE_SECONDS} seconds.'
+        if not self._profiling.acquire(blocking=False):
+            return 'A profile is already being captured.'
+        try:
+            stacks = sample_stacks(seconds)
+        finally:
+            self._profiling.release()
+        path = path or os.path.join(PROFILE_DIR, time.strftime('%Y%m%d-%H%M%S') + '.folded')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as file:
+            for stack, count in stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+        # Self time is the innermost frame of a sample; total time counts a function once per sample it appears in
+        total = sum(stacks.values())
+        own, inclusive = Counter(), Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        lines = [f'{total} samples in {seconds:g}s written to {path}', '', 'Top functions by own samples:']
+        lines += [f'{count / total:7.1%}  {frame}' for frame, count in own.most_common(15)]
+        lines += ['', 'Top functions by total samples:']
+        lines += [f'{count / total:7.1%}  {frame}' for frame, count in inclusive.most_common(15)]
+        return '\n'.join(lines)
+
+
+class _AdminHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline(MAX_COMMAND_BYTES).decode('utf-8', 'replace').strip()
+        if line:
+            self.wfile.write((self.server.console.execute(line) + '\n').encode('utf-8'))
+
+
+def _socket_in_use(path: str) -> bool:
+    """ Whether a live server is listening on the Unix socket at `path`. """
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+def start_admin_server(console: AdminConsole, path=ADMIN_SOCKET):
+    """ Serve admin commands on a Unix socket from a daemon thread. Returns the server, or None if it cannot be started. """
+    if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+        print("Admin socket not started: Unix sockets are not available on this platform.")
+        return None
+    if os.path.exists(path):
+        if not stat.S_ISSOCK(os.stat(path).st_mode) or _socket_in_use(path):
+            print(f"Admin socket not started: {path} exists and is in use.")
+            return None
+        os.unlink(path)  # Left behind by a server that did not shut down cleanly
+    server = socketserver.ThreadingUnixStreamServer(path, _AdminHandler, bind_and_activate=False)
+    try:
+        server.server_bind()
+        os.chmod(path, 0o600)  # Before listening, so no other user ever gets to connect
+        server.server_activate()
+    except OSError as e:
+        server.server_close()
+        print(f"Admin socket not started on {path}: {e}")
+        return None
+    server.daemon_threads = True
+    server.console = console
+    threading.Thread(target=server.serve_forever, name='admin', daemon=True).start()
+    print(f"Admin console on {path} (python admin.py help)")
+    return server
+
+def stop_admin_server(server):
+    server.shutdown()
+    server.server_close()
+    try:
+        os.unlink(server.server_address)
+    except OSError:
+        pass
+
+
+def send_command(line: str, path=ADMIN_SOCKET) -> str:
+    """ Send one command line to a running server and return its reply. """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(REPLY_TIMEOUT)
+        sock.connect(path)
+        sock.sendall(line.encode('utf-8') + b'\n')
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b''.join(chunks).decode('utf-8')
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Send admin commands to a running aiMUD server.")
+    parser.add_argument('--socket', default=ADMIN_SOCKET, help="The server's admin socket.")
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='A command and its arguments; without one, commands are read interactively.')
+    args = parser.parse_args()
+
+    try:
+        if args.command:
+            print(send_command(shlex.join(args.command), args.socket), end='')
+            return
+        while True:
+            try:
+                line = input('admin> ').strip()
+            except EOFError:
+                break
+            if line in ('quit', 'exit'):
+                break
+            if line:
+                print(send_command(line, args.socket), end='')
+    except OSError as e:
+        sys.exit(f"Cannot reach the server on {args.socket}: {e}")
+
+if __name__ == '__main__':
+    main()
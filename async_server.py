@@ -0,0 +1,184 @@
+"""
+asyncio server core for aiMUD.
+
+Every connection is a coroutine on a single event loop instead of an OS thread.
+The wire protocol (protocol.py, read here through AsyncFrameReader) and the
+register/login flow are the same as in server.handle_client; the blocking story
+pipeline of every world (continue_story / extract_key_words) runs on the shared turn
+pool from scheduler.py so it never stalls the other connections.
+"""
+import time
+import asyncio
+
+from outbox import AsyncOutbox
+from protocol import AsyncFrameReader, FrameTooLarge
+from server import users, sessions, negotiate, handle_command, find_world, enter_world, open_session, send_session, read_page, history_page
+from world import WorldRegistry
+from scheduler import QueueFull
+from metrics import span, STAGE_SECONDS, CONNECTIONS, OUTBOUND_BACKLOG, QUEUE_DEPTH
+
+HOST = '127.0.0.1'
+PORT = 12345
+
+outboxes = {}  # StreamWriter -> AsyncOutbox of every connected client
+
+_loop = None
+_server = None
+
+
+def call_in_loop(fn, *args):
+    """ Run fn(*args) on the event loop; turn threads send to clients through this. """
+    _loop.call_soon_threadsafe(fn, *args)
+
+# Every game this process hosts; their broadcasts from turn threads are handed back to the event loop
+worlds = WorldRegistry(call_soon=call_in_loop)
+
+def connection_backlogs():
+    """ Return the number of frames waiting to be sent, per connected client. """
+    return {outbox.name: outbox.backlog() for outbox in outboxes.values()}
+
+CONNECTIONS.set_function(lambda: len(outboxes))
+OUTBOUND_BACKLOG.set_function(lambda: sum(connection_backlogs().values()))
+QUEUE_DEPTH.set_function(lambda: {(world.name,): len(world.scheduler) for world in worlds.loaded()})
+
+async def handle_client(reader, writer):
+    peer = writer.get_extra_info('peername')
+    print(f'Connected to: {peer[0]}:{peer[1]}')
+    loop = asyncio.get_running_loop()
+    outbox = AsyncOutbox(writer, name=f'{peer[0]}:{peer[1]}')
+    frames = AsyncFrameReader(reader)  # Every frame from this client is read through it
+    outboxes[writer] = outbox
+    world = None  # The world the player is in once logged in
+    try:
+        outbox.send('Welcome to the Game! Do you want to [R]egister or [L]ogin?')
+        mode = await frames.read()
+        if mode is None:
+            return
+        # "L" logs into the default world, "L <world>" into another one, "S <token> <turn>" resumes a session
+        mode, _, argument = mode.strip().partition(' ')
+        if mode.upper() == 'C':  # Optional capability handshake first; older clients go straight to R/L/S
+            negotiate(outbox, argument)
+            mode, _, argument = (await frames.read() or '').strip().partition(' ')
+        mode = mode.upper()
+
+        if mode == 'R':
+            outbox.send('Enter username: ')
+            username = (await frames.read() or '').strip()
+            outbox.send('Enter password: ')
+            password = (await frames.read() or '').strip()
+            # Database work runs on the executor, never on the event loop
+            if await loop.run_in_executor(None, users.register, username, password):
+                outbox.send('Registration successful! You can now login.\n')
+            else:
+                outbox.send('Username already exists. Please try again.\n')
+            return  # Exit after registration to prompt for login
+        elif mode == 'L':
+            outbox.send('Enter username: ')
+            username = (await frames.read() or '').strip()
+            outbox.send('Enter password: ')
+            password = (await frames.read() or '').strip()
+            if not await loop.run_in_executor(None, users.verify, username, password):
+                outbox.send('Login failed. Check your username and password.\n')
+                return
+            outbox.name = username
+            # Loading a world reads its files, so it happens off the event loop
+            world = await loop.run_in_executor(None, find_world, worlds, argument.strip())
+            if world is None:
+                if argument.strip():
+                    outbox.send(f"[There is no world called {argument.strip()}.]")
+                world = await loop.run_in_executor(None, worlds.get)
+            page = await loop.run_in_executor(None, read_page, world)  # The story is read off the event loop
+            turn = enter_world(world, outbox, username, page=page)
+            token = await loop.run_in_executor(None, sessions.create, username, world.name)
+        elif mode == 'S':
+            session = await loop.run_in_executor(None, open_session, argument)
+            if session is None:
+                outbox.send('Session expired or unknown. Please login again.\n')
+                return
+            token, username, world_name, since = session
+            outbox.name = username
+            world = (await loop.run_in_executor(None, find_world, worlds, world_name)
+                     or await loop.run_in_executor(None, worlds.get))
+            page = await loop.run_in_executor(None, read_page, world, since)
+            turn = enter_world(world, outbox, username, resumed=True, since=since, page=page)
+        else:
+            return
+        send_session(outbox, token, turn)
+
+        while True:
+            user_input = await frames.read()
+            if not user_input:
+                break  # Connection dropped: the session can be resumed
+            # Receiving a command is timed from its header arriving, not from when the player started typing
+            STAGE_SECONDS.observe(time.perf_counter() - frames.arrived, stage="receive")
+            command = user_input.strip()
+            if command == "quit":
+                await loop.run_in_executor(None, sessions.revoke, token)
+                break
+            if command == '/history' or command.startswith('/history '):
+                outbox.send(await loop.run_in_executor(None, history_page, world, command))  # Reads the progress log
+                continue
+            if handle_command(worlds, outbox, world, command):
+                continue
+            if command == '/world' or command.startswith('/world '):
+                target = await loop.run_in_executor(None, find_world, worlds, command[len('/world'):].strip())
+                if target is None:
+                    outbox.send("[Usage: /world <name>; /worlds lists the worlds.]")
+                elif target is not world:
+                    page = await loop.run_in_executor(None, read_page, target)
+                    turn = enter_world(target, outbox, username, previous=world, page=page)
+                    world = target
+                    await loop.run_in_executor(None, sessions.move, token, world.name)
+                    send_session(outbox, token, turn)
+                continue
+
+            reply = lambda message, outbox=outbox: loop.call_soon_threadsafe(outbox.send, message)
+            try:
+                with span("enqueue"):
+                    position = world.scheduler.submit(username, user_input, reply=reply)
+            except QueueFull as e:
+                outbox.send(f"[Your action was not queued: {e}. Please wait.]")
+                continue
+            if position:
+                outbox.send(f"[Your action is queued: {position} ahead of it.]")
+    except FrameTooLarge as e:
+        print(f"Dropping client {outbox.name}: {e}")
+    except ConnectionError:
+        pass
+    finally:
+        if world is not None:
+            world.leave(outbox)
+        outboxes.pop(writer, None)
+        try:
+            await outbox.close()  # Deliver whatever is still queued for this client
+        except asyncio.CancelledError:
+            pass  # Server shutting down: nothing left to wait for
+        writer.close()
+
+async def serve(host=HOST, port=PORT):
+    global _loop, _server
+    _loop = asyncio.get_running_loop()
+    _server = await asyncio.start_server(handle_client, host, port, reuse_address=True, backlog=1024)
+    print('Server started (asyncio). Listening for connections...')
+    try:
+        await _server.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        # Drop every connection so the handlers see EOF and finish their cleanup before the loop goes away
+        for writer in list(outboxes):
+            writer.transport.abort()
+        handlers = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if handlers:
+            await asyncio.wait(handlers, timeout=1.0)
+        outboxes.clear()
+
+def start_server():
+    asyncio.run(serve())
+
+def stop_server():
+    if _loop is not None and _server is not None:
+        _loop.call_soon_threadsafe(_server.close)
+    worlds.close()  # Let pending keyword updates land, then flush every world
+    users.close()
+    print('Server has been shut down.')
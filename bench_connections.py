@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Compare idle-connection cost of the threaded and asyncio server modes.
+
+Starts `server.py --mode <mode>` in a subprocess, opens N idle client connections
+(each one reads the welcome frame and then just sits there), and reports the
+server's thread count and resident memory read from /proc (Linux only).
+
+    python bench_connections.py --connections 2000
+"""
+import argparse
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from protocol import FrameReader
+
+HOST = '127.0.0.1'
+PORT = 12345
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+def proc_status(pid):
+    """ Return (threads, rss_kb) of a process from /proc/<pid>/status. """
+    threads = rss = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('Threads:'):
+                threads = int(line.split()[1])
+            elif line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+    return threads, rss
+
+def wait_for_port(timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, PORT), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('server did not start listening')
+
+def run(mode, n):
+    server = subprocess.Popen([sys.executable, 'server.py', '--mode', mode],
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                              preexec_fn=raise_fd_limit, text=True)
+    clients = []
+    try:
+        wait_for_port()
+        time.sleep(0.5)
+        base_threads, base_rss = proc_status(server.pid)
+        start = time.time()
+        for _ in range(n):
+            sock = socket.create_connection((HOST, PORT))
+            FrameReader(sock).read_frame()  # welcome message: the connection is now fully set up server-side
+            clients.append(sock)
+        elapsed = time.time() - start
+        time.sleep(0.5)
+        threads, rss = proc_status(server.pid)
+        return {
+            'mode': mode,
+            'connections': len(clients),
+            'connect_s': elapsed,
+            'threads': threads,
+            'rss_mb': rss / 1024,
+            'rss_per_conn_kb': (rss - base_rss) / max(len(clients), 1),
+            'base_threads': base_threads,
+        }
+    finally:
+        for sock in clients:
+            sock.close()
+        server.stdin.write('stop\n')
+        server.stdin.flush()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--mode', choices=['threaded', 'async', 'both'], default='both')
+    args = parser.parse_args()
+    raise_fd_limit()
+
+    modes = ['threaded', 'async'] if args.mode == 'both' else [args.mode]
+    print(f"{'mode':<10}{'conns':>8}{'threads':>10}{'RSS MB':>10}{'KB/conn':>10}{'connect s':>11}")
+    for mode in modes:
+        r = run(mode, args.connections)
+        print(f"{r['mode']:<10}{r['connections']:>8}{r['threads']:>10}{r['rss_mb']:>10.1f}"
+              f"{r['rss_per_conn_kb']:>10.1f}{r['connect_s']:>11.2f}")
+        time.sleep(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Benchmark keyword spotting: per-key substring loop vs the Aho–Corasick KeywordMatcher.
+
+Generates a synthetic keyword dictionary (a mix of English and Chinese keys) and a story window,
+then times direct-appearance spotting and graph construction both ways.
+
+    python bench_keywords.py --keywords 100 1000 5000 --text-length 1500
+"""
+import argparse
+import random
+import time
+
+from keyword_matcher import KeywordMatcher
+
+SYLLABLES = ['al', 'dor', 'en', 'shi', 're', 'ka', 'mon', 'tul', 'vi', 'zor', 'th', 'wyn']
+HANZI = '查拉图斯特如是说欲望贞洁服从命令战争道德太阳哲人智者睡眠老者基督教和平敌人梦世界来生论大物可怜多余邻爱国偶像'
+
+
+def make_keywords(n, rng):
+    keys = set()
+    while len(keys) < n:
+        if rng.random() < 0.5:
+            keys.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+        else:
+            keys.add(''.join(rng.choice(HANZI) for _ in range(rng.randint(2, 4))))
+    keys = sorted(keys)
+    return {k: ' '.join(rng.choice(keys) if rng.random() < 0.2 else rng.choice(SYLLABLES) for _ in range(30)) for k in keys}
+
+def make_text(keywords, length, rng):
+    keys = list(keywords)
+    parts = []
+    while sum(map(len, parts)) < length:
+        parts.append(rng.choice(keys) if rng.random() < 0.1 else rng.choice(SYLLABLES + list(HANZI)))
+    return ' '.join(parts)[:length]
+
+def substring_loop(text, keywords):
+    text_lower = text.lower()
+    return {key for key in keywords if key.lower() in text_lower}
+
+def substring_graph_edges(keywords):
+    keywords_lower = {k: (k.lower(), v.lower()) for k, v in keywords.items()}
+    edges = 0
+    for key, (key_lower, description) in keywords_lower.items():
+        for potential_lower, _ in keywords_lower.values():
+            if potential_lower in description and key_lower != potential_lower:
+                edges += 1
+    return edges
+
+def matcher_graph_edges(keywords, matcher):
+    edges = 0
+    for key, description in keywords.items():
+        key_lower = key.lower()
+        edges += sum(1 for other in matcher.find(description) if other.lower() != key_lower)
+    return edges
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--keywords', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--text-length', type=int, default=1500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    print(f"{'keys':>6} | {'spot loop ms':>12} {'spot AC ms':>11} {'speedup':>8} | {'graph loop ms':>13} {'graph AC ms':>12} {'speedup':>8}")
+    for n in args.keywords:
+        keywords = make_keywords(n, rng)
+        text = make_text(keywords, args.text_length, rng)
+        matcher = KeywordMatcher(keywords)
+        assert matcher.find(text) == substring_loop(text, keywords)
+
+        spot_loop = best_of(lambda: substring_loop(text, keywords), args.repeat)
+        spot_ac = best_of(lambda: matcher.find(text), args.repeat)
+        graph_repeat = 1 if n > 2000 else args.repeat
+        graph_loop = best_of(lambda: substring_graph_edges(keywords), graph_repeat)
+        graph_ac = best_of(lambda: matcher_graph_edges(keywords, matcher), graph_repeat)
+        print(f"{n:>6} | {spot_loop * 1e3:>12.2f} {spot_ac * 1e3:>11.2f} {spot_loop / spot_ac:>7.1f}x | "
+              f"{graph_loop * 1e3:>13.1f} {graph_ac * 1e3:>12.1f} {graph_loop / graph_ac:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""Drive many simulated players against a local game server and report throughput and latency.
+
+Starts `server.py --mode <mode>` in a subprocess, in a scratch copy of the game files whose
+config.json points at the stub endpoint from mock_llm_server.py (started in this process), so no
+network access or API key is needed. Every simulated player registers, logs in and then sends
+actions over the real wire protocol, waiting for the story turn of each one before the next.
+
+Reported:
+  actions/sec       completed turns per second over the whole run
+  turn latency      from sending an action to receiving the story segment it produced (p50/p95/p99)
+  fan-out latency   spread between the first and the last player of a world seeing the same
+                    "[Action taken by ...]" broadcast (p50/p95/p99)
+  server            peak resident memory and thread count, sampled from /proc (Linux only)
+
+    python bench_load.py --players 50 --actions 5 --worlds 5 --mode async --latency 0.2 --error-rate 0.02
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench_connections import raise_fd_limit, proc_status, wait_for_port, HOST, PORT
+from protocol import FrameReader, send_frame
+from world import TURN_FAILED_NOTICE
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOCK_PORT = 8765
+
+
+def percentiles(values):
+    """ Return (p50, p95, p99) of a list of numbers, or Nones if it is empty. """
+    if not values:
+        return None, None, None
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return pick(0.50), pick(0.95), pick(0.99)
+
+
+class SimulatedPlayer(threading.Thread):
+    """ One player: registers, logs into its world, then plays `actions` turns with `think` seconds between them. """
+
+    def __init__(self, name, world, actions, think, timeout):
+        super().__init__(daemon=True)
+        self.name_ = name
+        self.world = world
+        self.actions = actions
+        self.think = think
+        self.timeout = timeout
+        self.turn_latencies = []
+        self.seen = {}  # "[Action taken by ...]" broadcast -> time this player received it
+        self.rejected = 0  # Actions bounced off a full queue and resent
+        self.failed_turns = 0  # Own turns that ended in the "story could not continue" notice
+        self.error = None
+
+    def connect(self) -> FrameReader:
+        for mode in ('R', f'L {self.world}'.strip()):
+            reader = FrameReader(socket.create_connection((HOST, PORT)))
+            reader.read()  # welcome
+            for message in (mode, self.name_, 'bench'):
+                send_frame(reader.sock, message)
+                reader.read()
+            if mode == 'R':
+                reader.sock.close()
+        return reader
+
+    def run(self):
+        try:
+            reader = self.connect()
+            sock = reader.sock
+            sock.settimeout(self.timeout)
+            for i in range(self.actions):
+                action = f'{self.name_} explores #{i}'
+                own_tag = f'[Action taken by {self.name_}: {action}]'
+                start = time.perf_counter()
+                send_frame(sock, action)
+                tagged = False
+                while True:
+                    message = reader.read()
+                    if message is None:
+                        raise ConnectionError('server closed the connection')
+                    now = time.perf_counter()
+                    if message.startswith('[Your action was not queued'):
+                        self.rejected += 1
+                        time.sleep(0.2)
+                        send_frame(sock, action)  # The world's queue is full: back off and try again
+                    elif message.startswith('[Action taken by '):
+                        self.seen[message] = now
+                        tagged = tagged or message == own_tag
+                    elif tagged and not message.startswith('['):
+                        self.turn_latencies.append(now - start)  # First story segment after our own action
+                        break
+                    elif tagged and message == TURN_FAILED_NOTICE:
+                        self.failed_turns += 1  # The LLM call failed for good; the action was dropped
+                        break
+                time.sleep(self.think)
+            # Stay around a little so the broadcasts of the other players' last turns are seen too
+            sock.settimeout(1.0)
+            try:
+                while (message := reader.read()) is not None:
+                    if message.startswith('[Action taken by '):
+                        self.seen[message] = time.perf_counter()
+            except socket.timeout:
+                pass
+            send_frame(sock, 'quit')
+            sock.close()
+        except Exception as e:
+            self.error = e
+
+
+def prepare_workdir(worlds):
+    workdir = tempfile.mkdtemp(prefix='aimud-load-')
+    shutil.copy(os.path.join(HERE, 'game.txt'), workdir)
+    os.makedirs(os.path.join(workdir, 'games'))
+    for i in range(1, worlds):
+        shutil.copy(os.path.join(HERE, 'games', 'WordLand.txt'), os.path.join(workdir, 'games', f'load{i}.txt'))
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump({'api_endpoint': f'http://127.0.0.1:{MOCK_PORT}/v1/chat/completions',
+                   'models': {'story_continuation': 'mock', 'keyword_extraction': 'mock'},
+                   'read_timeout': 30}, f)
+    return workdir
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--actions', type=int, default=5, help="Actions per player")
+    parser.add_argument('--worlds', type=int, default=1, help="Players are spread round-robin over this many worlds")
+    parser.add_argument('--think', type=float, default=0.0, help="Seconds a player waits between its turns")
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='async')
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds a player waits for its turn before giving up")
+    mock_args = parser.add_argument_group('stub endpoint')
+    mock_args.add_argument('--token-delay', type=float, default=0.01)
+    mock_args.add_argument('--latency', type=float, default=0.0)
+    mock_args.add_argument('--latency-jitter', type=float, default=0.0)
+    mock_args.add_argument('--error-rate', type=float, default=0.0)
+    mock_args.add_argument('--rate-limit-rate', type=float, default=0.0)
+    mock_args.add_argument('--disconnect-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    sys.path.insert(0, HERE)
+    from mock_llm_server import start_mock_server
+    mock = start_mock_server(port=MOCK_PORT, token_delay=args.token_delay, latency=args.latency,
+                             latency_jitter=args.latency_jitter, error_rate=args.error_rate,
+                             rate_limit_rate=args.rate_limit_rate, disconnect_rate=args.disconnect_rate)
+
+    workdir = prepare_workdir(args.worlds)
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'server.py'), '--mode', args.mode], cwd=workdir,
+                              stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, preexec_fn=raise_fd_limit, text=True)
+    peak = {'threads': 0, 'rss': 0}
+    sampling = threading.Event()
+
+    def sample():
+        while not sampling.is_set():
+            threads, rss = proc_status(server.pid)
+            peak['threads'] = max(peak['threads'], threads)
+            peak['rss'] = max(peak['rss'], rss)
+            sampling.wait(0.1)
+
+    try:
+        wait_for_port()
+        time.sleep(0.5)
+        threading.Thread(target=sample, daemon=True).start()
+        world_names = ['game'] + [f'load{i}' for i in range(1, args.worlds)]
+        players = [SimulatedPlayer(f'player{i}', world_names[i % args.worlds], args.actions, args.think, args.timeout)
+                   for i in range(args.players)]
+        start = time.perf_counter()
+        for player in players:
+            player.start()
+        for player in players:
+            player.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        sampling.set()
+        try:
+            server.stdin.write('stop\n')
+            server.stdin.flush()
+        except BrokenPipeError:
+            print(f"server exited early with status {server.poll()}")
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        mock.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    turns = [t for player in players for t in player.turn_latencies]
+    # Fan-out: for each action broadcast, the spread of receive times across the players of its world
+    fan_out = []
+    for world in set(player.world for player in players):
+        members = [player for player in players if player.world == world]
+        for tag in set().union(*(player.seen for player in members)):
+            times = [player.seen[tag] for player in members if tag in player.seen]
+            if len(times) == len(members) > 1:
+                fan_out.append(max(times) - min(times))
+    failed = [player for player in players if player.error]
+    rejected = sum(player.rejected for player in players)
+    failed_turns = sum(player.failed_turns for player in players)
+
+    print(f"{args.players} players x {args.actions} actions over {args.worlds} world(s), {args.mode} server")
+    print(f"completed turns:  {len(turns)} in {elapsed:.1f} s = {len(turns) / elapsed:.1f} actions/sec")
+    for label, values in (('turn latency', turns), ('fan-out latency', fan_out)):
+        p50, p95, p99 = percentiles(values)
+        if p50 is None:
+            print(f"{label + ':':<18}n/a")
+        else:
+            print(f"{label + ':':<18}p50 {p50 * 1000:.0f} ms  p95 {p95 * 1000:.0f} ms  p99 {p99 * 1000:.0f} ms")
+    print(f"server:           peak RSS {peak['rss'] / 1024:.1f} MB, peak threads {peak['threads']}")
+    print(f"stub endpoint:    {mock.counts}")
+    if rejected:
+        print(f"{rejected} action(s) were rejected by a full queue and resent")
+    if failed_turns:
+        print(f"{failed_turns} turn(s) failed after the LLM call layer gave up")
+    if failed:
+        print(f"{len(failed)} player(s) failed, e.g. {failed[0].name_}: {failed[0].error}")
+
+if __name__ == '__main__':
+    main()
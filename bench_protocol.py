@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark the frame codec: the old per-script recv/send helpers vs protocol.FrameReader / send_frame.
+
+A sender thread writes frames of one size through a local socket pair while the main thread reads
+them back, for each payload size; throughput is reported in frames and megabytes per second.
+
+    python bench_protocol.py --sizes 64 1024 65536 1048576 --megabytes 64
+"""
+import argparse
+import socket
+import threading
+import time
+
+from protocol import FrameReader, send_frame
+
+
+def legacy_send(sock, data):
+    sock.send(len(data).to_bytes(4, byteorder='big'))
+    sock.send(data)
+
+def legacy_recv(sock):
+    length_bytes = sock.recv(4)
+    if not length_bytes:
+        return None
+    length = int.from_bytes(length_bytes, byteorder='big')
+    data = b''
+    while len(data) < length:
+        packet = sock.recv(length - len(data))
+        if not packet:
+            break
+        data += packet
+    return data
+
+def run(size, count, send, make_recv):
+    """ Send `count` frames of `size` bytes and read them back. Returns the elapsed seconds. """
+    sender_sock, receiver_sock = socket.socketpair()
+    payload = b'x' * size
+    def sender():
+        for _ in range(count):
+            send(sender_sock, payload)
+        sender_sock.close()
+    thread = threading.Thread(target=sender)
+    recv = make_recv(receiver_sock)
+    start = time.perf_counter()
+    thread.start()
+    for _ in range(count):
+        frame = recv()
+        assert frame is not None and len(frame) == size
+    elapsed = time.perf_counter() - start
+    thread.join()
+    receiver_sock.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 1024, 65536, 1048576])
+    parser.add_argument('--megabytes', type=int, default=64, help='Payload megabytes per run')
+    parser.add_argument('--max-frames', type=int, default=200000)
+    args = parser.parse_args()
+
+    print(f"{'size':>8} {'frames':>7} | {'legacy frames/s':>15} {'MB/s':>8} | {'protocol frames/s':>17} {'MB/s':>8} | {'speedup':>7}")
+    for size in args.sizes:
+        count = max(1, min(args.max_frames, args.megabytes * 1024 * 1024 // size))
+        legacy = run(size, count, legacy_send, lambda sock: lambda: legacy_recv(sock))
+        buffered = run(size, count, send_frame, lambda sock: FrameReader(sock).read_frame)
+        megabytes = size * count / 1024 / 1024
+        print(f"{size:>8} {count:>7} | {count / legacy:>15,.0f} {megabytes / legacy:>8.1f} | "
+              f"{count / buffered:>17,.0f} {megabytes / buffered:>8.1f} | {legacy / buffered:>6.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""Time how long a large world takes to load, cleanly and after a crash.
+
+Builds a scratch world with N turns in its progress log and K keywords in its keyword store, then
+times opening it (GameState(path), which loads the progress index and the keyword graph) in these cases:
+
+  clean         the index covers the whole log (a normal restart)
+  tail replay   the last --tail records never made it into the index (a crash between the two writes)
+  torn record   the log ends in half a record (a crash mid-append)
+  no index      the index is gone and the whole log has to be replayed
+
+The files are put back the way they were before every run, since opening a damaged world repairs it.
+The "keyword graph" column is the part of opening spent building the keyword graph, which is never
+stored and grows with the number of keywords rather than turns; the rest is loading the progress log.
+
+    python bench_startup.py --turns 100000 --keywords 2000 --tail 1000
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from game_state import GameState
+from keywords import KeywordGraph
+from progress_log import INDEX_ENTRY
+
+WORDS = ['the', 'knight', 'opens', 'a', 'door', 'into', 'dark', 'hall', 'where', 'lanterns', 'flicker', 'and', 'rats', 'run']
+
+
+def build_world(directory, turns, keywords, rng):
+    path = os.path.join(directory, 'game.txt')
+    state = GameState(path)
+    for turn in range(turns):
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+        state.progress.append(text, author=f'player{turn % 8}', action='look around')
+    state.update_keywords({f'Keyword{i}': ' '.join(rng.choice(WORDS) for _ in range(20)) + f' Keyword{rng.randrange(keywords)}'
+                           for i in range(keywords)})
+    state.close()
+    return path
+
+def time_open(path, prepare, repeat):
+    """ Median seconds to open the world, and to build its keyword graph, running `prepare()` before each attempt. """
+    times, graph_times = [], []
+    for _ in range(repeat):
+        prepare()
+        start = time.perf_counter()
+        state = GameState(path)
+        times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        KeywordGraph(state.keywords)  # The same build GameState just did
+        graph_times.append(time.perf_counter() - start)
+        state.close()
+    return statistics.median(times), statistics.median(graph_times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--turns', type=int, default=100000)
+    parser.add_argument('--keywords', type=int, default=2000)
+    parser.add_argument('--tail', type=int, default=1000, help='Records missing from the index in the "tail replay" case.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='aimud-startup-')
+    try:
+        start = time.perf_counter()
+        path = build_world(directory, args.turns, args.keywords, random.Random(args.seed))
+        log_path = os.path.join(directory, 'game.progress.jsonl')
+        index_path = log_path + '.idx'
+        log_size, index_size = os.path.getsize(log_path), os.path.getsize(index_path)
+        print(f'Built {args.turns} turns ({log_size / 2**20:.1f} MiB log, {index_size / 2**20:.1f} MiB index) '
+              f'and {args.keywords} keywords in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+        with open(index_path, 'rb') as f:
+            index = f.read()
+
+        def restore(index_bytes=index, log_bytes=log_size, torn=b''):
+            def prepare():
+                with open(log_path, 'r+b') as f:
+                    f.truncate(log_bytes)
+                    f.seek(0, os.SEEK_END)
+                    f.write(torn)
+                if index_bytes is None:
+                    if os.path.exists(index_path):
+                        os.remove(index_path)
+                else:
+                    with open(index_path, 'wb') as f:
+                        f.write(index_bytes)
+            return prepare
+
+        cases = [
+            ('clean', restore()),
+            (f'tail replay ({args.tail} records)', restore(index[:len(index) - args.tail * INDEX_ENTRY.size])),
+            ('torn record', restore(torn=b'{"turn": 1, "author": "narr')),
+            ('no index', restore(None)),
+        ]
+        print(f"{'case':<28}{'open':>10}{'keyword graph':>16}")
+        for name, prepare in cases:
+            seconds, graph_seconds = time_open(path, prepare, args.repeat)
+            print(f'{name:<28}{seconds * 1000:>8.1f}ms{graph_seconds * 1000:>14.1f}ms')
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
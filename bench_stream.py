@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Measure story time-to-first-byte for streaming and non-streaming players.
+
+Runs the game server in-process against the stub endpoint from mock_llm_server.py, in a scratch copy
+of game.txt, with two logged-in players: one that sent "/stream on" and one that did not. For every
+action it records how long each player waits for the first byte of story text and for the end of it.
+
+    python bench_stream.py --actions 5 --token-delay 0.05 --mode threaded
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from protocol import FrameReader, send_frame, STREAM_DELTA
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def connect(username, password) -> FrameReader:
+    for mode in ('R', 'L'):
+        reader = FrameReader(socket.create_connection(('127.0.0.1', 12345)))
+        reader.read()
+        for message in (mode, username, password):
+            send_frame(reader.sock, message)
+            reader.read()
+        if mode == 'R':
+            reader.sock.close()
+    return reader
+
+class Player:
+    """ Logged-in client whose reader thread timestamps every frame it receives. """
+
+    def __init__(self, username, streaming):
+        self.reader = connect(username, 'bench')
+        self.sock = self.reader.sock
+        self.frames = []
+        if streaming:
+            send_frame(self.sock, '/stream on')
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        while True:
+            message = self.reader.read()
+            if message is None:
+                return
+            self.frames.append((time.perf_counter(), message))
+
+    def story_timing(self, since):
+        """ Return (first story byte, end of story) times relative to `since`, or None if not seen yet. """
+        first = None
+        for t, message in self.frames:
+            if t < since:
+                continue
+            if message.startswith(STREAM_DELTA):
+                if message == STREAM_DELTA:
+                    return first - since, t - since
+                first = first or t
+            elif not message.startswith('['):
+                return t - since, t - since
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--actions', type=int, default=5)
+    parser.add_argument('--token-delay', type=float, default=0.05)
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='aimud-bench-')
+    shutil.copy(os.path.join(HERE, 'game.txt'), workdir)
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump({'api_endpoint': 'http://127.0.0.1:8765/v1/chat/completions',
+                   'models': {'story_continuation': 'mock', 'keyword_extraction': 'mock'}}, f)
+    os.chdir(workdir)
+    sys.path.insert(0, HERE)
+
+    from mock_llm_server import start_mock_server
+    mock = start_mock_server(port=8765, token_delay=args.token_delay)
+    if args.mode == 'async':
+        import async_server as game_server
+    else:
+        import server as game_server
+    threading.Thread(target=game_server.start_server, daemon=True).start()
+    time.sleep(0.5)
+
+    streamer = Player('streamer', streaming=True)
+    waiter = Player('waiter', streaming=False)
+    time.sleep(0.2)
+
+    results = {'streaming': [], 'whole': []}
+    for i in range(args.actions):
+        start = time.perf_counter()
+        send_frame(streamer.sock, f'look around #{i}')
+        deadline = start + 60
+        while time.perf_counter() < deadline:
+            s, w = streamer.story_timing(start), waiter.story_timing(start)
+            if s and w:
+                results['streaming'].append(s)
+                results['whole'].append(w)
+                break
+            time.sleep(0.01)
+        for world in game_server.worlds.loaded():
+            world.keyword_pipeline.join(timeout=60)  # Let keyword extraction finish before the next action
+
+    print(f"{args.actions} actions, {args.mode} server, {args.token_delay * 1000:.0f} ms per streamed chunk")
+    print(f"{'player':<10}{'TTFB ms (median)':>18}{'complete ms (median)':>22}")
+    for name, timings in results.items():
+        print(f"{name:<10}{statistics.median(t[0] for t in timings) * 1000:>18.0f}"
+              f"{statistics.median(t[1] for t in timings) * 1000:>22.0f}")
+
+    game_server.stop_server()
+    mock.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Check that a burst of small frames reaches a client without getting it evicted.
+
+A login storm or a streamed story queues many tiny frames for one client at once. The outbox merges
+them into scatter-gather writes, and a write of more buffers than IOV_MAX fails with EMSGSIZE, which
+used to look like a dead socket and evicted a healthy client. This queues --frames tiny frames on an
+Outbox (threaded server) and on an AsyncOutbox (asyncio server) over a local socket pair, reads them
+back, and checks that every frame arrived, in order, and that nobody was evicted.
+
+It also checks the opposite case: a client that stops reading must be evicted once a write has been
+stuck for the send deadline, even when nothing else is queued for it that could notice the stall.
+
+    python check_outbox.py --frames 5000
+"""
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+
+from outbox import Outbox, AsyncOutbox
+from protocol import FrameReader, IOV_MAX
+
+
+def read_all(sock, count) -> list:
+    """ Read `count` frames from `sock`, or as many as arrive before it goes quiet for a few seconds. """
+    sock.settimeout(5)
+    reader = FrameReader(sock)
+    messages = []
+    try:
+        while len(messages) < count:
+            message = reader.read()
+            if message is None:
+                break
+            messages.append(message)
+    except socket.timeout:
+        pass
+    return messages
+
+def check_threaded(count) -> tuple:
+    server_sock, client_sock = socket.socketpair()
+    outbox = Outbox(server_sock, name='threaded')
+    for i in range(count):
+        outbox.send(f'[player{i} logs in.]')
+    messages = read_all(client_sock, count)
+    outbox.close()
+    server_sock.close()
+    client_sock.close()
+    return messages, outbox.evicted
+
+def check_async(count) -> tuple:
+    server_sock, client_sock = socket.socketpair()
+    result = {}
+
+    async def run():
+        _, writer = await asyncio.open_connection(sock=server_sock)
+        outbox = AsyncOutbox(writer, name='async')
+        for i in range(count):
+            outbox.send(f'[player{i} logs in.]')
+        await outbox.close()
+        result['evicted'] = outbox.evicted
+        writer.close()
+
+    reading = threading.Thread(target=lambda: result.setdefault('messages', read_all(client_sock, count)))
+    reading.start()
+    asyncio.run(run())
+    reading.join()
+    client_sock.close()
+    return result['messages'], result['evicted']
+
+
+def check_stalled(deadline) -> tuple:
+    """ Fill the socket of a client that never reads, queue nothing more, and return (seconds until evicted, reason). """
+    server_sock, client_sock = socket.socketpair()
+    outbox = Outbox(server_sock, name='stalled', send_deadline=deadline)
+    start = time.monotonic()
+    for _ in range(12):
+        outbox.send('x' * 60000)  # Far more than the socket buffers hold
+    while not outbox.evicted and time.monotonic() - start < deadline + 5:
+        time.sleep(0.05)
+    seconds = time.monotonic() - start
+    outbox.close(timeout=1)
+    server_sock.close()
+    client_sock.close()
+    return seconds, outbox.evicted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--frames', type=int, default=4 * IOV_MAX, help=f'Frames queued at once (default 4 x IOV_MAX = {4 * IOV_MAX}).')
+    args = parser.parse_args()
+
+    expected = [f'[player{i} logs in.]' for i in range(args.frames)]
+    failed = False
+    for name, check in (('threaded', check_threaded), ('async', check_async)):
+        messages, evicted = check(args.frames)
+        ok = messages == expected and not evicted
+        failed = failed or not ok
+        print(f'{name:<9} {len(messages)} of {args.frames} frames received, '
+              f'{"evicted: " + evicted if evicted else "not evicted"}: {"ok" if ok else "FAILED"}')
+    seconds, evicted = check_stalled(deadline=1.0)
+    ok = bool(evicted) and 'stalled' in evicted
+    failed = failed or not ok
+    outcome = f'evicted after {seconds:.1f}s: {evicted}' if evicted else 'never evicted'
+    print(f'{"stalled":<9} {outcome}: {"ok" if ok else "FAILED"}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""Kill a game writer at random points and check that the world always comes back intact.
+
+A writer subprocess plays turns against a scratch world as fast as it can: every turn appends a
+progress record, every third one also adds a keyword, and the game file is rewritten every few
+turns. After each turn it reports the turn on stdout, and after every sync of the progress log or
+the keyword store (its own, or the state writer's) the last turn the sync covered. The writer is SIGKILLed at a random moment, the world is reopened and checked,
+and the next round carries on from whatever was recovered:
+
+  - the game file parses and the progress log and index agree (tail_text matches the full text)
+  - turns are numbered 0..n-1 with the text the writer wrote for them
+  - every turn the writer reported is there, and so is every keyword it added
+  - every keyword has the description of its turn, and none is from a turn the writer never reached
+
+With --tear the files are also cut back to a random length after the kill, down to what the
+last reported sync covered, to imitate a power loss that drops whatever was not fsynced yet:
+the progress log and its index are truncated, and so is the keyword store's write-ahead log
+(a sync checkpoints it into the database file, so none of the log has to survive).
+Then only the synced turns and keywords have to survive.
+
+    python check_recovery.py --rounds 50 --tear
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from game_state import GameState
+from progress_log import INDEX_ENTRY
+
+SYNC_EVERY = 25  # Turns between the writer's explicit journal syncs
+
+
+def turn_text(turn: int) -> str:
+    # Non-ASCII text, so character and byte lengths differ
+    return f"Turn {turn}: the lantern flickers " + "é" * (turn * 7 % 50) + "." * (turn * 13 % 300)
+
+def keyword_text(turn: int) -> str:
+    return f"Seen on turn {turn}"
+
+def writer(path: str):
+    state = GameState(path, flush_interval=0.01, dirty_threshold=3, sync_interval=0.05)
+    output = threading.Lock()
+
+    def report(line):
+        with output:  # The state writer thread reports its syncs too
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    # Report every sync of the log and of the keyword store, whoever makes it, with the last turn it covered
+    sync = state.progress.sync
+    def reporting_sync():
+        with state.progress.lock:
+            last = len(state.progress) - 1
+            synced = sync()
+            if synced:
+                report(f"synced {last}")
+            return synced
+    state.progress.sync = reporting_sync
+
+    keyword_sync = state.keywords.sync
+    last_keyword = -1  # Last turn whose keyword was committed, in this run
+    def reporting_keyword_sync():
+        last = last_keyword  # Read first: a keyword committed meanwhile is synced too, just not reported
+        synced = keyword_sync()
+        if synced and last >= 0:
+            report(f"keywords {last}")
+        return synced
+    state.keywords.sync = reporting_keyword_sync
+
+    state.start()
+    turn = len(state.progress)
+    report(f"ready {turn}")
+    while True:
+        state.progress.append(turn_text(turn), author="writer", action=f"act {turn}")
+        if turn % 3 == 0:
+            state.update_keywords({f"Keyword{turn}": keyword_text(turn)})
+            last_keyword = turn
+        state["last_turn"] = turn
+        report(f"turn {turn}")
+        if turn % SYNC_EVERY == 0:
+            state.sync()
+        turn += 1
+
+
+def run_writer(path: str, seconds: float) -> tuple:
+    """
+    Let the writer run for `seconds`, SIGKILL it, and return (first turn, last turn reported, last turn synced,
+    last turn whose keyword was synced).
+    """
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--writer", path],
+                               stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    ready, _, first = process.stdout.readline().strip().partition(" ")
+    if ready != "ready":  # The clock starts once the world is open
+        process.wait()
+        raise RuntimeError("the writer did not start")
+    reported = {"turn": -1, "synced": -1, "keywords": -1}
+
+    def read():
+        for line in process.stdout:
+            kind, _, turn = line.strip().partition(" ")
+            if kind in reported and turn.isdigit():
+                reported[kind] = max(reported[kind], int(turn))
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(seconds)
+    process.send_signal(signal.SIGKILL)
+    process.wait()
+    reader.join()
+    return int(first), reported["turn"], reported["synced"], reported["keywords"]
+
+def tear(directory: str, synced: int, rng: random.Random):
+    """
+    Cut the progress log and its index back to a random length no shorter than the synced turns, and the
+    keyword store's write-ahead log to any length. A sync checkpoints that log into the database file, so
+    what it still holds was never synced; SQLite recovers the whole commits left in what remains.
+    """
+    log_path = os.path.join(directory, "game.progress.jsonl")
+    keep = 0
+    with open(log_path, "rb") as f:
+        for _ in range(synced + 1):
+            keep += len(f.readline())
+    for path, minimum in ((log_path, keep), (log_path + ".idx", (synced + 1) * INDEX_ENTRY.size)):
+        size = os.path.getsize(path)
+        if size > minimum:
+            with open(path, "r+b") as f:
+                f.truncate(rng.randint(minimum, size))
+    store_path = os.path.join(directory, "game.keywords.db")
+    if os.path.exists(store_path + "-wal"):
+        with open(store_path + "-wal", "r+b") as f:
+            f.truncate(rng.randint(0, os.path.getsize(store_path + "-wal")))
+    if os.path.exists(store_path + "-shm"):
+        os.remove(store_path + "-shm")  # Shared memory is lost with the power; SQLite rebuilds it from the log
+
+def check(path: str, required: int, keyword_turns: list, reached: int) -> int:
+    """
+    Reopen the world, check it, and return the number of turns in it. The first `required` turns must have
+    survived, and so must the keywords of `keyword_turns`; no keyword may be from a turn after `reached`.
+    """
+    with open(path) as f:
+        last_turn = json.load(f).get("last_turn", -1)
+    state = GameState(path)
+    try:
+        turns = len(state.progress)
+        assert turns >= required, f"{required} turns were written, only {turns} recovered"
+        assert last_turn < turns, f"the game file mentions turn {last_turn}, the log has {turns} turns"
+        records = state.progress.read()
+        assert [record["turn"] for record in records] == list(range(turns)), "turns are not numbered in order"
+        for record in records:
+            assert record["text"] == turn_text(record["turn"]), f"turn {record['turn']} has the wrong text"
+        text = " ".join(record["text"] for record in records)
+        assert state.progress.char_length() == len(text), "the index disagrees with the log on the text length"
+        for chars in (1, 500, 5000, len(text)):
+            assert state.progress.tail_text(chars) == text[-chars:], "tail_text disagrees with the log"
+        missing = [turn for turn in keyword_turns if f"Keyword{turn}" not in state.keywords]
+        assert not missing, f"keywords of turns {missing[:5]} were lost"
+        for name in state.keywords:
+            turn = int(name[len("Keyword"):])
+            assert turn % 3 == 0 and turn <= reached, f"keyword {name} was never added"
+            assert state.keywords[name] == keyword_text(turn), f"keyword {name} has the wrong description"
+        return turns
+    finally:
+        state.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=30)
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="Shortest time the writer runs before it is killed.")
+    parser.add_argument("--max-seconds", type=float, default=0.5, help="Longest time the writer runs before it is killed.")
+    parser.add_argument("--tear", action="store_true", help="Also drop a random amount of unsynced data after each kill.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--writer", metavar="PATH", help=argparse.SUPPRESS)  # Run as the writer subprocess
+    args = parser.parse_args()
+    if args.writer:
+        writer(args.writer)
+        return
+
+    rng = random.Random(args.seed)
+    directory = tempfile.mkdtemp(prefix="aimud-recovery-")
+    path = os.path.join(directory, "game.txt")
+    required = 0  # Turns that must survive: reported ones, or with --tear the synced ones, over all rounds so far
+    # Turns whose keyword must survive: reported ones, or with --tear the ones a keyword sync covered. A turn
+    # killed before it reported may lack its keyword, and a turn recovered without it never gets it later.
+    keyword_turns = []
+    reached = -1  # Last turn any writer got to; it may have added the keyword of the next one before it was killed
+    try:
+        for round_number in range(1, args.rounds + 1):
+            first, reported, synced, keywords_synced = run_writer(path, rng.uniform(args.min_seconds, args.max_seconds))
+            if args.tear:
+                # A sync covers the turns of earlier rounds as well, and those are on disk anyway: checking closed the world
+                tear(directory, max(synced, first - 1), rng)
+            required = max(required, (synced if args.tear else reported) + 1)
+            last_keyword = keywords_synced if args.tear else reported
+            keyword_turns.extend(turn for turn in range(first, last_keyword + 1) if turn % 3 == 0)
+            reached = max(reached, reported + 1)
+            turns = check(path, required, keyword_turns, reached)
+            print(f"round {round_number}: writer reached turn {reported} (synced {synced}, keywords {keywords_synced}), {turns} turns recovered")
+    except AssertionError as e:
+        sys.exit(f"Recovery check failed, world kept in {directory}: {e}")
+    shutil.rmtree(directory)
+    print(f"All {args.rounds} rounds recovered cleanly.")
+
+
+if __name__ == "__main__":
+    main()
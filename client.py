@@ -1,58 +1,87 @@
 import socket
 import threading
 
-def send_long_data(sock, data):
-    """ Send long data reliably over a socket connection. """
-    data = data.encode('utf-8')  # Ensure the data is in bytes
-    length = len(data)
-    sock.send(length.to_bytes(4, byteorder='big'))  # Send the length of data first
-    sock.send(data)  # Send the data
-
-def recv_long_data(sock):
-    """ Receive long data reliably from a socket connection. """
-    length_bytes = sock.recv(4)  # First receive 4 bytes for the length
-    if not length_bytes:
-        return None
-    length = int.from_bytes(length_bytes, byteorder='big')  # Convert bytes to int
-    data = b''
-    while len(data) < length:
-        packet = sock.recv(length - len(data))  # Receive the remaining bytes
-        if not packet:
-            break  # Connection closed
-        data += packet
-    return data.decode('utf-8')
-
-def listen_for_messages(sock):
+from protocol import FrameReader, send_frame, STREAM_DELTA
+
+# Server text that is not tagged "[...]" but is not a story turn either: prompts, login replies and story pages
+# (a page is followed by a session frame that carries the turn count)
+SERVER_TEXT = ('Welcome to the Game!', 'Enter username', 'Enter password', 'Registration successful', 'Username already exists',
+               'Login failed', 'Login successful!', 'Session resumed!', 'Session expired')
+
+class Session:
+    """ What the client needs to resume after a dropped connection: the session token and the turns seen so far. """
+
+    def __init__(self):
+        self.token = None
+        self.turn = 0
+        self.connected = threading.Event()
+
+    def track(self, message):
+        """ Follow the session frames and count every story turn received since the last one. """
+        if message.startswith('[Session: '):
+            self.token, turn = message[len('[Session: '):-1].split()
+            self.turn = int(turn)
+        elif message.startswith('Session expired'):
+            self.token, self.turn = None, 0  # Logging in again starts a new session
+        elif self.token and (message == STREAM_DELTA or not message.startswith(('[', STREAM_DELTA) + SERVER_TEXT)):
+            self.turn += 1  # A whole story segment, or the end of a streamed one
+
+def listen_for_messages(sock, reader, session):
     """ Continuously listen for messages from the server and print them. """
     try:
         while True:
-            message = recv_long_data(sock)
+            message = reader.read()
             if message:
+                session.track(message)
+            if message and message.startswith('[Capabilities: '):
+                continue  # Handshake reply, nothing to show
+            if message == STREAM_DELTA:
+                print()  # End of a streamed story segment
+            elif message and message.startswith(STREAM_DELTA):
+                print(message[len(STREAM_DELTA):], end='', flush=True)
+            elif message:
                 print(message)
             else:
                 break  # Stop listening if no data is received (connection closed)
+    except OSError:
+        pass
     finally:
+        session.connected.clear()
         sock.close()
 
-def main():
+def connect(host, port, session):
+    """ Open a connection; with a session token, resume the session instead of showing the login prompt. """
     client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    host = '127.0.0.1'
-    port = 12345
-
     client_socket.connect((host, port))
-    response = recv_long_data(client_socket)
-    print(response)
+    reader = FrameReader(client_socket)
+    response = reader.read()
+    send_frame(client_socket, "C zlib")  # Ask for compressed frames; the reader inflates them
+    if session.token:
+        send_frame(client_socket, f"S {session.token} {session.turn}")
+    else:
+        print(response)
+    session.connected.set()
 
     # Start a thread to continuously listen for messages
-    threading.Thread(target=listen_for_messages, args=(client_socket,), daemon=True).start()
+    threading.Thread(target=listen_for_messages, args=(client_socket, reader, session), daemon=True).start()
+    return client_socket
+
+def main():
+    host = '127.0.0.1'
+    port = 12345
+    session = Session()
+    client_socket = connect(host, port, session)
 
     try:
         while True:
             message = input("")  # Prompt for user input
+            if not session.connected.is_set() and session.token:
+                print("[Connection lost; resuming the session...]")
+                client_socket = connect(host, port, session)
             if message.lower() == 'quit':  # Allow command to break the loop and close connection
-                send_long_data(client_socket, message)
+                send_frame(client_socket, message)
                 break
-            send_long_data(client_socket, message)
+            send_frame(client_socket, message)
     except KeyboardInterrupt:
         pass  # Handle Ctrl+C gracefully
 
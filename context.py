@@ -0,0 +1,193 @@
+"""
+Token-budgeted prompt context.
+
+A prompt is filled in priority order until the model's token budget is used up: first the game's
+overall context, then the rolling summary of the older story (see summary.py), then the most recent
+story progress, then keyword notes in the order they were ranked. Whatever does not fit is trimmed
+(summary and progress from the old end, notes from the low-ranked end) and reported, so prompt size
+stays predictable per model whatever the language of the game.
+
+Budgets come from the "context_budgets" key of config.json, per model with a "default" entry:
+
+    "context_budgets": {
+        "default": {"tokens": 3000, "progress_share": 0.6, "tokenizer": "estimate"},
+        "gpt-4-turbo": {"tokens": 8000, "tokenizer": "tiktoken:cl100k_base"}
+    }
+
+Tokens are counted by a pluggable tokenizer: "estimate" (the default, a local heuristic that counts
+CJK characters one by one and other words by length), "chars", "tiktoken:<encoding>" when tiktoken
+is installed, or any function registered with `register_tokenizer`.
+"""
+import re
+import math
+
+DEFAULT_BUDGET = {
+    "tokens": 3000,  # Total prompt tokens for the context parts below plus the instructions
+    "progress_share": 0.6,  # Largest share of the tokens left after overall_context that progress may take
+    "summary_share": 0.25,  # Largest share of the tokens left after overall_context that the story summary may take
+    "reserve": 100,  # Tokens kept for the fixed instructions of the prompt template
+    "tokenizer": "estimate",
+}
+CHARS_PER_TOKEN = 4  # How "text_window_size" (characters of English text) is turned into tokens
+MAX_CHARS_PER_TOKEN = 16  # Upper bound used to decide how much progress text to read before counting its tokens
+
+_CJK = '　-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯'  # CJK scripts and full-width forms
+_TOKEN_PATTERN = re.compile(rf'[{_CJK}]|[^\s{_CJK}\W]+|[^\s\w]', re.UNICODE)
+
+
+def estimate_tokens(text: str) -> int:
+    """ Local token estimate: one token per CJK character or punctuation mark, one per 4 letters of a word. """
+    count = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        piece = match.group()
+        count += math.ceil(len(piece) / CHARS_PER_TOKEN) if piece[0].isalnum() and len(piece) > 1 else 1
+    return count
+
+_tokenizers = {
+    "estimate": estimate_tokens,
+    "chars": len,
+}
+
+
+def register_tokenizer(name: str, count):
+    """ Make `count(text) -> int` available as tokenizer `name` in config.json. """
+    _tokenizers[name] = count
+
+def get_tokenizer(name: str):
+    """ Return the counting function of tokenizer `name`, falling back to "estimate" if it is unavailable. """
+    if name in _tokenizers:
+        return _tokenizers[name]
+    if name.startswith("tiktoken:"):
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(name.split(":", 1)[1])
+        except (ImportError, ValueError) as e:
+            print(f"Tokenizer {name} unavailable ({e}); using the estimate instead.")
+            _tokenizers[name] = estimate_tokens
+        else:
+            _tokenizers[name] = lambda text: len(encoding.encode(text, disallowed_special=()))
+        return _tokenizers[name]
+    print(f"Unknown tokenizer {name}; using the estimate instead.")
+    return estimate_tokens
+
+def budget_for(config: dict, model: str) -> dict:
+    """ The context budget of `model`: DEFAULT_BUDGET, overridden by the "default" and then the model's own entry. """
+    budgets = config.get("context_budgets", {})
+    return {**DEFAULT_BUDGET, **budgets.get("default", {}), **budgets.get(model, {})}
+
+
+class Context:
+    """ The parts of a prompt that fit the budget, their token counts, and what was trimmed to get there. """
+
+    def __init__(self, overall_context, progress, notes, tokens, budget, trimmed, summary=""):
+        self.overall_context = overall_context
+        self.summary = summary
+        self.progress = progress
+        self.notes = notes
+        self.tokens = tokens  # Part name -> tokens used
+        self.budget = budget
+        self.trimmed = trimmed  # Part name -> what was cut: tokens of text, or the dropped note keys
+
+    def report(self) -> str:
+        used = sum(self.tokens.values())
+        line = f"{used}/{self.budget} tokens (" + ", ".join(f"{k} {v}" for k, v in self.tokens.items()) + ")"
+        if self.trimmed:
+            cuts = []
+            for part, cut in self.trimmed.items():
+                cuts.append(f"{len(cut)} {part}" if isinstance(cut, list) else f"{cut} tokens of {part}")
+            line += "; trimmed " + ", ".join(cuts)
+        return line
+
+
+def _longest_prefix(text, limit, count):
+    """ Longest prefix of `text` that counts at most `limit` tokens (binary search over its length). """
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count(text[:mid]) <= limit:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
+def tail_tokens(text, limit, count):
+    """ Longest suffix of `text` that counts at most `limit` tokens, starting at a word boundary where there is one close by. """
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high) // 2
+        if count(text[mid:]) <= limit:
+            high = mid
+        else:
+            low = mid + 1
+    if 0 < low < len(text) and not text[low - 1].isspace():
+        space = text.find(" ", low, low + 32)
+        if space != -1:
+            low = space + 1
+    return text[low:]
+
+def note_text(key, value) -> str:
+    """ How one keyword note appears in the prompt. """
+    return f"{key}: {value}, "
+
+def build_context(budget: dict, overall_context: str = "", progress: str = "", notes: dict = None,
+                  fixed: str = "", max_progress_tokens: int = None, summary: str = "") -> Context:
+    """
+    Fill the token budget in priority order: overall_context, story summary, recent progress, then ranked keyword notes.
+
+    Args:
+    budget (dict): The model's budget, as returned by `budget_for`.
+    overall_context (str): The game's overall context; cut at the end only if it alone exceeds the budget.
+    progress (str): Recent story text, newest last; trimmed from the start.
+    notes (dict): Keyword notes, highest ranked first; the lowest ranked ones are dropped first.
+    fixed (str): Text that is always sent (e.g. the player's input), counted against the budget.
+    max_progress_tokens (int): Optional cap on the progress tokens, on top of the budget's "progress_share".
+    summary (str): Rolling summary of the story before `progress`, oldest first; trimmed from the start, within "summary_share".
+
+    Returns:
+    Context: The parts that fit, with token counts and a record of what was trimmed.
+    """
+    count = get_tokenizer(budget["tokenizer"])
+    notes = notes or {}
+    total = budget["tokens"]
+    remaining = total - budget["reserve"] - count(fixed)
+    tokens, trimmed = {}, {}
+
+    overall_tokens = count(overall_context)
+    if overall_tokens > remaining:
+        overall_context = _longest_prefix(overall_context, max(remaining, 0), count)
+        trimmed["overall_context"] = overall_tokens - count(overall_context)
+    tokens["overall_context"] = count(overall_context)
+    remaining -= tokens["overall_context"]
+
+    if summary:
+        summary_limit = int(max(remaining, 0) * budget["summary_share"])
+        summary_tokens = count(summary)
+        if summary_tokens > summary_limit:
+            summary = tail_tokens(summary, summary_limit, count)
+            trimmed["summary"] = summary_tokens - count(summary)
+        tokens["summary"] = count(summary)
+        remaining -= tokens["summary"]
+
+    progress_limit = int(max(remaining, 0) * budget["progress_share"]) if notes else max(remaining, 0)
+    if max_progress_tokens is not None:
+        progress_limit = min(progress_limit, max_progress_tokens)
+    progress_tokens = count(progress)
+    if progress_tokens > progress_limit:
+        progress = tail_tokens(progress, progress_limit, count)
+        trimmed["progress"] = progress_tokens - count(progress)
+    tokens["progress"] = count(progress)
+    remaining -= tokens["progress"]
+
+    kept, dropped, notes_tokens = {}, [], 0
+    for key, value in notes.items():
+        cost = count(note_text(key, value))
+        if notes_tokens + cost <= remaining:
+            kept[key] = value
+            notes_tokens += cost
+        else:
+            dropped.append(key)  # Keep trying: a lower ranked but shorter note may still fit
+    if dropped:
+        trimmed["notes"] = dropped
+    tokens["notes"] = notes_tokens
+
+    return Context(overall_context, progress, kept, tokens, total, trimmed, summary=summary)
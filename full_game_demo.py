@@ -4,31 +4,20 @@ import socket
 import threading
 import time
 
-def send_long_data(sock, data):
-    data = data.encode('utf-8')
-    length = len(data)
-    sock.send(length.to_bytes(4, byteorder='big'))
-    sock.send(data)
-
-def recv_long_data(sock):
-    sock.settimeout(90)
-    length_bytes = sock.recv(4)
-    if not length_bytes:
+from protocol import FrameReader, send_frame
+
+def recv_long_data(reader, timeout=90):
+    reader.sock.settimeout(timeout)
+    try:
+        return reader.read()
+    except socket.timeout:
         return None
-    length = int.from_bytes(length_bytes, byteorder='big')
-    data = b''
-    while len(data) < length:
-        packet = sock.recv(length - len(data))
-        if not packet:
-            break
-        data += packet
-    return data.decode('utf-8')
 
-def listen_for_messages(sock, messages_list, running):
+def listen_for_messages(reader, messages_list, running):
     """Background thread to collect server messages"""
     while running[0]:
         try:
-            message = recv_long_data(sock)
+            message = recv_long_data(reader)
             if message:
                 messages_list.append(('server', message, time.time()))
         except Exception as e:
@@ -53,24 +42,25 @@ def main():
 
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client.connect(('127.0.0.1', 12345))
+    reader = FrameReader(client)
 
     messages = []
     running = [True]
 
     # Welcome
-    welcome = recv_long_data(client)
+    welcome = recv_long_data(reader)
     print(f"\n📨 SERVER: {welcome}\n")
 
     # Login
     print("🔐 Logging in as test_player...")
-    send_long_data(client, "L")
-    print(recv_long_data(client))
-    send_long_data(client, "test_player")
-    print(recv_long_data(client))
-    send_long_data(client, "test123")
+    send_frame(client, "L")
+    print(recv_long_data(reader))
+    send_frame(client, "test_player")
+    print(recv_long_data(reader))
+    send_frame(client, "test123")
 
     # Get initial game state
-    initial_state = recv_long_data(client)
+    initial_state = recv_long_data(reader)
     print("\n" + "="*80)
     print("📖 INITIAL GAME STATE:")
     print("="*80)
@@ -78,7 +68,7 @@ def main():
     print("="*80)
 
     # Start listening thread
-    listener = threading.Thread(target=listen_for_messages, args=(client, messages, running), daemon=True)
+    listener = threading.Thread(target=listen_for_messages, args=(reader, messages, running), daemon=True)
     listener.start()
 
     time.sleep(2)
@@ -94,7 +84,7 @@ def main():
         print(f"⏳ Sending action to AI... (Please wait 15-30 seconds)")
         print(f"🤖 AI Model: Google Gemini 2.5 Pro")
 
-        send_long_data(client, action)
+        send_frame(client, action)
 
         # Wait for response
         start_time = time.time()
@@ -140,7 +130,7 @@ def main():
     print("="*80)
 
     running[0] = False
-    send_long_data(client, 'quit')
+    send_frame(client, 'quit')
     time.sleep(1)
     client.close()
 
@@ -0,0 +1,290 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from progress_log import ProgressLog
+from keyword_store import KeywordStore
+from keywords import KeywordGraph
+from metrics import span
+
+
+def default_game_state() -> dict:
+    return {"overall_context": "", "keywords": {}, "progress": ""}
+
+
+class GameState:
+    """
+    In-memory, authoritative copy of a game file with write-behind persistence.
+
+    Callers read and mutate the state in place (under `lock` when other threads may touch it)
+    and call `mark_dirty()` afterwards. Once started, the shared `state_flusher` writes the state
+    to disk at most `flush_interval` seconds after its first unflushed mutation, or earlier once
+    `dirty_threshold` mutations have piled up.
+    Flushes write a temporary file and atomically rename it over the game file, so a crash
+    mid-write never leaves a truncated game behind.
+
+    The story progress is not part of the JSON file: it lives in an append-only `ProgressLog`
+    (`progress`), and the game file only keeps its file name under "progress_log". A game file
+    that still carries an inline "progress" string is migrated into a log on first load.
+
+    Keywords are not part of the JSON file either: they live in a KeywordStore (`keywords`), an SQLite
+    table next to the game file named under "keyword_store", so an update writes only the changed rows.
+    An inline "keywords" dictionary is merged into the store when the game is loaded. The keyword graph is kept
+    alongside in `keyword_graph` and is refreshed only for the keys that change; go through
+    `update_keywords` so the store and the graph stay in step.
+
+    The progress log and the keyword store are the journal of the game: turns and keyword changes are
+    written to them as they happen, but only handed to the OS. The same writer forces them to disk as a
+    group, at most `sync_interval` seconds after the first unsynced write, so a power loss costs at most
+    that window and a turn never waits for the disk. On startup the progress index is loaded as the
+    checkpoint and only the log records written after it are replayed (see `ProgressLog`).
+
+    Args:
+    path (str): Path of the JSON game file (e.g. "game.txt").
+    flush_interval (float): Maximum number of seconds a mutation may stay unflushed.
+    dirty_threshold (int): Number of mutations that triggers an early flush.
+    sync_interval (float): Maximum number of seconds journal writes may stay unsynced once the writer runs.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5.0, dirty_threshold: int = 20, sync_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.dirty_threshold = dirty_threshold
+        self.sync_interval = sync_interval
+        self.lock = threading.RLock()  # Guards `data` and the dirty counter
+        self._flush_lock = threading.Lock()  # Serializes writers of the file itself
+        self._dirty = 0
+        self._dirty_since = None  # Monotonic time of the first unflushed mutation
+        self._flusher = None
+        self.data = self._read()
+        self.progress = self._open_progress_log()
+        self.keywords = self._open_keyword_store()
+        with span("keyword_graph"):
+            self.keyword_graph = KeywordGraph(self.keywords)
+
+    def _read(self) -> dict:
+        if os.path.exists(self.path):
+            with open(self.path, "r") as file:
+                return json.load(file)
+        return default_game_state()
+
+    def _open_progress_log(self) -> ProgressLog:
+        base_dir = os.path.dirname(self.path)
+        if "progress_log" in self.data:
+            return ProgressLog(os.path.join(base_dir, self.data["progress_log"]))
+
+        log_name = os.path.splitext(os.path.basename(self.path))[0] + ".progress.jsonl"
+        log = self.progress = ProgressLog(os.path.join(base_dir, log_name))  # flush() below syncs it
+        initial_progress = self.data.pop("progress", "")
+        if initial_progress and not len(log):
+            log.append(initial_progress, author="narrator")
+        self.data["progress_log"] = log_name
+        self.mark_dirty()
+        self.flush()  # Persist the pointer right away so the inline progress is never imported twice
+        return log
+
+    def _open_keyword_store(self) -> KeywordStore:
+        base_dir = os.path.dirname(self.path)
+        if "keyword_store" in self.data and "keywords" not in self.data:
+            return KeywordStore(os.path.join(base_dir, self.data["keyword_store"]))
+
+        store_name = self.data.get("keyword_store") or os.path.splitext(os.path.basename(self.path))[0] + ".keywords.db"
+        store = KeywordStore(os.path.join(base_dir, store_name))
+        store.update_many(self.data.pop("keywords", {}))  # Keywords edited into the game file win over stored ones
+        self.data["keyword_store"] = store_name
+        self.mark_dirty()
+        self.flush()  # Persist the pointer right away so the inline keywords are never imported twice
+        return store
+
+    def __getitem__(self, key):
+        with self.lock:
+            return self.data[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.mark_dirty()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def update_keywords(self, new_keywords: dict):
+        """ Write added or changed keywords to the store and refresh only their edges in the graph. """
+        with self.lock:
+            changed = self.keywords.update_many(new_keywords)
+            with span("keyword_graph"):
+                self.keyword_graph.refresh(self.keywords, changed)
+
+    def mark_dirty(self, count: int = 1):
+        """ Record `count` in-place mutations; wakes the writer early once the threshold is reached. """
+        with self.lock:
+            self._dirty += count
+            if self._dirty_since is None:
+                self._dirty_since = time.monotonic()
+            if self._dirty >= self.dirty_threshold and self._flusher is not None:
+                self._flusher.wake()
+
+    @property
+    def dirty(self) -> int:
+        return self._dirty
+
+    def flush_due(self):
+        """ Seconds until the writer should flush this state (0 if it is due now), or None if it is clean. """
+        with self.lock:
+            if not self._dirty:
+                return None
+            if self._dirty >= self.dirty_threshold:
+                return 0.0
+            return max(0.0, self._dirty_since + self.flush_interval - time.monotonic())
+
+    def flush(self) -> bool:
+        """ Write the state to disk now if it has unflushed changes. Returns True if a write happened. """
+        with self._flush_lock:
+            with self.lock:
+                if not self._dirty:
+                    return False
+                payload = json.dumps(self.data, indent=4)
+                self._dirty = 0
+                self._dirty_since = None
+            tmp_path = self.path + ".tmp"
+            try:
+                # The game file refers to turns (e.g. what the summary covers), so it must never reach the disk before them
+                self.progress.sync()
+                with span("state_save"), open(tmp_path, "w") as file:
+                    file.write(payload)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(tmp_path, self.path)
+                _fsync_directory(self.path)  # Make the rename itself durable
+            except OSError:
+                self.mark_dirty()  # Keep the changes pending so the next flush retries them
+                raise
+            return True
+
+    def sync_due(self):
+        """ Seconds until the writer should sync the journal (0 if it is due now), or None if nothing is unsynced. """
+        pending = [since for since in (self.progress.unsynced_since, self.keywords.unsynced_since) if since is not None]
+        if not pending:
+            return None
+        return max(0.0, min(pending) + self.sync_interval - time.monotonic())
+
+    def sync(self) -> bool:
+        """ Force the journal (progress log and keyword store) to disk now. Returns True if anything was synced. """
+        synced = self.progress.sync()
+        return self.keywords.sync() or synced
+
+    def snapshot(self, directory: str) -> list:
+        """
+        Write a copy of the game (game file, progress log and keyword store) into `directory`, under the
+        same file names, so the copy can be loaded as a game of its own. Returns the paths written.
+        """
+        os.makedirs(directory, exist_ok=True)
+        game_path = os.path.join(directory, os.path.basename(self.path))
+        log_path = os.path.join(directory, self.data["progress_log"])
+        store_path = os.path.join(directory, self.data["keyword_store"])
+        with self.lock:
+            with open(game_path, "w") as file:
+                json.dump(self.data, file, indent=4)
+        # Each copy is taken under the lock of its own file, so none of them holds half a write
+        self.progress.snapshot(log_path)
+        self.keywords.backup(store_path)
+        return [game_path, log_path, log_path + ".idx", store_path]
+
+    def start(self, flusher=None):
+        """ Hand the state to a background writer, the process-wide `state_flusher` by default (idempotent). """
+        if self._flusher is None:
+            self._flusher = flusher or state_flusher
+            self._flusher.register(self)
+
+    def close(self):
+        """ Detach from the background writer and flush whatever is still dirty. """
+        if self._flusher is not None:
+            self._flusher.unregister(self)
+            self._flusher = None
+        self.flush()
+        self.progress.close()
+        self.keywords.close()
+
+
+def _fsync_directory(path: str):
+    """ Sync the directory entry of `path`, so a file renamed into place survives a power loss. """
+    if os.name != "posix":
+        return  # Directories cannot be opened for fsync elsewhere
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class StateFlusher:
+    """
+    One background writer thread for every started GameState in the process.
+
+    A server hosting hundreds of games needs no thread per game: the writer sleeps until the
+    earliest state is due (its flush interval elapsed, or its dirty threshold was reached) and
+    flushes the states that are due, one after the other. Journal syncs are scheduled the same way.
+    """
+
+    def __init__(self):
+        self._states = set()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def register(self, state: GameState):
+        with self._cond:
+            self._states.add(state)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="game-state-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def unregister(self, state: GameState):
+        with self._cond:
+            self._states.discard(state)
+
+    def wake(self):
+        """ Re-check the states now, e.g. because one of them reached its dirty threshold. """
+        with self._cond:
+            self._cond.notify()
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                states = list(self._states)
+            due, sync_due, timeout = [], [], None
+            for state in states:
+                for wait, pending in ((state.flush_due(), due), (state.sync_due(), sync_due)):
+                    if wait is None:
+                        continue
+                    if wait <= 0:
+                        pending.append(state)
+                    elif timeout is None or wait < timeout:
+                        timeout = wait
+            for state in due:
+                try:
+                    state.flush()
+                except OSError as e:
+                    print(f"Error saving game state {state.path}: {e}")
+            for state in sync_due:
+                try:
+                    with span("journal_sync"):
+                        state.sync()
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Error syncing the journal of {state.path}: {e}")
+            if not due and not sync_due:
+                with self._cond:
+                    self._cond.wait(min(timeout, 1.0) if timeout is not None else 1.0)  # Re-check newly dirtied states
+
+
+# Writes back every game of the process
+state_flusher = StateFlusher()
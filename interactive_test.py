@@ -4,31 +4,20 @@ import socket
 import threading
 import time
 
-def send_long_data(sock, data):
-    data = data.encode('utf-8')
-    length = len(data)
-    sock.send(length.to_bytes(4, byteorder='big'))
-    sock.send(data)
+from protocol import FrameReader, send_frame
 
-def recv_long_data(sock):
-    sock.settimeout(60)  # Long timeout for API calls
-    length_bytes = sock.recv(4)
-    if not length_bytes:
+def recv_long_data(reader, timeout=60):
+    reader.sock.settimeout(timeout)
+    try:
+        return reader.read()
+    except socket.timeout:
         return None
-    length = int.from_bytes(length_bytes, byteorder='big')
-    data = b''
-    while len(data) < length:
-        packet = sock.recv(length - len(data))
-        if not packet:
-            break
-        data += packet
-    return data.decode('utf-8')
 
-def listen_for_messages(sock, running):
+def listen_for_messages(reader, running):
     """Background thread to listen for server messages"""
     while running[0]:
         try:
-            message = recv_long_data(sock)
+            message = recv_long_data(reader)
             if message:
                 print(f"\n{'='*60}")
                 print("SERVER MESSAGE:")
@@ -47,28 +36,29 @@ def main():
 
     client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     client.connect(('127.0.0.1', 12345))
+    reader = FrameReader(client)
 
     # Welcome
-    print("\n" + recv_long_data(client))
+    print("\n" + recv_long_data(reader))
 
     # Login
-    send_long_data(client, "L")
-    print(recv_long_data(client))
+    send_frame(client, "L")
+    print(recv_long_data(reader))
 
-    send_long_data(client, "test_player")
-    print(recv_long_data(client))
+    send_frame(client, "test_player")
+    print(recv_long_data(reader))
 
-    send_long_data(client, "test123")
+    send_frame(client, "test123")
 
     # Get game state
-    response = recv_long_data(client)
+    response = recv_long_data(reader)
     print("\n" + "="*70)
     print(response)
     print("="*70)
 
     # Start listening thread
     running = [True]
-    listener = threading.Thread(target=listen_for_messages, args=(client, running), daemon=True)
+    listener = threading.Thread(target=listen_for_messages, args=(reader, running), daemon=True)
     listener.start()
 
     print("\n" + "="*70)
@@ -82,11 +72,11 @@ def main():
         try:
             action = input("\nYour action: ").strip()
             if action.lower() == 'quit':
-                send_long_data(client, 'quit')
+                send_frame(client, 'quit')
                 break
             if action:
                 print(f"\n[Sending action to server... please wait 10-30s for AI response]")
-                send_long_data(client, action)
+                send_frame(client, action)
                 time.sleep(1)  # Give server time to process
         except KeyboardInterrupt:
             break
@@ -0,0 +1,129 @@
+import threading
+from collections import deque, Counter
+
+
+class KeywordMatcher:
+    """
+    Aho–Corasick automaton over a set of keywords, for finding every keyword in a text in one pass.
+
+    Matching is case-insensitive in the same way as the old `key.lower() in text.lower()` loop and works
+    on characters, so Chinese (or any other unsegmented) keywords are found as plain substrings with no
+    tokenization or word boundaries involved. Overlapping and nested occurrences are all reported.
+
+    Keys can be added and removed at any time; the trie is extended in place and the failure links are
+    recomputed lazily before the next search.
+
+    Args:
+    keys (iterable): Initial keywords.
+    """
+
+    def __init__(self, keys=()):
+        self._lock = threading.RLock()
+        self._goto = [{}]  # Trie transitions, node 0 is the root
+        self._out = [None]  # Lowercased keyword that ends at each node, if any
+        self._fail = [0]
+        self._dict_link = [0]  # Nearest node on the failure chain that ends a keyword (0 = none)
+        self._originals = {}  # Lowercased keyword -> set of original keys with that spelling
+        self._stale = False
+        for key in keys:
+            self.add(key)
+
+    def __len__(self) -> int:
+        return sum(len(originals) for originals in self._originals.values())
+
+    def __contains__(self, key) -> bool:
+        return key in self._originals.get(key.lower(), ())
+
+    def add(self, key: str) -> None:
+        """ Add a keyword to the automaton. """
+        lowered = key.lower()
+        if not lowered:
+            return
+        with self._lock:
+            originals = self._originals.setdefault(lowered, set())
+            if key in originals:
+                return
+            originals.add(key)
+            node = 0
+            for ch in lowered:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._out.append(None)
+                    self._fail.append(0)
+                    self._dict_link.append(0)
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node] = lowered
+            self._stale = True
+
+    def remove(self, key: str) -> None:
+        """ Remove a keyword; its trie nodes are kept but no longer report a match. """
+        lowered = key.lower()
+        with self._lock:
+            originals = self._originals.get(lowered)
+            if not originals or key not in originals:
+                return
+            originals.discard(key)
+            if originals:
+                return
+            del self._originals[lowered]
+            node = 0
+            for ch in lowered:
+                node = self._goto[node][ch]
+            self._out[node] = None
+            self._stale = True
+
+    def _build(self) -> None:
+        """ Recompute failure and output links breadth-first over the whole trie. """
+        goto, out, fail, dict_link = self._goto, self._out, self._fail, self._dict_link
+        queue = deque()
+        for nxt in goto[0].values():
+            fail[nxt] = 0
+            dict_link[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                dict_link[nxt] = fail[nxt] if out[fail[nxt]] is not None else dict_link[fail[nxt]]
+                queue.append(nxt)
+        self._stale = False
+
+    def count(self, text: str) -> Counter:
+        """
+        Count the occurrences of every keyword in the text with a single scan.
+
+        Args:
+        text (str): The text to search within.
+
+        Returns:
+        Counter: Original keys mapped to the number of times they occur (keys that do not occur are absent).
+        """
+        with self._lock:
+            if self._stale:
+                self._build()
+            goto, out, fail, dict_link = self._goto, self._out, self._fail, self._dict_link
+            hits = Counter()
+            node = 0
+            for ch in text.lower():
+                while node and ch not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(ch, 0)
+                match = node if out[node] is not None else dict_link[node]
+                while match:
+                    hits[out[match]] += 1
+                    match = dict_link[match]
+            counts = Counter()
+            for lowered, n in hits.items():
+                for key in self._originals[lowered]:
+                    counts[key] = n
+            return counts
+
+    def find(self, text: str) -> set:
+        """ Return the set of keys that occur in the text. """
+        return set(self.count(text))
@@ -0,0 +1,202 @@
+"""
+SQLite-backed keyword dictionary.
+
+A game's keywords live in a table with one row per keyword (name, description, version, updated_at)
+and an FTS5 index over names and descriptions, instead of a dict that is re-serialized into the game
+file on every change. Updates touch only the rows that changed, and finding the descriptions that
+mention a keyword is an index lookup rather than a scan of every description.
+
+KeywordStore is a MutableMapping of name -> description, so code written against the plain keyword
+dict (spot_keywords, create_graph, KeywordGraph) works on it unchanged. Names are kept in memory (the
+keyword matcher needs them anyway); descriptions are read from the database when they are used.
+"""
+import time
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+TRIGRAM_MIN_LENGTH = 3  # Shorter keys cannot be looked up in a trigram index and are searched by a scan
+
+
+class KeywordStore(MutableMapping):
+    """
+    Keyword dictionary persisted in an SQLite file, with full-text search.
+
+    Args:
+    path (str): Path of the SQLite file (":memory:" for a throwaway store).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._unsynced_since = None  # Monotonic time of the first commit not yet forced to disk
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS keywords
+                            (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, description TEXT NOT NULL,
+                             version INTEGER NOT NULL DEFAULT 1, updated_at REAL NOT NULL)''')
+        self.trigram = self._create_index()
+        self._db.commit()
+        # Names in insertion order, like the dict this replaces
+        self._names = {name: None for (name,) in self._db.execute('SELECT name FROM keywords ORDER BY id')}
+
+    def _create_index(self) -> bool:
+        """ Create the FTS5 index and the triggers that keep it in step. Returns whether it is a trigram (substring) index. """
+        exists = self._db.execute("SELECT sql FROM sqlite_master WHERE name = 'keywords_fts'").fetchone()
+        if exists:
+            return 'trigram' in exists[0]
+        trigram = True
+        try:
+            self._db.execute('''CREATE VIRTUAL TABLE keywords_fts USING fts5
+                                (name, description, content='keywords', content_rowid='id', tokenize='trigram')''')
+        except sqlite3.OperationalError:
+            trigram = False  # SQLite before 3.34: word index, substring lookups fall back to a scan
+            self._db.execute('''CREATE VIRTUAL TABLE keywords_fts USING fts5
+                                (name, description, content='keywords', content_rowid='id')''')
+        self._db.executescript('''
+            CREATE TRIGGER keywords_ai AFTER INSERT ON keywords BEGIN
+                INSERT INTO keywords_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+            END;
+            CREATE TRIGGER keywords_ad AFTER DELETE ON keywords BEGIN
+                INSERT INTO keywords_fts (keywords_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+            END;
+            CREATE TRIGGER keywords_au AFTER UPDATE ON keywords BEGIN
+                INSERT INTO keywords_fts (keywords_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+                INSERT INTO keywords_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+            END;
+        ''')
+        return trigram
+
+    def __getitem__(self, name):
+        if name not in self._names:
+            raise KeyError(name)
+        with self._lock:
+            row = self._db.execute('SELECT description FROM keywords WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row[0]
+
+    def __setitem__(self, name, description):
+        self.update_many({name: description})
+
+    def __delitem__(self, name):
+        with self._lock:
+            if self._db.execute('DELETE FROM keywords WHERE name = ?', (name,)).rowcount == 0:
+                raise KeyError(name)
+            self._db.commit()
+            self._committed()
+            self._names.pop(name, None)
+
+    def __iter__(self):
+        return iter(list(self._names))
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._names
+
+    def items(self):
+        """ Every (name, description) pair, read in one query. """
+        with self._lock:
+            return self._db.execute('SELECT name, description FROM keywords ORDER BY id').fetchall()
+
+    def get_many(self, names) -> dict:
+        """ Descriptions of the given names that exist, in the order given. """
+        names = [name for name in names if name in self._names]
+        found = {}
+        with self._lock:
+            for start in range(0, len(names), 500):  # Stay below SQLite's bound-parameter limit
+                chunk = names[start:start + 500]
+                query = f"SELECT name, description FROM keywords WHERE name IN ({','.join('?' * len(chunk))})"
+                found.update(self._db.execute(query, chunk).fetchall())
+        return {name: found[name] for name in names if name in found}
+
+    def update_many(self, new_keywords: dict) -> list:
+        """ Insert or update several keywords in one transaction. Returns the names whose description changed. """
+        changed = []
+        now = time.time()
+        with self._lock:
+            current = self.get_many(new_keywords)
+            rows = [(name, description, now) for name, description in new_keywords.items() if current.get(name) != description]
+            self._db.executemany('''INSERT INTO keywords (name, description, updated_at) VALUES (?, ?, ?)
+                                    ON CONFLICT (name) DO UPDATE SET description = excluded.description,
+                                    version = version + 1, updated_at = excluded.updated_at''', rows)
+            self._db.commit()
+            if rows:
+                self._committed()
+            for name, _, _ in rows:
+                self._names.setdefault(name, None)
+                changed.append(name)
+        return changed
+
+    def _committed(self):
+        if self._unsynced_since is None:
+            self._unsynced_since = time.monotonic()
+
+    @property
+    def unsynced_since(self):
+        """ Monotonic time of the oldest commit that may not be on disk yet, or None if every commit is. """
+        return self._unsynced_since
+
+    def sync(self) -> bool:
+        """
+        Force the committed changes to disk. With synchronous=NORMAL a commit only reaches the WAL; a
+        checkpoint syncs the WAL first, so one checkpoint makes a whole group of commits durable.
+        Returns True if there was anything to sync.
+        """
+        with self._lock:
+            if self._unsynced_since is None:
+                return False
+            self._db.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            self._unsynced_since = None
+            return True
+
+    def version(self, name) -> tuple:
+        """ (version, updated_at) of a keyword: the version starts at 1 and goes up with every change. """
+        with self._lock:
+            row = self._db.execute('SELECT version, updated_at FROM keywords WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(name)
+        return row
+
+    def mentioning(self, name) -> list:
+        """ Names of the keywords whose description contains `name` (case insensitive). """
+        name_lower = name.lower()
+        with self._lock:
+            if self.trigram and len(name) >= TRIGRAM_MIN_LENGTH:
+                query = 'description : "' + name.replace('"', '""') + '"'
+                rows = self._db.execute('''SELECT keywords.name, keywords.description FROM keywords_fts
+                                           JOIN keywords ON keywords.id = keywords_fts.rowid
+                                           WHERE keywords_fts MATCH ?''', (query,)).fetchall()
+            else:
+                rows = self._db.execute('SELECT name, description FROM keywords').fetchall()
+        # The index finds candidates; the exact (Unicode case-insensitive) substring test decides
+        return [other for other, description in rows if name_lower in description.lower()]
+
+    def search(self, query: str, limit: int = 20) -> list:
+        """ Full-text search over names and descriptions: (name, description) pairs, best match first. """
+        match = '"' + query.replace('"', '""') + '"'
+        with self._lock:
+            if self.trigram and len(query) < TRIGRAM_MIN_LENGTH:
+                pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                return self._db.execute('''SELECT name, description FROM keywords WHERE name LIKE ?1 ESCAPE '\\'
+                                           OR description LIKE ?1 ESCAPE '\\' ORDER BY id LIMIT ?2''', (pattern, limit)).fetchall()
+            return self._db.execute('''SELECT keywords.name, keywords.description FROM keywords_fts
+                                       JOIN keywords ON keywords.id = keywords_fts.rowid
+                                       WHERE keywords_fts MATCH ? ORDER BY rank LIMIT ?''', (match, limit)).fetchall()
+
+    def backup(self, path: str):
+        """ Write a consistent copy of the store to a new SQLite file at `path`. """
+        with self._lock:
+            target = sqlite3.connect(path)
+            try:
+                self._db.backup(target)
+            finally:
+                target.close()
+
+    def close(self):
+        with self._lock:
+            self._unsynced_since = None  # Closing checkpoints the WAL itself
+            self._db.close()
@@ -1,72 +1,211 @@
 import networkx as nx
 import json
 import re
-from llm import callGPT
+import logging
+from llm import callGPT, llm_client
+from keyword_matcher import KeywordMatcher
+from metrics import span
 
+logger = logging.getLogger('aimud.keywords')
 
-def create_graph(keywords: dict, directed: bool = False) -> nx.Graph:
+
+def create_graph(keywords: dict, directed: bool = False, matcher: KeywordMatcher = None) -> nx.Graph:
     """
     Create a graph from the keywords dictionary. Each keyword is a node. If the description of one keyword
     contains another keyword, an edge is created between them.
 
     Args:
-    keywords (dict): Dictionary with keywords and their descriptions.
+    keywords (dict): Dictionary (or KeywordStore) with keywords and their descriptions.
     directed (bool): Determines if the resulting graph should be directed. False means the graph is undirected.
+    matcher (KeywordMatcher): Optional automaton over the keys, reused instead of building a new one.
 
     Returns:
     nx.Graph: The resulting graph, which could be either directed or undirected.
     """
     graph = nx.DiGraph() if directed else nx.Graph()
-    keywords_lower = {k.lower(): v.lower() for k, v in keywords.items()}  # Work with lowercase to ensure case insensitivity
+    if matcher is None:
+        matcher = KeywordMatcher(keywords)
 
     # Add nodes with the actual keyword (not lowercased) for better output handling
     for key in keywords:
         graph.add_node(key)  
 
-    # Add edges based on case insensitive comparison
-    for key, description in keywords_lower.items():
-        for potential_key in keywords_lower:
-            if potential_key in description and key != potential_key:
+    # One automaton pass per description finds every keyword it mentions (case insensitive)
+    for key, description in keywords.items():
+        key_lower = key.lower()
+        for potential_key in matcher.find(description):
+            if potential_key in keywords and potential_key.lower() != key_lower:
                 graph.add_edge(key, potential_key)  # Use original keys for the nodes
 
     return graph
 
-def spot_keywords(text: str, keywords: dict, depth: int = 1, graph=None) -> set:
+
+class KeywordGraph(nx.Graph):
     """
-    Extended version of spot_keywords that considers graph relations among keywords to identify related terms.
+    Undirected keyword graph that is maintained incrementally instead of being rebuilt for every action.
+
+    It has the same nodes and neighbors as `create_graph(keywords, directed=False)`, but after the keyword
+    dictionary changes only the edges of the changed keys are recomputed, in both directions: the changed
+    key's description against every other keyword, and (for new keys) every other description against
+    the changed key. The graph also owns the `matcher` automaton over its keys, which `spot_keywords` can reuse.
+
+    For a plain dict, lowercased descriptions are cached so untouched keywords are never lowercased again.
+    A KeywordStore is not mirrored in memory: descriptions are read from it when needed, and the
+    descriptions that mention a new key are found through its full-text index.
+
+    Args:
+    keywords (dict): Dictionary (or KeywordStore) with keywords and their descriptions to build the initial graph from.
+    """
+
+    def __init__(self, keywords: dict = None, **attr):
+        super().__init__(**attr)
+        self._lowered = {}  # key -> lowercased key
+        self._descriptions = {}  # key -> lowercased description, for dict-backed graphs only
+        self.matcher = KeywordMatcher()
+        if keywords:
+            self.refresh(keywords, list(keywords))
+
+    def _description(self, keywords, key) -> str:
+        description = self._descriptions.get(key)
+        return description if description is not None else keywords[key].lower()
+
+    def _mentioning(self, keywords, key) -> list:
+        """ Keys whose description contains `key`. """
+        if hasattr(keywords, 'mentioning'):
+            return keywords.mentioning(key)
+        key_lower = self._lowered[key]
+        return [other for other, description in self._descriptions.items() if key_lower in description]
+
+    def refresh(self, keywords: dict, changed_keys) -> None:
+        """
+        Bring the graph in line with `keywords` after the keys in `changed_keys` were added, updated or removed.
+
+        Args:
+        keywords (dict): The current, complete keyword dictionary (or KeywordStore).
+        changed_keys (iterable): Keys whose entry was added, changed or deleted since the last refresh.
+        """
+        changed_keys = list(changed_keys)
+        cache = not hasattr(keywords, 'mentioning')
+        new_keys = {key for key in changed_keys if key in keywords and key not in self}
+        present = [key for key in changed_keys if key in keywords]
+        descriptions = keywords.get_many(present) if hasattr(keywords, 'get_many') else {key: keywords[key] for key in present}
+        for key in changed_keys:
+            if key not in keywords:
+                self._lowered.pop(key, None)
+                self._descriptions.pop(key, None)
+                self.matcher.remove(key)
+                if key in self:
+                    self.remove_node(key)
+                continue
+            self._lowered[key] = key.lower()
+            if cache:
+                self._descriptions[key] = descriptions[key].lower()
+            self.matcher.add(key)
+
+        has_existing = len(self) > 0  # Keys that were already in the graph before this refresh
+        for key in present:
+            key_lower = self._lowered[key]
+            description = descriptions[key].lower()
+            is_new = key in new_keys
+            self.add_node(key)
+
+            if not is_new:
+                # The key's own name is unchanged, so only edges that came from its old description can go away
+                for neighbor in list(self.neighbors(key)):
+                    if key_lower not in self._description(keywords, neighbor) and self._lowered[neighbor] not in description:
+                        self.remove_edge(key, neighbor)
+
+            for other in self.matcher.find(description):
+                if self._lowered[other] != key_lower:
+                    self.add_edge(key, other)
+            if is_new and has_existing:
+                # Descriptions of keys that were already there may mention the new key
+                for other in self._mentioning(keywords, key):
+                    if other in self._lowered and other not in new_keys and self._lowered[other] != key_lower:
+                        self.add_edge(key, other)
+
+
+def rank_keywords(text: str, keywords: dict, depth: int = 1, graph=None, matcher: KeywordMatcher = None, max_keywords: int = None) -> list:
+    """
+    Find the keywords relevant to a text and rank them.
+
+    Keys that appear in the text are at hop 0 and weighted by how often they appear. The graph is then
+    walked breadth-first, expanding only the frontier reached in the previous hop; a key first reached at
+    hop h gets the summed weight of the frontier keys that link to it. Keys are ranked by hop distance
+    first and weight second, so once `max_keywords` keys have been reached no deeper hop can make the cut
+    and the walk stops early.
 
     Args:
     text (str): The text to search within.
     keywords (dict): A dictionary where the keys are terms to search for.
     depth (int): The depth to traverse in the keyword graph. depth=1 means only direct appearances.
     graph (nx.Graph): A graph representing relationships between keywords.
+    matcher (KeywordMatcher): Optional automaton over the keys; finds all direct appearances in one pass.
+    max_keywords (int): Maximum number of keys to return. None means no cap.
 
     Returns:
-    set: A set of keys that were found directly in the text and their related keys up to the specified depth.
+    list: (key, hop, weight) tuples, most relevant first.
     """
     if depth >= 2 and graph is None:
         raise ValueError("A graph must be provided for depth >= 2")
 
-    found_keys = set()
-    text_lower = text.lower()
-
-    # Identify direct appearances
-    for key in keywords.keys():
-        if key.lower() in text_lower:
-            found_keys.add(key)
+    # Identify direct appearances and how often they occur
+    if matcher is not None:
+        counts = {key: n for key, n in matcher.count(text).items() if key in keywords}
+    else:
+        text_lower = text.lower()
+        counts = {}
+        for key in keywords.keys():
+            key_lower = key.lower()
+            # Count overlapping occurrences, as the automaton does
+            position = text_lower.find(key_lower) if key_lower else -1
+            while position != -1:
+                counts[key] = counts.get(key, 0) + 1
+                position = text_lower.find(key_lower, position + 1)
+
+    hops = dict.fromkeys(counts, 0)
+    weights = dict(counts)
+
+    # Expand only the newly reached frontier on each hop
+    frontier = list(counts)
+    for hop in range(1, depth):
+        if not frontier or (max_keywords is not None and len(hops) >= max_keywords):
+            break
+        reached = {}
+        for key in frontier:
+            if key not in graph:
+                continue
+            for neighbor in graph.neighbors(key):
+                if neighbor in hops or neighbor not in keywords:
+                    continue
+                reached[neighbor] = reached.get(neighbor, 0) + weights[key]
+        for key, weight in reached.items():
+            hops[key] = hop
+            weights[key] = weight
+        frontier = list(reached)
+
+    ranked = sorted(hops, key=lambda k: (hops[k], -weights[k], k))
+    if max_keywords is not None:
+        ranked = ranked[:max_keywords]
+    return [(key, hops[key], weights[key]) for key in ranked]
+
+def spot_keywords(text: str, keywords: dict, depth: int = 1, graph=None, matcher: KeywordMatcher = None, max_keywords: int = None) -> list:
+    """
+    Extended version of spot_keywords that considers graph relations among keywords to identify related terms.
 
-    # Use the graph to find related keywords based on the depth
-    if depth >= 2:
-        related_keys = set(found_keys)
-        for _ in range(depth - 1):
-            new_related = set()
-            for key in related_keys:
-                # Use neighbors from graph directly
-                new_related.update(graph.neighbors(key))
-            related_keys.update(new_related)
-        found_keys.update(related_keys)
+    Args:
+    text (str): The text to search within.
+    keywords (dict): A dictionary where the keys are terms to search for.
+    depth (int): The depth to traverse in the keyword graph. depth=1 means only direct appearances.
+    graph (nx.Graph): A graph representing relationships between keywords.
+    matcher (KeywordMatcher): Optional automaton over the keys; finds all direct appearances in one pass.
+    max_keywords (int): Maximum number of keys to return. None means no cap.
 
-    return found_keys
+    Returns:
+    list: Keys found directly in the text and their related keys up to the specified depth, most relevant first
+    (see `rank_keywords`).
+    """
+    return [key for key, _, _ in rank_keywords(text, keywords, depth=depth, graph=graph, matcher=matcher, max_keywords=max_keywords)]
 
 
 def extract_json_from_response(response: str) -> dict:
@@ -146,24 +285,22 @@ def extract_keywords(current_keywords: dict, text: str) -> dict:
     
     # Use the existing callGPT function to send the prompt and get the AI's response
     try:
-        # Load model configuration
-        with open('config.json', 'r') as f:
-            config = json.load(f)
-        keyword_model = config['models']['keyword_extraction']
+        # Model configuration comes from the shared client's cached config.json
+        keyword_model = llm_client.config['models']['keyword_extraction']
 
         ai_response = callGPT([{'role': 'system', 'content': prompt}], model=keyword_model)
 
         # Use robust JSON extraction to handle markdown code blocks and extra text
-        updated_keywords = extract_json_from_response(ai_response)
+        with span("parse_keywords"):
+            updated_keywords = extract_json_from_response(ai_response)
 
         if updated_keywords is None:
-            print("Parsing error: Could not extract valid JSON from response.")
-            print(f"Raw response: {ai_response[:200]}...")  # Print first 200 chars for debugging
+            logger.warning("Parsing error: Could not extract valid JSON from response. Raw response: %s...", ai_response[:200])
             return None
 
         return updated_keywords
     except Exception as e:
-        print(f"An error occurred: {str(e)}")
+        logger.warning("Keyword extraction failed: %s", e)
         return None
 
 
@@ -1,5 +1,24 @@
-import requests
+import os
 import json
+import random
+import logging
+import time
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from llm_cache import ResponseCache, request_key
+from llm_resilience import (LLMError, LLMTimeout, LLMUnavailable, LLMAPIError, LLMBadResponse,
+                            CircuitBreaker, LatencyTracker, backoff_delay)
+from context import estimate_tokens
+from metrics import LLM_REQUESTS, LLM_TOKENS, PROMPT_CHARS, LLM_BREAKER_OPEN
+
+logger = logging.getLogger('aimud.llm')
+
+DEFAULT_CALL_DEADLINE = 120.0  # Seconds a call may take in all, retries and backoff included
+
+# Hedged calls run here, so the caller can take whichever of two requests answers first
+hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='llm-hedge')
 
 '''
 available models:
@@ -12,58 +31,413 @@ gpt-4-turbo
 '''
 
 
-def callGPT(messages: list, model: str = 'gpt-3.5-turbo') -> str:
-    print(f"GPT called. model:{model}, message_length = {len(str(messages))}")
-    print("---------------------------------")
-    print(messages)
-    print("---------------------------------")
-    # URL of the AI endpoint
-    
-    with open('config.json', 'r') as f:
-        config = json.load(f)
-    url = config['api_endpoint']
-    api_key = config.get('api_key', '')
-
-    # Define the headers for the HTTP request
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {api_key}'
-    }
+class LLMClient:
+    """
+    Long-lived client for the chat completions endpoint, shared by the whole process.
 
-    # Prepare the JSON body for the POST request
-    body = {
-        'model': model,
-        'messages': messages,
-        'max_tokens': config.get('max_tokens', 4000)
-    }
-    
-    # Try to send the POST request
+    Keeps one requests.Session with a pool of keep-alive connections, so turns reuse TCP/TLS connections
+    instead of handshaking on every call, and applies explicit connect/read timeouts. config.json is
+    parsed once and only re-read when its modification time changes.
+
+    Optional config.json keys: "connect_timeout" (default 5 s), "read_timeout" (default 120 s), "pool_size" (default 16),
+    "prompt_log_sample" (share of calls whose full prompt is logged at DEBUG level, default 0.1), and "response_cache", which turns on the response cache of llm_cache.py, e.g.
+    {"enabled": true, "max_entries": 1024, "path": "llm_cache.db", "max_disk_mb": 64, "replay": false}.
+
+    Failure handling (see llm_resilience.py): "call_deadline" (seconds per call, retries included, default 120),
+    "max_retries" (default 2), "retry_backoff" / "retry_backoff_max" (jittered backoff base and cap, default 0.5 s / 8 s),
+    "breaker_failures" / "breaker_reset" (failures in a row that pause a model, and for how long, default 5 / 30 s),
+    and "hedging", e.g. {"enabled": true, "quantile": 0.95, "min_delay": 1.0, "initial_delay": 10.0}, which needs
+    a "fallback" entry under "models".
+    """
+
+    def __init__(self, config_path: str = 'config.json'):
+        self.config_path = config_path
+        self._config = None
+        self._config_mtime = None
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self._pool_size = None
+        self._cache = None
+        self._cache_settings = None
+        self._breakers = {}  # model -> CircuitBreaker
+        self.latency = LatencyTracker()  # Recent latencies of successful calls, for the hedging delay
+
+    @property
+    def config(self) -> dict:
+        """ The parsed config.json, reloaded only if the file changed since the last read. """
+        mtime = os.stat(self.config_path).st_mtime_ns
+        if mtime != self._config_mtime:
+            with self._lock:
+                if mtime != self._config_mtime:
+                    with open(self.config_path, 'r') as f:
+                        self._config = json.load(f)
+                    self._config_mtime = mtime
+                    self._configure_pool(self._config.get('pool_size', 16))
+                    self._configure_cache(self._config.get('response_cache'))
+        return self._config
+
+    @property
+    def cache(self):
+        """ The response cache, or None unless config.json enables it. """
+        self.config
+        return self._cache
+
+    def _configure_cache(self, settings):
+        if settings == self._cache_settings:
+            return
+        if self._cache is not None:
+            self._cache.close()
+        self._cache = None
+        if settings and settings.get('enabled', True):
+            self._cache = ResponseCache(max_entries=settings.get('max_entries', 1024),
+                                        path=settings.get('path'),
+                                        max_disk_bytes=int(settings.get('max_disk_mb', 64) * 1024 * 1024),
+                                        replay=settings.get('replay', False))
+        self._cache_settings = settings
+
+    def _configure_pool(self, pool_size: int):
+        if pool_size != self._pool_size:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+            self._pool_size = pool_size
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """ The circuit breaker of a model, created on first use. """
+        with self._lock:
+            breaker = self._breakers.get(model)
+            if breaker is None:
+                config = self._config or {}
+                breaker = self._breakers[model] = CircuitBreaker(config.get('breaker_failures', 5), config.get('breaker_reset', 30.0))
+            return breaker
+
+    def breaker_states(self) -> dict:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {model: breaker.state for model, breaker in breakers.items()}
+
+    def post(self, body: dict, stream: bool = False, timeout: float = None) -> requests.Response:
+        """ POST a request body to the configured endpoint over a pooled connection. `timeout` caps the read timeout. """
+        config = self.config
+        headers = {
+            'Content-Type': 'application/json',
+            'Authorization': f"Bearer {config.get('api_key', '')}"
+        }
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+        read_timeout = config.get('read_timeout', 120.0)
+        if timeout is not None:
+            read_timeout = min(read_timeout, timeout)
+        timeout = (min(config.get('connect_timeout', 5.0), read_timeout), read_timeout)
+        return self.session.post(config['api_endpoint'], headers=headers, json=body, stream=stream, timeout=timeout)
+
+
+# Shared by llm.py, keywords.py and server.py
+llm_client = LLMClient()
+LLM_BREAKER_OPEN.set_function(lambda: {(model,): 0 if state == 'closed' else 1
+                                       for model, state in llm_client.breaker_states().items()})
+
+
+def _record_request(model: str, messages: list) -> int:
+    """ Log and count an LLM call about to be made. Returns the prompt size in characters. """
+    prompt_chars = sum(len(message['content']) for message in messages)
+    PROMPT_CHARS.observe(prompt_chars, model=model)
+    logger.debug("GPT called. model:%s, message_length = %d", model, prompt_chars)  # PROMPT_CHARS has the totals
+    # Full prompts are large: only a sample of them is logged, and only at DEBUG level
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < llm_client.config.get('prompt_log_sample', 0.1):
+        logger.debug("Prompt for %s:\n%s", model, messages)
+    return prompt_chars
+
+def _record_tokens(model: str, messages: list, completion: str, usage: dict = None):
+    """ Count the tokens of a finished call: as reported by the API when it says, estimated otherwise. """
+    usage = usage or {}
+    prompt_tokens = usage.get('prompt_tokens', usage.get('input_tokens'))
+    if prompt_tokens is None:
+        prompt_tokens = sum(estimate_tokens(message['content']) for message in messages)
+    completion_tokens = usage.get('completion_tokens', usage.get('output_tokens'))
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(completion)
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind='prompt')
+    LLM_TOKENS.inc(completion_tokens, model=model, kind='completion')
+
+
+def _retry_after(response) -> float:
+    """ The Retry-After header of a response in seconds, if it has one in that form. """
     try:
-        response = requests.post(url, headers=headers, json=body)
-        # print(response.text)
-        response.raise_for_status()  # Raises an HTTPError for bad responses
-        # Parse the response JSON
-        data = response.json()
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+def _raise_for_status(response, model: str):
+    if response.status_code >= 400:
+        raise LLMAPIError(f"{model} answered HTTP {response.status_code}", response.status_code,
+                          model=model, retry_after=_retry_after(response))
+
+def _llm_error(e: requests.RequestException, model: str) -> LLMError:
+    """ The typed error for a failed HTTP exchange. """
+    if isinstance(e, requests.Timeout):
+        return LLMTimeout(f"{model} timed out: {e}", model=model, retryable=True)
+    if isinstance(e, (requests.ConnectionError, requests.exceptions.ChunkedEncodingError)):
+        return LLMUnavailable(f"{model} could not be reached: {e}", model=model, retryable=True)
+    return LLMError(f"{model} request failed: {e}", model=model)
+
+def _call_with_retries(model: str, attempt, deadline: float, track_latency: bool = False, cancelled: threading.Event = None):
+    """
+    Run `attempt(timeout)` for `model` until it returns, fails for good, or `deadline` (monotonic time) passes.
+
+    Retryable failures are tried again after a jittered backoff (or the delay the API asked for), up to
+    "max_retries" times. The model's circuit breaker sees every outcome, and refuses the call while open.
+    Once `cancelled` is set, no further attempt is made (an attempt already under way still finishes).
+
+    Raises:
+    LLMError: The last failure, LLMUnavailable if the breaker is open, LLMTimeout once the deadline passes,
+        or a plain LLMError once the call is cancelled.
+    """
+    config = llm_client.config
+    max_retries = config.get('max_retries', 2)
+    breaker = llm_client.breaker(model)
+    for retry in range(max_retries + 1):
+        if cancelled is not None and cancelled.is_set():
+            raise LLMError(f"{model} call cancelled", model=model)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise LLMTimeout(f"{model} did not answer within the call deadline", model=model)
+        if not breaker.allow():
+            LLM_REQUESTS.inc(model=model, outcome='rejected')
+            raise LLMUnavailable(f"{model} is failing; calls are paused for up to {breaker.reset_timeout:g}s", model=model)
+        start = time.monotonic()
+        try:
+            result = attempt(remaining)
+        except LLMError as e:
+            if e.retryable:
+                breaker.record_failure()
+            else:
+                breaker.release()  # A rejected request says nothing about the model's health
+            delay = e.retry_after if e.retry_after is not None else backoff_delay(
+                retry, config.get('retry_backoff', 0.5), config.get('retry_backoff_max', 8.0))
+            if not e.retryable or retry == max_retries or time.monotonic() + delay >= deadline:
+                raise
+            LLM_REQUESTS.inc(model=model, outcome='retry')
+            logger.warning("%s; retrying in %.1fs", e, delay)
+            if cancelled is not None:
+                cancelled.wait(delay)  # Wakes up early when the call is cancelled
+            else:
+                time.sleep(delay)
+            continue
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        if track_latency:
+            llm_client.latency.observe(model, time.monotonic() - start)
+        return result
+
+def _complete(model: str, messages: list, max_tokens, deadline: float, cancelled: threading.Event = None) -> str:
+    """ One model's completion of `messages`, with retries until `cancelled` is set. Counts the call and its tokens. """
+    def attempt(timeout):
+        _record_request(model, messages)
+        body = {
+            'model': model,
+            'messages': messages,
+            'max_tokens': max_tokens
+        }
+        try:
+            response = llm_client.post(body, timeout=timeout)
+            _raise_for_status(response, model)
+            data = response.json()
+        except requests.RequestException as e:
+            raise _llm_error(e, model) from e
+        except ValueError as e:
+            raise LLMBadResponse(f"{model} answered with invalid JSON: {e}", model=model) from e
 
         # Try standard OpenAI/OpenRouter format first (most common)
         try:
             ai_response = data['choices'][0]['message']['content']
-        except (KeyError, IndexError):
+        except (KeyError, IndexError, TypeError):
             # Fallback to Anthropic's direct API format (if using Anthropic API directly)
             try:
                 ai_response = " ".join([item['text'] for item in data['content'] if 'text' in item])
             except (KeyError, TypeError):
-                return "Failed to extract AI's response from API."
+                raise LLMBadResponse(f"Failed to extract {model}'s response from the API answer", model=model)
+        return ai_response, data.get('usage')
+
+    try:
+        ai_response, usage = _call_with_retries(model, attempt, deadline, track_latency=True, cancelled=cancelled)
+    except LLMError:
+        LLM_REQUESTS.inc(model=model, outcome='cancelled' if cancelled is not None and cancelled.is_set() else 'error')
+        raise
+    LLM_REQUESTS.inc(model=model, outcome='ok')
+    _record_tokens(model, messages, ai_response, usage)
+    return ai_response
+
+def _hedge_model(config: dict, model: str):
+    """ The fallback model to hedge calls to `model` with, or None if hedging is off. """
+    hedging = config.get('hedging') or {}
+    fallback = config.get('models', {}).get('fallback')
+    if not hedging.get('enabled', True) or not hedging or not fallback or fallback == model:
+        return None
+    return fallback
+
+def _complete_hedged(model: str, fallback: str, messages: list, max_tokens, deadline: float) -> tuple:
+    """
+    Ask `model`, and `fallback` as well if `model` has not answered within its recent p95 latency (or fails).
+    Returns (model that answered, completion) of whichever answers first. The other call is cancelled: a request
+    already sent finishes unobserved, but no retry follows it.
+    """
+    hedging = llm_client.config['hedging']
+    delay = llm_client.latency.quantile(model, hedging.get('quantile', 0.95))
+    delay = hedging.get('initial_delay', 10.0) if delay is None else max(delay, hedging.get('min_delay', 1.0))
+    hedge_at = time.monotonic() + delay
+
+    cancelled = threading.Event()  # Set once this call returns, so the losing call stops retrying
+    pending = {hedge_executor.submit(_complete, model, messages, max_tokens, deadline, cancelled): model}
+    hedged = False
+    first_error = None
+    try:
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                raise LLMTimeout(f"{model} did not answer within the call deadline", model=model) from first_error
+            timeout = deadline - now if hedged else min(hedge_at, deadline) - now
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                answered_by = pending.pop(future)
+                try:
+                    return answered_by, future.result()
+                except LLMError as e:
+                    first_error = first_error or e
+            if not hedged and (not pending or time.monotonic() >= hedge_at):
+                hedged = True
+                LLM_REQUESTS.inc(model=fallback, outcome='hedge')
+                logger.info("Hedging %s with %s after %.1fs", model, fallback, time.monotonic() - (hedge_at - delay))
+                pending[hedge_executor.submit(_complete, fallback, messages, max_tokens, deadline, cancelled)] = fallback
+        raise first_error
+    finally:
+        cancelled.set()
+
 
-        return ai_response
-    except requests.RequestException as e:
-        return f"An error occurred: {str(e)}"
-    except KeyError as e:
-        return f"Failed to extract AI's response: {str(e)}"
+def callGPT(messages: list, model: str = 'gpt-3.5-turbo') -> str:
+    """
+    Return the completion of `messages` by `model`.
+
+    The whole call, retries included, is bounded by "call_deadline" seconds. With "hedging" enabled and a
+    "fallback" model under "models" in config.json, a second request goes to the fallback once the call has
+    taken longer than the model's recent p95 latency (or has failed), and the first answer wins.
+
+    Raises:
+    LLMError: If no completion could be had (ReplayMiss in replay mode, for a request that is not cached).
+        Failures are never returned as text.
+    """
+    # Identical requests are answered from the response cache when it is enabled (ReplayMiss propagates in replay mode)
+    config = llm_client.config
+    max_tokens = config.get('max_tokens', 4000)
+    cache = llm_client.cache
+    cache_key = request_key(model, messages, max_tokens) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            LLM_REQUESTS.inc(model=model, outcome='cache_hit')
+            return cached
+
+    deadline = time.monotonic() + config.get('call_deadline', DEFAULT_CALL_DEADLINE)
+    fallback = _hedge_model(config, model)
+    if fallback is None:
+        answered_by, ai_response = model, _complete(model, messages, max_tokens, deadline)
+    else:
+        answered_by, ai_response = _complete_hedged(model, fallback, messages, max_tokens, deadline)
+
+    if cache is not None and ai_response:
+        # A fallback's answer is cached under the fallback, so it is not replayed as the primary model's
+        key = cache_key if answered_by == model else request_key(answered_by, messages, max_tokens)
+        cache.put(key, ai_response, answered_by)
+    return ai_response
+
+def callGPTStream(messages: list, model: str = 'gpt-3.5-turbo', on_delta=None) -> str:
+    """
+    Streaming variant of callGPT: requests a server-sent-event stream and calls `on_delta(text)` for every
+    piece of the completion as it arrives. Returns the assembled completion, like callGPT.
+    A cached completion is handed to `on_delta` in one piece.
+
+    Deadline, retries and the circuit breaker apply as in callGPT, but a stream is only retried until its
+    first piece has been handed to `on_delta`, and it is never hedged: players would see both answers.
+
+    Raises:
+    LLMError: If no complete answer could be had, including when the stream broke off halfway.
+    """
+    config = llm_client.config
+    max_tokens = config.get('max_tokens', 4000)
+    cache = llm_client.cache
+    cache_key = request_key(model, messages, max_tokens) if cache is not None else None
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            LLM_REQUESTS.inc(model=model, outcome='cache_hit')
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    deadline = time.monotonic() + config.get('call_deadline', DEFAULT_CALL_DEADLINE)
+    pieces = []
+
+    def attempt(timeout):
+        _record_request(model, messages)
+        body = {
+            'model': model,
+            'messages': messages,
+            'max_tokens': max_tokens,
+            'stream': True
+        }
+        try:
+            with llm_client.post(body, stream=True, timeout=timeout) as response:
+                _raise_for_status(response, model)
+                for line in response.iter_lines(chunk_size=None, decode_unicode=True):  # Hand over events as soon as they arrive
+                    if time.monotonic() > deadline:
+                        raise LLMTimeout(f"{model} did not finish within the call deadline", model=model)
+                    if not line or not line.startswith('data:'):
+                        continue  # Blank separators, comments and "event:" lines
+                    payload = line[len('data:'):].strip()
+                    if payload == '[DONE]':
+                        break
+                    event = json.loads(payload)
+                    # OpenAI/OpenRouter chunks carry choices[0].delta.content, Anthropic ones a content_block_delta
+                    if 'choices' in event:
+                        delta = (event['choices'][0].get('delta') or {}).get('content') if event['choices'] else None
+                    elif event.get('type') == 'content_block_delta':
+                        delta = event['delta'].get('text')
+                    else:
+                        delta = None
+                    if delta:
+                        pieces.append(delta)
+                        if on_delta is not None:
+                            on_delta(delta)
+        except LLMError as e:
+            e.retryable = e.retryable and not pieces  # Players already saw part of this answer
+            raise
+        except requests.RequestException as e:
+            error = _llm_error(e, model)
+            error.retryable = error.retryable and not pieces
+            raise error from e
+        except (KeyError, IndexError, ValueError) as e:
+            raise LLMBadResponse(f"Failed to extract {model}'s response: {e}", model=model) from e
+        return ''.join(pieces)
+
+    try:
+        completion = _call_with_retries(model, attempt, deadline)
+    except LLMError:
+        LLM_REQUESTS.inc(model=model, outcome='error')
+        raise
+    LLM_REQUESTS.inc(model=model, outcome='ok')
+    _record_tokens(model, messages, completion)
+    if cache is not None and completion:
+        cache.put(cache_key, completion, model)
+    return completion
 
-def continueStory(progress: str, general_styles: str, player: str, player_input: str, keywords: dict, model: str = 'claude-3-sonnet-20240229') -> str:
+def continueStory(progress: str, general_styles: str, player: str, player_input: str, keywords: dict, model: str = 'claude-3-sonnet-20240229', on_delta=None, summary: str = '') -> str:
     # Create a rich contextual narrative with explicit instructions for the AI
-    context = f"{general_styles} In the latest part of the story, {progress} The main character, {player}, "
+    context = f"{general_styles} "
+    if summary:
+        context += f"The story so far, in summary: {summary} "  # Older turns, condensed by the rolling summary
+    context += f"In the latest part of the story, {progress} The main character, {player}, "
     context += f"now decides to: {player_input}. This is a game setting; focus on detailed, cinematic descriptions. "
     context += "Keep the response concise, aiming for 1 or 2 paragraphs only."
     
@@ -75,7 +449,9 @@ def continueStory(progress: str, general_styles: str, player: str, player_input:
         {'role': 'user', 'content': context + supplementary_context}
     ]
     
-    # Call the callGPT function with the generated messages
+    # Call the callGPT function with the generated messages, streaming the text out as it is generated if asked to
+    if on_delta is not None:
+        return callGPTStream(messages, model, on_delta=on_delta)
     return callGPT(messages, model)
 
 # Example usage
@@ -0,0 +1,139 @@
+"""
+Content-addressed cache of LLM responses.
+
+A response is stored under the SHA-256 of its request (model, messages and max_tokens), so the same
+prompt asked twice is answered from the cache instead of the API. Entries live in an in-memory LRU
+and, optionally, in an SQLite file that survives restarts and is trimmed to a size budget by evicting
+the least recently used rows.
+
+In replay mode the cache never lets a request through: a prompt that is not cached raises ReplayMiss,
+so test runs are deterministic and cost no API calls.
+"""
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from llm_resilience import LLMError
+
+
+class ReplayMiss(LLMError):
+    """ Raised in replay mode when a request has no cached response; callers handle it like any failed call. """
+
+
+def request_key(model: str, messages: list, max_tokens) -> str:
+    """ Hash of everything that determines a completion, used as the cache key. """
+    canonical = json.dumps({'model': model, 'messages': messages, 'max_tokens': max_tokens},
+                           sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier response cache: an in-memory LRU in front of an optional SQLite file.
+
+    Args:
+    max_entries (int): Responses kept in memory.
+    path (str): SQLite file of the disk tier, or None for a memory-only cache.
+    max_disk_bytes (int): Size budget of the cached text on disk; least recently used rows go first.
+    replay (bool): Strict replay mode: `get` raises ReplayMiss instead of reporting a miss.
+    """
+
+    def __init__(self, max_entries: int = 1024, path: str = None, max_disk_bytes: int = 64 * 1024 * 1024, replay: bool = False):
+        self.max_entries = max_entries
+        self.path = path
+        self.max_disk_bytes = max_disk_bytes
+        self.replay = replay
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> response, oldest first
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute('''CREATE TABLE IF NOT EXISTS responses
+                                (key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, last_used REAL)''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)')
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                    'entries': len(self._memory), 'disk_bytes': self._disk_bytes()}
+
+    def get(self, key: str):
+        """
+        Return the cached response for `key`, or None on a miss.
+
+        Raises:
+        ReplayMiss: In replay mode, if nothing is cached under `key`.
+        """
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return response
+            if self._db is not None:
+                row = self._db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    self._db.execute('UPDATE responses SET last_used = ? WHERE key = ?', (time.time(), key))
+                    self._db.commit()
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+        if self.replay:
+            raise ReplayMiss(f"no cached response for request {key[:12]} in replay mode")
+        return None
+
+    def put(self, key: str, response: str, model: str = ''):
+        with self._lock:
+            self._remember(key, response)
+            if self._db is not None:
+                size = len(response.encode('utf-8'))
+                self._db.execute('INSERT OR REPLACE INTO responses (key, model, response, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                                 (key, model, response, size, time.time()))
+                self._evict_disk()
+                self._db.commit()
+
+    def _remember(self, key, response):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _disk_bytes(self) -> int:
+        if self._db is None:
+            return 0
+        return self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def _evict_disk(self):
+        excess = self._disk_bytes() - self.max_disk_bytes
+        if excess <= 0:
+            return
+        freed = 0
+        doomed = []
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY last_used'):
+            if freed >= excess:
+                break
+            doomed.append((key,))
+            freed += size
+        self._db.executemany('DELETE FROM responses WHERE key = ?', doomed)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute('DELETE FROM responses')
+                self._db.commit()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
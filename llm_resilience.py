@@ -0,0 +1,145 @@
+"""
+Failure handling for LLM calls: typed errors, jittered backoff, circuit breakers and latency tracking.
+
+A failed call raises an LLMError instead of returning an error message, so a failure can never end up
+in the story or in keyword extraction. Errors say whether trying again may help (`retryable`): timeouts,
+dropped connections, rate limits and 5xx answers may; a rejected request or an unusable answer won't.
+
+Every model has a CircuitBreaker. After `failure_threshold` failures in a row it opens and calls to the
+model are refused at once (LLMUnavailable) for `reset_timeout` seconds, instead of every turn waiting
+out its own timeout against an endpoint that is down. Then a single trial call is let through: if it
+succeeds the breaker closes, otherwise it stays open for another period.
+
+LatencyTracker keeps the latencies of recent successful calls per model, which is what the hedging
+delay in llm.py is based on.
+"""
+import time
+import random
+import threading
+from collections import deque
+
+RETRYABLE_STATUS = frozenset({408, 409, 425, 429, 500, 502, 503, 504})
+
+
+class LLMError(Exception):
+    """
+    An LLM call failed.
+
+    Args:
+    message (str): What went wrong.
+    model (str): The model that was called.
+    retryable (bool): Whether the same request may succeed if tried again.
+    retry_after (float): Seconds the API asked us to wait before trying again, if it said.
+    """
+
+    def __init__(self, message: str, model: str = None, retryable: bool = False, retry_after: float = None):
+        super().__init__(message)
+        self.model = model
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+class LLMTimeout(LLMError):
+    """ The call, or one attempt of it, ran out of time. """
+
+class LLMUnavailable(LLMError):
+    """ The endpoint could not be reached, the connection dropped, or the model's circuit breaker is open. """
+
+class LLMAPIError(LLMError):
+    """ The API answered with an error status. """
+
+    def __init__(self, message: str, status: int, model: str = None, retry_after: float = None):
+        super().__init__(message, model=model, retryable=status in RETRYABLE_STATUS, retry_after=retry_after)
+        self.status = status
+
+class LLMBadResponse(LLMError):
+    """ The API answered, but not with a completion we could read. """
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """ "Full jitter" backoff: a random delay up to base * 2**attempt, capped, so retrying callers spread out. """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one model.
+
+    Args:
+    failure_threshold (int): Failures in a row that open the breaker.
+    reset_timeout (float): Seconds the breaker stays open before a trial call is let through.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None  # Monotonic time the breaker opened, None while closed
+        self._trial = False  # Whether the one trial call of a half-open breaker is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """ "closed", "open", or "half-open" (the reset timeout has passed; the next call is a trial). """
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            return 'open' if self._trial or time.monotonic() - self._opened_at < self.reset_timeout else 'half-open'
+
+    def allow(self) -> bool:
+        """ Whether a call may go out now. A half-open breaker lets exactly one through. """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()  # (Re)open: a failed trial starts a new period
+            self._trial = False
+
+    def release(self):
+        """ End a call that neither succeeded nor failed in a way that says anything about the model. """
+        with self._lock:
+            self._trial = False
+
+
+class LatencyTracker:
+    """
+    Latencies of the most recent successful calls, per model.
+
+    Args:
+    window (int): Calls remembered per model.
+    min_samples (int): Calls needed before `quantile` gives an answer.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}  # model -> deque of seconds
+        self._lock = threading.Lock()
+
+    def observe(self, model: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = self._samples[model] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def quantile(self, model: str, q: float):
+        """ The q-quantile of the model's recent latencies, or None while there are too few of them. """
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
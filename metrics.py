@@ -0,0 +1,250 @@
+"""
+Process metrics in Prometheus text format.
+
+Counters, gauges and histograms live in one process-wide registry and are served as plain text on a
+local HTTP endpoint (GET /metrics), so a Prometheus server, or just curl, can see where the time of
+a turn goes:
+
+    aimud_stage_seconds{stage="continue_story"}   story continuation, including the LLM call
+    aimud_stage_seconds{stage="spot_keywords"}    keyword spotting for the prompt and for extraction
+    ...
+
+Every stage of a turn is timed with `span(stage)`. Gauges whose value lives elsewhere (connections,
+queue depths) are read through a function at scrape time, so keeping them current costs nothing.
+Only the standard library is used.
+"""
+import math
+import time
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = '127.0.0.1'  # The endpoint is local only
+METRICS_PORT = 9108
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Seconds
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Registry:
+    """ The metrics of the process, rendered together. """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """ Every metric in the Prometheus text exposition format. """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.lines())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Base of the metric types: one value (or histogram) per combination of label values.
+
+    Args:
+    name (str): Metric name, e.g. "aimud_turns_total".
+    help (str): One-line description shown on the endpoint.
+    labelnames (tuple): Names of the labels every sample carries.
+    registry (Registry): Where the metric is rendered from.
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # Tuple of label values -> value
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels) -> tuple:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def lines(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """ A value that goes up and down. Instead of being set, it can be read from a function at scrape time. """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self._function = None
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        """ Read the gauge from `function()`: a number, or a dict of label-value tuples to numbers for a labelled gauge. """
+        self._function = function
+
+    def lines(self) -> list:
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception as e:  # A broken callback must not break the whole endpoint
+                return [f'# {self.name} unavailable: {e}']
+            with self._lock:
+                self._values = dict(value) if isinstance(value, dict) else {(): value}
+        return super().lines()
+
+
+class Histogram(Metric):
+    """ Observations counted into cumulative buckets, with their sum and count. """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * len(self.buckets) + [0.0]  # Bucket counts, then the sum
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def lines(self) -> list:
+        with self._lock:
+            items = sorted((key, list(counts)) for key, counts in self._values.items())
+        lines = []
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", _format_value(bound))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+    def summary(self) -> dict:
+        """
+        Count, mean and approximate percentiles of every label combination seen so far.
+
+        Returns:
+        dict: Tuple of label values -> {"count", "mean", "p50", "p95", "p99"}. A percentile is the upper
+        bound of the bucket it falls in (inf above the largest bucket).
+        """
+        with self._lock:
+            items = [(key, list(counts)) for key, counts in self._values.items()]
+        summary = {}
+        for key, counts in items:
+            total = sum(counts[:-1])
+            if not total:
+                continue
+            stats = {"count": total, "mean": counts[-1] / total}
+            for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    if cumulative >= q * total:
+                        stats[name] = bound
+                        break
+            summary[key] = stats
+        return summary
+
+
+# Turn pipeline
+STAGE_SECONDS = Histogram('aimud_stage_seconds', 'Time spent in each stage of a turn.', ['stage'])
+TURNS = Counter('aimud_turns_total', 'Story turns completed.', ['world'])
+TURN_ERRORS = Counter('aimud_turn_errors_total', 'Turns that failed with an exception.')
+QUEUE_WAIT_SECONDS = Histogram('aimud_queue_wait_seconds', 'Time an action waited in its world queue before its turn started.')
+QUEUE_DEPTH = Gauge('aimud_action_queue_depth', 'Actions waiting per world.', ['world'])
+
+# LLM calls
+LLM_REQUESTS = Counter('aimud_llm_requests_total', 'LLM calls by model and outcome (ok, error, cache_hit, retry, hedge, rejected, cancelled).', ['model', 'outcome'])
+LLM_BREAKER_OPEN = Gauge('aimud_llm_breaker_open', 'Whether calls to a model are paused by its circuit breaker (1) or not (0).', ['model'])
+LLM_TOKENS = Counter('aimud_llm_tokens_total', 'LLM tokens by model and kind (prompt, completion); reported by the API or estimated.', ['model', 'kind'])
+PROMPT_CHARS = Histogram('aimud_prompt_chars', 'Size of the prompts sent, in characters.', ['model'],
+                         buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000))
+
+# Connections
+CONNECTIONS = Gauge('aimud_connections', 'Open client connections.')
+OUTBOUND_BACKLOG = Gauge('aimud_outbound_backlog_frames', 'Frames waiting to be sent, summed over all clients.')
+
+
+@contextmanager
+def span(stage: str):
+    """ Time the block into aimud_stage_seconds{stage=...}, also when it raises. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes are too frequent to log
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """ Serve GET /metrics from a daemon thread. Returns the HTTP server, or None if the port is taken. """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on {host}:{port}: {e}")
+        return None
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    print(f"Metrics at http://{host}:{port}/metrics")
+    return server
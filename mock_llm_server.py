@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Local stub of an OpenAI-compatible chat completions endpoint, for tests and benchmarks.
+
+Answers every POST with a canned story paragraph, either as one JSON completion or, when the request
+sets "stream": true, as a server-sent-event stream of word-sized chunks. Requests whose first message
+is a system prompt (keyword extraction) get an empty JSON object as the completion.
+
+Latency and failures can be dialled in: a fixed delay (plus random jitter) before the first token,
+a token rate, and per-request probabilities of answering 500, answering 429, hanging past the
+client's read timeout, or dropping the connection halfway through a streamed reply.
+
+    python mock_llm_server.py --port 8000 --latency 0.3 --tokens-per-sec 40 --error-rate 0.05
+
+and point config.json at it:  "api_endpoint": "http://127.0.0.1:8000/v1/chat/completions"
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STORY_TEXT = ("The wind shifts as you move, carrying the scent of pine and wet stone. Somewhere beyond the ridge a bell "
+              "rings once, then falls silent, and the path ahead splits between a lantern-lit trail and a dark ravine.")
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like a real API endpoint
+
+    def log_message(self, format, *args):
+        pass  # Stay quiet under load
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        messages = body.get('messages') or [{}]
+        text = '{}' if messages[0].get('role') == 'system' else self.server.story_text
+        server = self.server
+
+        server.count('requests')
+        time.sleep(server.latency + random.uniform(0, server.latency_jitter))  # Time to first token
+        failure = server.pick_failure()
+        if failure == 'error':
+            return self.send_error_json(500, 'Injected server error')
+        if failure == 'rate_limit':
+            return self.send_error_json(429, 'Injected rate limit')
+        if failure == 'hang':
+            time.sleep(server.hang_seconds)  # Longer than the client is willing to wait
+            return self.send_error_json(504, 'Injected hang')
+
+        if body.get('stream'):
+            self.stream_completion(body.get('model', ''), text, drop=failure == 'disconnect')
+        else:
+            if failure == 'disconnect':
+                self.close_connection = True
+                return  # Hang up without an answer
+            time.sleep(server.token_delay * len(re.findall(r'\S+\s*', text)))  # Same generation time as streaming
+            self.send_json({'model': body.get('model', ''),
+                            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]})
+
+    def send_error_json(self, status, message):
+        payload = json.dumps({'error': {'message': message, 'code': status}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_json(self, data):
+        payload = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def stream_completion(self, model, text, drop=False):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')  # One HTTP chunk per event, like the real APIs
+        self.end_headers()
+        pieces = re.findall(r'\S+\s*', text)
+        for i, piece in enumerate(pieces):
+            if drop and i == len(pieces) // 2:
+                self.close_connection = True
+                return  # Injected disconnect: the stream just stops, without [DONE] or the last chunk
+            time.sleep(self.server.token_delay)
+            chunk = {'model': model, 'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}]}
+            self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")  # Terminating zero-length chunk
+
+    def write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+class MockLLMServer(ThreadingHTTPServer):
+    """ The stub endpoint and its knobs; `counts` tallies requests and injected failures. """
+
+    daemon_threads = True
+    FAILURES = ('error', 'rate_limit', 'hang', 'disconnect')
+
+    def __init__(self, address, token_delay=0.05, story_text=STORY_TEXT, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, rate_limit_rate=0.0, hang_rate=0.0, disconnect_rate=0.0, hang_seconds=300.0):
+        super().__init__(address, MockLLMHandler)
+        self.token_delay = token_delay
+        self.story_text = story_text
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.failure_rates = {'error': error_rate, 'rate_limit': rate_limit_rate, 'hang': hang_rate, 'disconnect': disconnect_rate}
+        self.hang_seconds = hang_seconds
+        self.counts = {'requests': 0}
+        self._counts_lock = threading.Lock()
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def pick_failure(self):
+        """ Draw which failure, if any, to inject into the current request. """
+        roll = random.random()
+        for failure in self.FAILURES:
+            roll -= self.failure_rates[failure]
+            if roll < 0:
+                self.count(failure)
+                return failure
+        return None
+
+def start_mock_server(host='127.0.0.1', port=8000, token_delay=0.05, story_text=STORY_TEXT, **faults):
+    """
+    Start the stub endpoint on a background thread and return the server (call shutdown() to stop it).
+    `faults` are the latency and failure-injection keyword arguments of MockLLMServer.
+    """
+    server = MockLLMServer((host, port), token_delay=token_delay, story_text=story_text, **faults)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--token-delay', type=float, default=0.05, help="Seconds between streamed chunks (and before a whole reply, per chunk)")
+    parser.add_argument('--tokens-per-sec', type=float, help="Token rate; overrides --token-delay")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds before the first token")
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help="Extra random latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument('--hang-rate', type=float, default=0.0, help="Fraction of requests that hang for --hang-seconds")
+    parser.add_argument('--disconnect-rate', type=float, default=0.0, help="Fraction of requests whose connection drops mid-reply")
+    parser.add_argument('--hang-seconds', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, help="Seed for failure injection, for repeatable runs")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    token_delay = 1.0 / args.tokens_per_sec if args.tokens_per_sec else args.token_delay
+    server = start_mock_server(args.host, args.port, token_delay, latency=args.latency, latency_jitter=args.latency_jitter,
+                               error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, hang_rate=args.hang_rate,
+                               disconnect_rate=args.disconnect_rate, hang_seconds=args.hang_seconds)
+    print(f"Mock LLM endpoint on http://{args.host}:{args.port}/v1/chat/completions (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(f"Requests: {server.counts}")
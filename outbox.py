@@ -0,0 +1,232 @@
+"""
+Per-connection outbound queues.
+
+Every client gets a bounded queue of encoded frames drained by its own writer, so a broadcast is one
+O(1) enqueue per client and a slow or stalled client only ever delays itself. A client whose queue
+overflows, or whose current send has been stuck for longer than the send deadline, is evicted: its
+socket is shut down, which also wakes up the reader blocked on it.
+
+Messages are queued as shared Frames and turned into bytes per client (compressed for clients that
+negotiated it). Whatever has piled up by the time the writer gets to it goes out in one write, so a
+burst of status lines costs one syscall instead of one each.
+"""
+import time
+import socket
+import asyncio
+import threading
+from collections import deque
+
+from protocol import Frame, send_buffers, IOV_MAX
+
+MAX_BACKLOG_BYTES = 1024 * 1024  # Bytes that may be waiting for one client before it is evicted
+SEND_DEADLINE = 10.0  # Seconds a single write may take before the client is evicted
+COALESCE_BYTES = 64 * 1024  # Queued frames are merged into writes of up to this many bytes
+
+
+def _take_batch(frames) -> tuple:
+    """
+    Pop the queued frames that go out in the next write: at least one, then as many as fit COALESCE_BYTES,
+    but no more than one sendmsg call takes (IOV_MAX). Returns (frames, bytes).
+    """
+    batch = [frames.popleft()]
+    size = len(batch[0])
+    while frames and size + len(frames[0]) <= COALESCE_BYTES and len(batch) < IOV_MAX:
+        size += len(frames[0])
+        batch.append(frames.popleft())
+    return batch, size
+
+
+class Outbox:
+    """
+    Bounded outbound queue of one socket, drained by a dedicated writer thread.
+
+    Args:
+    conn (socket.socket): The client socket. Once an Outbox exists, all sends must go through it.
+    name (str): Label used in logs and metrics (the peer address, then the username after login).
+    max_backlog_bytes (int): Queued bytes beyond which the client is evicted; a burst of small notices stays well below it.
+    send_deadline (float): Seconds a single write may take before the client is evicted, also when nothing more is queued.
+    """
+
+    def __init__(self, conn, name='', max_backlog_bytes=MAX_BACKLOG_BYTES, send_deadline=SEND_DEADLINE):
+        self.conn = conn
+        self.name = name
+        self.max_backlog_bytes = max_backlog_bytes
+        self.send_deadline = send_deadline
+        self.streaming = False  # Whether the client asked for story text as STREAM_DELTA frames
+        self.compress = False  # Whether the client negotiated compressed frames
+        self.evicted = None  # Reason string once the client has been evicted
+        self._frames = deque()
+        self._queued_bytes = 0
+        self._cond = threading.Condition()
+        self._closing = False
+        self._send_started = None  # Monotonic time the in-flight send started, None when idle
+        self._writer = threading.Thread(target=self._run, name=f'outbox-{name}', daemon=True)
+        self._writer.start()
+
+    def backlog(self) -> int:
+        """ Number of frames queued and not yet handed to the socket. """
+        return len(self._frames)
+
+    def queued_bytes(self) -> int:
+        """ Bytes of the frames queued and not yet handed to the socket. """
+        return self._queued_bytes
+
+    def send(self, message: str) -> bool:
+        return self.put(Frame(message))
+
+    def put(self, frame: Frame) -> bool:
+        """ Queue a frame. Returns False if the client is gone or has just been evicted. """
+        data = frame.encoded(self.compress)  # Outside the lock: compression happens at most once per frame
+        with self._cond:
+            if self._closing or self.evicted:
+                return False
+            started = self._send_started
+            if started is not None and time.monotonic() - started > self.send_deadline:
+                reason = f'send stalled for more than {self.send_deadline:.0f}s'
+            elif self._frames and self._queued_bytes + len(data) > self.max_backlog_bytes:
+                reason = f'outbound backlog exceeded {self.max_backlog_bytes} bytes'
+            else:
+                self._frames.append(data)
+                self._queued_bytes += len(data)
+                self._cond.notify()
+                return True
+        self.evict(reason)
+        return False
+
+    def evict(self, reason: str):
+        """ Drop the client: discard its backlog and shut the socket down. """
+        with self._cond:
+            if self.evicted:
+                return
+            self.evicted = reason
+            self._frames.clear()
+            self._queued_bytes = 0
+            self._cond.notify()
+        print(f"Evicting client {self.name}: {reason}")
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._frames and not self._closing and not self.evicted:
+                    self._cond.wait()
+                if self.evicted or not self._frames:
+                    return  # Evicted, or closing with nothing left to send
+                frames, size = _take_batch(self._frames)
+                self._queued_bytes -= size
+                self._send_started = time.monotonic()
+            try:
+                # The deadline is enforced by the write itself: a client that stopped reading is evicted even
+                # when no other frame comes along to notice the stall in put()
+                send_buffers(self.conn, frames, deadline=self._send_started + self.send_deadline)
+            except socket.timeout:
+                self.evict(f'send stalled for more than {self.send_deadline:.0f}s')
+                return
+            except OSError as e:
+                self.evict(f'send failed: {e}')
+                return
+            finally:
+                self._send_started = None
+
+    def close(self, timeout=None):
+        """ Stop accepting frames, let the writer flush what is queued, and wait for it to finish. """
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._writer.join(self.send_deadline if timeout is None else timeout)
+        if self._writer.is_alive():
+            self.evict('could not flush outbound backlog before closing')
+
+
+class AsyncOutbox:
+    """
+    asyncio counterpart of Outbox: a bounded queue per StreamWriter drained by its own task.
+
+    Must only be used from the event loop thread.
+    """
+
+    def __init__(self, writer, name='', max_backlog_bytes=MAX_BACKLOG_BYTES, send_deadline=SEND_DEADLINE):
+        self.writer = writer
+        self.name = name
+        self.max_backlog_bytes = max_backlog_bytes
+        self.send_deadline = send_deadline
+        self.streaming = False
+        self.compress = False
+        self.evicted = None
+        self._frames = deque()
+        self._queued_bytes = 0
+        self._ready = asyncio.Event()
+        self._closing = False
+        self._send_started = None
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def backlog(self) -> int:
+        return len(self._frames)
+
+    def queued_bytes(self) -> int:
+        return self._queued_bytes
+
+    def send(self, message: str) -> bool:
+        return self.put(Frame(message))
+
+    def put(self, frame: Frame) -> bool:
+        if self._closing or self.evicted:
+            return False
+        started = self._send_started
+        if started is not None and time.monotonic() - started > self.send_deadline:
+            self.evict(f'send stalled for more than {self.send_deadline:.0f}s')
+            return False
+        data = frame.encoded(self.compress)
+        if self._frames and self._queued_bytes + len(data) > self.max_backlog_bytes:
+            self.evict(f'outbound backlog exceeded {self.max_backlog_bytes} bytes')
+            return False
+        self._frames.append(data)
+        self._queued_bytes += len(data)
+        self._ready.set()
+        return True
+
+    def evict(self, reason: str):
+        if self.evicted:
+            return
+        self.evicted = reason
+        self._frames.clear()
+        self._queued_bytes = 0
+        self._ready.set()
+        print(f"Evicting client {self.name}: {reason}")
+        self.writer.transport.abort()
+
+    async def _run(self):
+        while True:
+            while not self._frames:
+                if self._closing or self.evicted:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+            if self.evicted:
+                return
+            frames, size = _take_batch(self._frames)
+            self._queued_bytes -= size
+            self._send_started = time.monotonic()
+            try:
+                self.writer.writelines(frames)
+                await asyncio.wait_for(self.writer.drain(), self.send_deadline)
+            except asyncio.TimeoutError:
+                self.evict(f'send stalled for more than {self.send_deadline:.0f}s')
+                return
+            except ConnectionError as e:
+                self.evict(f'send failed: {e}')
+                return
+            finally:
+                self._send_started = None
+
+    async def close(self):
+        """ Stop accepting frames and wait until the queued ones are flushed (or the client is evicted). """
+        self._closing = True
+        self._ready.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), self.send_deadline)
+        except asyncio.TimeoutError:
+            self.evict('could not flush outbound backlog before closing')
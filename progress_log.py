@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import shutil
+import time
+import struct
+import threading
+from array import array
+from itertools import accumulate
+
+# One index entry per record: byte offset in the log, byte length of the record line, character length of its text
+INDEX_ENTRY = struct.Struct('>QII')
+
+
+def _unpack_index(raw: bytes) -> tuple:
+    """
+    Split whole index entries into arrays of offsets, sizes and text lengths. The columns are cut out of
+    the raw bytes with strided slices instead of unpacking one tuple per record.
+    """
+    offsets, words = array('Q'), array('I')
+    offsets.frombytes(raw)
+    words.frombytes(raw)
+    if sys.byteorder == 'little':  # The index is big-endian
+        offsets.byteswap()
+        words.byteswap()
+    return offsets[0::2], words[2::4], words[3::4]
+
+
+class ProgressLog:
+    """
+    Append-only, segmented log of the story progress.
+
+    Each turn is one JSON line `{"turn", "author", "ts", "action", "text"}` in the log file. A binary
+    sidecar index (`<log>.idx`) stores the byte offset and text length of every record, so the tail of
+    the story can be read by seeking straight to the records that cover it instead of loading the whole
+    history. The full progress string of older versions is `" ".join(record["text"] for each record)`;
+    `tail_text(n)` returns exactly the last n characters of that string.
+
+    Args:
+    path (str): Path of the log file. The index lives next to it with an ".idx" suffix.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock = threading.RLock()
+        self._offsets = array('Q')
+        self._sizes = array('I')
+        self._cumulative = array('Q')  # Total characters of record texts up to and including each record
+        self._unsynced_since = None  # Monotonic time of the first append not yet fsynced
+        self._recover()
+        self._log = open(self.path, "ab")
+        self._index = open(self.index_path, "ab")
+
+    def _recover(self):
+        """
+        Load the index and reconcile it with the log after a crash.
+
+        The index is the checkpoint: it is loaded as a whole, and only the log records written after its
+        last entry are parsed again (a torn last record is cut off). The index file is only touched when it
+        has to change, so a clean start costs one read of it, whatever the length of the story.
+        """
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        log_size = os.path.getsize(self.path)
+
+        raw = b""
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                raw = f.read()
+        index_size = len(raw)
+        raw = raw[:len(raw) - len(raw) % INDEX_ENTRY.size]  # A torn last entry
+        if raw:
+            self._offsets, self._sizes, chars = _unpack_index(raw)
+            self._cumulative = array('Q', accumulate(chars))
+        # Drop index entries that point past the end of the log
+        n = len(self._offsets)
+        while n and self._offsets[n - 1] + self._sizes[n - 1] > log_size:
+            n -= 1
+        if n < len(self._offsets):
+            del self._offsets[n:], self._sizes[n:], self._cumulative[n:]
+
+        indexed_end = self._offsets[-1] + self._sizes[-1] if n else 0
+        replayed = []
+        if log_size > indexed_end:
+            # Records were appended without their index entries: index complete lines, drop a torn last line
+            with open(self.path, "rb") as f:
+                f.seek(indexed_end)
+                offset = indexed_end
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        text = json.loads(line)["text"]
+                    except (ValueError, KeyError):
+                        break
+                    replayed.append((offset, len(line), len(text)))
+                    offset += len(line)
+            if offset < log_size:
+                with open(self.path, "r+b") as f:
+                    f.truncate(offset)
+
+        if index_size != n * INDEX_ENTRY.size or replayed:
+            with open(self.index_path, "ab") as f:
+                f.truncate(n * INDEX_ENTRY.size)
+                for entry in replayed:
+                    f.write(INDEX_ENTRY.pack(*entry))
+        for offset, size, chars in replayed:
+            self._offsets.append(offset)
+            self._sizes.append(size)
+            self._cumulative.append((self._cumulative[-1] if self._cumulative else 0) + chars)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def char_length(self) -> int:
+        """ Length of the joined progress text, including the single spaces between records. """
+        with self.lock:
+            n = len(self._offsets)
+            return self._cumulative[-1] + n - 1 if n else 0
+
+    def append(self, text: str, author: str = "narrator", action: str = None) -> int:
+        """ Append one turn to the log and return its turn number. """
+        with self.lock:
+            turn = len(self._offsets)
+            record = {"turn": turn, "author": author, "ts": time.time(), "action": action, "text": text}
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            offset = self._log.tell()
+            self._log.write(line)
+            self._log.flush()
+            self._index.write(INDEX_ENTRY.pack(offset, len(line), len(text)))
+            self._index.flush()
+            self._offsets.append(offset)
+            self._sizes.append(len(line))
+            self._cumulative.append((self._cumulative[-1] if turn else 0) + len(text))
+            if self._unsynced_since is None:
+                self._unsynced_since = time.monotonic()
+            return turn
+
+    @property
+    def unsynced_since(self):
+        """ Monotonic time of the oldest append that may not be on disk yet, or None if every append is. """
+        return self._unsynced_since
+
+    def sync(self) -> bool:
+        """
+        Force the appended records and their index entries to disk (log first, so the index never gets
+        ahead of it). Appends are only flushed to the OS; a background writer calls this for a whole group
+        of them at once. Returns True if there was anything to sync.
+        """
+        with self.lock:
+            if self._unsynced_since is None or self._log.closed:
+                return False
+            os.fsync(self._log.fileno())
+            os.fsync(self._index.fileno())
+            self._unsynced_since = None
+            return True
+
+    def read(self, start: int = 0, end: int = None) -> list:
+        """ Return the records of turns [start, end) without touching any other part of the log. """
+        with self.lock:
+            n = len(self._offsets)
+            end = n if end is None else min(end, n)
+            start = max(start, 0)
+            if start >= end:
+                return []
+            first = self._offsets[start]
+            last = self._offsets[end - 1] + self._sizes[end - 1]
+            with open(self.path, "rb") as f:
+                f.seek(first)
+                raw = f.read(last - first)
+        return [json.loads(line) for line in raw.splitlines()]
+
+    def tail_turns(self, count: int) -> list:
+        """ Return the records of the last `count` turns. """
+        return self.read(len(self) - count) if count > 0 else []
+
+    def tail_text(self, chars: int) -> str:
+        """ Return the last `chars` characters of the joined progress text. """
+        if chars <= 0:
+            return ""
+        with self.lock:
+            n = len(self._offsets)
+            if not n:
+                return ""
+            total = self.char_length()
+            # Find the latest record whose start position still leaves `chars` characters to the end
+            start = n - 1
+            while start > 0 and total - (self._cumulative[start - 1] + start) < chars:
+                start -= 1
+            records = self.read(start, n)
+        return " ".join(record["text"] for record in records)[-chars:]
+
+    def tail_start(self, chars: int) -> int:
+        """ Return the first turn whose text reaches into the last `chars` characters of the joined progress text. """
+        with self.lock:
+            n = len(self._offsets)
+            if chars <= 0 or not n:
+                return n
+            position = self.char_length() - chars  # Where the tail starts in the joined text
+            # Turn i ends at self._cumulative[i] + i in the joined text (one space between turns)
+            low, high = 0, n
+            while low < high:
+                mid = (low + high) // 2
+                if self._cumulative[mid] + mid > position:
+                    high = mid
+                else:
+                    low = mid + 1
+            return low
+
+    def text(self) -> str:
+        """ Materialize the whole progress text. Prefer `tail_text` where possible. """
+        return " ".join(record["text"] for record in self.read())
+
+    def snapshot(self, path: str):
+        """ Copy the log (to `path`) and its index (to `path` + ".idx") as they are at one turn boundary. """
+        with self.lock:
+            shutil.copyfile(self.path, path)
+            shutil.copyfile(self.index_path, path + ".idx")
+
+    def close(self):
+        with self.lock:
+            self.sync()
+            self._log.close()
+            self._index.close()
@@ -0,0 +1,271 @@
+"""
+The wire protocol shared by the servers and every client.
+
+Each message is a frame: a 4-byte big-endian payload length followed by the UTF-8 payload. Frames
+larger than MAX_FRAME_SIZE are refused on both ends, so a corrupt or hostile length prefix cannot
+make a reader allocate gigabytes or wait forever for data that never comes.
+
+FrameReader reads frames through one reusable buffer: it receives with `recv_into` whatever the
+socket has (several small frames at a time, or a large frame in a few big chunks), slices frames out
+with memoryviews, and keeps partial headers and payloads across calls, so short reads and timeouts
+never desynchronize the stream. AsyncFrameReader does the same for an asyncio StreamReader. `send_frame` writes the header and payload with one scatter-gather
+`sendmsg` call, looping until everything is written.
+
+Compression is negotiated: a client that sends "C zlib" right after the welcome message (instead of
+going straight to R/L/S) is answered with the capabilities the server accepted, and from then on may
+receive zlib-compressed frames, marked by COMPRESSED_FLAG in the length prefix. Only payloads of at
+least COMPRESS_THRESHOLD bytes are compressed, and only if that makes them smaller. Clients that skip
+the handshake never see a flagged frame. FrameReader inflates flagged frames transparently.
+"""
+import os
+import time
+import zlib
+import select
+import socket
+import asyncio
+
+HEADER_SIZE = 4  # Bytes of the big-endian length prefix
+MAX_FRAME_SIZE = 4 * 1024 * 1024  # Largest payload either side accepts, in bytes
+READ_BUFFER_SIZE = 64 * 1024  # Initial size of a FrameReader's buffer; it grows for larger frames
+COMPRESSED_FLAG = 0x80000000  # Set in the length prefix of a zlib-compressed frame; never part of a valid length
+COMPRESS_THRESHOLD = 512  # Payloads shorter than this (in bytes) are always sent as they are
+COMPRESS_LEVEL = 6
+CAPABILITIES = ('zlib',)  # What a client may ask for with "C <capability> ..."
+
+# Story text for clients that turned streaming on arrives as a run of frames that start with this marker,
+# each carrying the next piece of text, and ends with a frame holding the bare marker
+STREAM_DELTA = '\x1e'
+
+
+def _iov_max() -> int:
+    """ Most buffers one sendmsg call accepts (more fail with EMSGSIZE); 1024 where the system does not say. """
+    try:
+        limit = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):  # No sysconf (Windows), or no such name
+        return 1024
+    return limit if limit > 0 else 1024
+
+IOV_MAX = _iov_max()
+
+
+class FrameTooLarge(ConnectionError):
+    """ A frame exceeds MAX_FRAME_SIZE. The stream cannot be resynchronized, so the connection must be dropped. """
+
+
+def check_frame_size(length: int, max_frame_size: int = MAX_FRAME_SIZE):
+    if length > max_frame_size:
+        raise FrameTooLarge(f'frame of {length} bytes exceeds the limit of {max_frame_size} bytes')
+
+def parse_header(header, max_frame_size: int = MAX_FRAME_SIZE) -> tuple:
+    """ Return (payload length, whether the payload is compressed) of a frame header. Raises FrameTooLarge above the limit. """
+    length = int.from_bytes(header, byteorder='big')
+    compressed = bool(length & COMPRESSED_FLAG)
+    length &= ~COMPRESSED_FLAG
+    check_frame_size(length, max_frame_size)
+    return length, compressed
+
+def decode_payload(payload, compressed: bool, max_frame_size: int = MAX_FRAME_SIZE):
+    """ Inflate a compressed payload, refusing to produce more than `max_frame_size` bytes; plain payloads are returned as they are. """
+    if not compressed:
+        return payload
+    inflater = zlib.decompressobj()
+    try:
+        data = inflater.decompress(payload, max_frame_size)
+    except zlib.error as e:
+        raise ConnectionError(f'corrupt compressed frame: {e}') from e
+    if inflater.unconsumed_tail:
+        raise FrameTooLarge(f'compressed frame inflates beyond the limit of {max_frame_size} bytes')
+    return data
+
+def encode_frame(data, compress=False) -> bytes:
+    """ Build a length-prefixed frame from a string (or bytes) in one buffer, compressed if asked and worthwhile. """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    check_frame_size(len(data))
+    flag = 0
+    if compress and len(data) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(data, COMPRESS_LEVEL)
+        if len(compressed) < len(data):
+            data, flag = compressed, COMPRESSED_FLAG
+    return (len(data) | flag).to_bytes(HEADER_SIZE, byteorder='big') + data
+
+def _wait_writable(sock, timeout: float) -> bool:
+    """ Wait up to `timeout` seconds for room in the send buffer of `sock`. Returns False if there was none. """
+    if hasattr(select, 'poll'):  # select() cannot watch descriptors above FD_SETSIZE
+        poller = select.poll()
+        poller.register(sock, select.POLLOUT)
+        return bool(poller.poll(timeout * 1000))
+    return bool(select.select([], [sock], [], timeout)[1])
+
+def send_buffers(sock, buffers, deadline: float = None):
+    """
+    Write several buffers with scatter-gather sendmsg calls of at most IOV_MAX buffers, looping on partial writes.
+
+    Args:
+    deadline (float): Optional time.monotonic() by which everything must be written. The buffers then only go
+        out as fast as the peer makes room for them, so a peer that stopped reading cannot block the caller past it.
+
+    Raises:
+    socket.timeout: If the deadline passes first; part of the buffers may have been written.
+    """
+    if not hasattr(sock, 'sendmsg'):  # Windows sockets have no sendmsg
+        sock.sendall(b''.join(buffers))
+        return
+    flags = 0 if deadline is None else getattr(socket, 'MSG_DONTWAIT', 0)
+    buffers = list(buffers)
+    while buffers:
+        try:
+            sent = sock.sendmsg(buffers[:IOV_MAX], [], flags)
+        except BlockingIOError:  # Send buffer full: wait for the peer to read, but not past the deadline
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not _wait_writable(sock, remaining):
+                raise socket.timeout('the peer did not read in time')
+            continue
+        while sent:  # Drop whatever was written and retry with the rest
+            if sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            else:
+                buffers[0] = memoryview(buffers[0])[sent:]
+                sent = 0
+
+def send_frame(sock, data):
+    """ Send one uncompressed frame: header and payload go out in a single write, without copying them together. """
+    payload = data.encode('utf-8') if isinstance(data, str) else data
+    check_frame_size(len(payload))
+    send_buffers(sock, [len(payload).to_bytes(HEADER_SIZE, byteorder='big'), memoryview(payload)])
+
+
+class Frame:
+    """
+    One outgoing message, encoded once and shared by every client it is queued for.
+
+    The plain frame is built up front; the compressed one only when the first client that negotiated
+    compression asks for it, and then reused for all the others.
+    """
+
+    __slots__ = ('payload', 'plain', '_compressed')
+
+    def __init__(self, message):
+        self.payload = message.encode('utf-8') if isinstance(message, str) else message
+        self.plain = encode_frame(self.payload)
+        self._compressed = None
+
+    def encoded(self, compress: bool) -> bytes:
+        """ The bytes to send to a client, compressed if it negotiated compression and the payload is large enough. """
+        if not compress or len(self.payload) < COMPRESS_THRESHOLD:
+            return self.plain
+        if self._compressed is None:
+            self._compressed = encode_frame(self.payload, compress=True)
+        return self._compressed
+
+
+class FrameReader:
+    """
+    Incremental frame reader over a blocking socket.
+
+    Not thread-safe: each socket has exactly one reader, used by the one thread that receives from it.
+
+    Args:
+    sock (socket.socket): The connected socket to read from.
+    max_frame_size (int): Largest payload accepted, in bytes.
+    buffer_size (int): Initial buffer size, in bytes.
+    """
+
+    def __init__(self, sock, max_frame_size=MAX_FRAME_SIZE, buffer_size=READ_BUFFER_SIZE):
+        self.sock = sock
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First byte not yet handed out
+        self._end = 0  # End of the bytes received so far
+        self.arrived = None  # time.perf_counter() when the header of the last frame was in
+
+    def _fill(self, needed: int) -> bool:
+        """ Receive until at least `needed` unread bytes are buffered. Returns False if the peer closed the connection first. """
+        while self._end - self._start < needed:
+            if self._start + needed > len(self._buffer):
+                self._compact(needed)
+            received = self.sock.recv_into(self._view[self._end:])
+            if not received:
+                return False
+            self._end += received
+        return True
+
+    def _compact(self, needed: int):
+        """ Move the unread bytes to the front of the buffer, growing it if `needed` bytes would not fit. """
+        unread = self._end - self._start
+        if needed > len(self._buffer):
+            self._view.release()
+            buffer = bytearray(max(needed, 2 * len(self._buffer)))
+            buffer[:unread] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+            self._view = memoryview(self._buffer)
+        else:
+            self._view[:unread] = self._view[self._start:self._end]
+        self._start, self._end = 0, unread
+
+    def read_frame(self):
+        """
+        Return the payload of the next frame, or None once the connection is closed.
+
+        A plain payload is a memoryview into the reader's buffer, only valid until the next call;
+        a compressed one is inflated into new bytes.
+
+        Raises:
+        FrameTooLarge: If the peer announces a frame above the limit.
+        socket.timeout: If the socket has a timeout and it expires; the partial frame is kept for the next call.
+        """
+        if not self._fill(HEADER_SIZE):
+            return None
+        self.arrived = time.perf_counter()
+        length, compressed = parse_header(self._view[self._start:self._start + HEADER_SIZE], self.max_frame_size)
+        if not self._fill(HEADER_SIZE + length):
+            return None
+        start = self._start + HEADER_SIZE
+        self._start = start + length
+        if self._start == self._end:
+            self._start = self._end = 0  # Buffer drained: the next frame starts at the front again
+        return decode_payload(self._view[start:start + length], compressed, self.max_frame_size)
+
+    def read(self):
+        """ Return the next frame decoded as text, or None once the connection is closed. """
+        payload = self.read_frame()
+        return None if payload is None else str(payload, 'utf-8')
+
+
+class AsyncFrameReader:
+    """
+    Frame reader over an asyncio StreamReader, which does the buffering itself.
+
+    Args:
+    reader (asyncio.StreamReader): The connection to read from.
+    max_frame_size (int): Largest payload accepted, in bytes.
+    """
+
+    def __init__(self, reader, max_frame_size=MAX_FRAME_SIZE):
+        self.reader = reader
+        self.max_frame_size = max_frame_size
+        self.arrived = None  # time.perf_counter() when the header of the last frame was in
+
+    async def read_frame(self):
+        """
+        Return the payload of the next frame, or None once the connection is closed.
+
+        Raises:
+        FrameTooLarge: If the peer announces a frame above the limit.
+        """
+        try:
+            header = await self.reader.readexactly(HEADER_SIZE)
+            self.arrived = time.perf_counter()
+            length, compressed = parse_header(header, self.max_frame_size)
+            payload = await self.reader.readexactly(length)
+        except FrameTooLarge:
+            raise  # The stream cannot be resynchronized; the caller drops the client
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+        return decode_payload(payload, compressed, self.max_frame_size)
+
+    async def read(self):
+        """ Return the next frame decoded as text, or None once the connection is closed. """
+        payload = await self.read_frame()
+        return None if payload is None else str(payload, 'utf-8')
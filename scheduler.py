@@ -0,0 +1,268 @@
+import time
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+from metrics import QUEUE_WAIT_SECONDS, TURN_ERRORS
+
+DEFAULT_QUEUE_DEPTH = 20  # Actions that may wait per game
+DEFAULT_PER_PLAYER_DEPTH = 3  # Actions that may wait per player
+MIN_TURN_WORKERS = 8  # Turn workers available however few worlds are loaded
+MAX_TURN_WORKERS = 256  # Turn workers at most, however many worlds are loaded
+TURN_WORKERS_PER_WORLD = 1  # A world runs one turn at a time, so one worker per loaded world lets them all run at once
+BACKGROUND_WORKERS = 4  # Workers for keyword extraction and summaries, apart from the turns
+
+
+class WorkerPool:
+    """
+    Thread pool whose size can be raised while it runs.
+
+    Workers are started on demand, when work is submitted and none is idle, up to `max_workers`; they
+    stay around once started. Unlike ThreadPoolExecutor, the limit can be changed later, so the turn
+    pool can grow with the number of worlds a server hosts.
+
+    Args:
+    max_workers (int): Most workers running at once.
+    name (str): Prefix of the worker thread names.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.name = name
+        self._items = deque()  # (future, fn, args, kwargs) not taken by a worker yet
+        self._workers = []
+        self._idle = 0  # Workers waiting for an item
+        self._cond = threading.Condition()
+
+    def set_max_workers(self, max_workers: int):
+        """ Change the limit. Lowering it keeps the workers already running, but starts no new ones above it. """
+        with self._cond:
+            self.max_workers = max_workers
+
+    def __len__(self) -> int:
+        """ Workers started so far. """
+        return len(self._workers)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self._cond:
+            self._items.append((future, fn, args, kwargs))
+            if self._idle >= len(self._items):
+                self._cond.notify()  # An idle worker takes it
+            elif len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._run, name=f'{self.name}_{len(self._workers)}', daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            # Otherwise every worker is busy and the item waits for the first one that finishes
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._idle += 1
+                    self._cond.wait()
+                    self._idle -= 1
+                future, fn, args, kwargs = self._items.popleft()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            del future, fn, args, kwargs  # Drop references to finished work while idle
+
+
+# Turns of every game run on this pool; a game only occupies a worker while it has queued actions
+turn_executor = WorkerPool(MIN_TURN_WORKERS, 'turn')
+# Keyword extraction and summaries run here, so background work never holds a worker a turn is waiting for
+background_executor = WorkerPool(BACKGROUND_WORKERS, 'background')
+turn_workers_min = MIN_TURN_WORKERS
+turn_workers_max = MAX_TURN_WORKERS
+
+
+def configure_pools(min_turn_workers: int = None, max_turn_workers: int = None, background_workers: int = None):
+    """ Set the bounds of the turn pool and the size of the background pool, e.g. from the command line. """
+    global turn_workers_min, turn_workers_max
+    if min_turn_workers is not None:
+        turn_workers_min = min_turn_workers
+    if max_turn_workers is not None:
+        turn_workers_max = max_turn_workers
+    if background_workers is not None:
+        background_executor.set_max_workers(background_workers)
+    turn_executor.set_max_workers(max(turn_workers_min, min(turn_workers_max, turn_executor.max_workers)))
+
+def scale_turn_pool(worlds: int) -> int:
+    """ Size the turn pool for `worlds` loaded worlds, within its bounds. Returns the new limit. """
+    size = max(turn_workers_min, min(turn_workers_max, worlds * TURN_WORKERS_PER_WORLD))
+    turn_executor.set_max_workers(size)
+    return size
+
+
+class QueueFull(Exception):
+    """ Raised when an action cannot be queued because the game's or the player's queue is full. """
+
+
+class ActionScheduler:
+    """
+    Queues player actions for one game and runs them one turn at a time, in fair order.
+
+    Every player has their own FIFO of pending actions and players take turns round-robin, so one player
+    sending many actions cannot starve the others. Turns run on the shared `turn_executor`: while the
+    queue is non-empty the scheduler keeps one job there that drains it, and holds no thread otherwise.
+
+    With `merge=True`, a turn takes every action queued so far (in fair order) and hands them to
+    `run_turn` together, so a burst of simultaneous actions costs one story continuation instead of one each.
+
+    Args:
+    run_turn (callable): run_turn(actions) performs one turn; `actions` is a list of (player, text) tuples.
+    max_depth (int): Maximum number of actions waiting in the whole game.
+    max_per_player (int): Maximum number of actions waiting for one player.
+    merge (bool): Whether to combine all waiting actions into a single turn.
+    executor (Executor): Where turns run; defaults to the shared `turn_executor`.
+    """
+
+    def __init__(self, run_turn, max_depth=DEFAULT_QUEUE_DEPTH, max_per_player=DEFAULT_PER_PLAYER_DEPTH, merge=False, executor=None):
+        self.run_turn = run_turn
+        self.max_depth = max_depth
+        self.max_per_player = max_per_player
+        self.merge = merge
+        self.executor = executor or turn_executor
+        self._lock = threading.Lock()
+        self._queues = OrderedDict()  # player -> deque of (text, reply, time queued); order is the round-robin order
+        self._size = 0
+        self._running = False
+
+    def __len__(self) -> int:
+        return self._size
+
+    def submit(self, player: str, text: str, reply=None) -> int:
+        """
+        Queue an action and return its position: 0 if its turn starts right away, n if n actions run before it.
+        `reply(message)` is used to tell the player when their position in the queue changes.
+
+        Raises:
+        QueueFull: If the game or the player already has the maximum number of actions waiting.
+        """
+        with self._lock:
+            if self._size >= self.max_depth:
+                raise QueueFull(f"the action queue is full ({self.max_depth} actions waiting)")
+            queue = self._queues.setdefault(player, deque())
+            if len(queue) >= self.max_per_player:
+                raise QueueFull(f"you already have {self.max_per_player} actions waiting")
+            queue.append((text, reply, time.monotonic()))
+            self._size += 1
+            position = self._position(player, len(queue) - 1) + (1 if self._running else 0)
+            if not self._running:
+                self._running = True
+                self.executor.submit(self._drain)
+        return position
+
+    def _fair_order(self):
+        """ Yield (player, index in their queue) of every waiting action, in the order they will run. """
+        depth = 0
+        while True:
+            found = False
+            for player, queue in self._queues.items():
+                if depth < len(queue):
+                    found = True
+                    yield player, depth
+            if not found:
+                return
+            depth += 1
+
+    def _position(self, player, index) -> int:
+        for position, entry in enumerate(self._fair_order()):
+            if entry == (player, index):
+                return position
+        return self._size
+
+    def _next_batch(self) -> list:
+        """ Pop the next action, or every waiting action in fair order when merging. """
+        batch = []
+        while self._queues and (self.merge or not batch):
+            player, queue = next(iter(self._queues.items()))
+            text, reply, queued_at = queue.popleft()
+            self._size -= 1
+            QUEUE_WAIT_SECONDS.observe(time.monotonic() - queued_at)
+            batch.append((player, text, reply))
+            # Rotate the player to the back of the round-robin, or drop them once they have nothing left
+            del self._queues[player]
+            if queue:
+                self._queues[player] = queue
+        return batch
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                batch = self._next_batch()
+                if not batch:
+                    self._running = False
+                    return
+                waiting = [(player, index, queue[index][1]) for player, queue in self._queues.items() for index in range(len(queue))]
+                positions = {(player, index): position for position, (player, index) in enumerate(self._fair_order())}
+            for player, index, reply in waiting:
+                if reply is not None:
+                    reply(f"[Your action is queued: {positions[(player, index)] + 1} ahead of it.]")
+            try:
+                self.run_turn([(player, text) for player, text, _ in batch])
+            except Exception as e:
+                TURN_ERRORS.inc()
+                print(f"Error while running a turn: {e}")
+
+
+class PipelineStage:
+    """
+    Background stage that processes items one at a time, in submission order, off the action path.
+
+    Items wait in an unbounded FIFO that is drained by a job on the background pool while there is work,
+    so a game needs no dedicated thread for it. `on_done(item, result)` is called after each item, which
+    lets the stage report completion as an event instead of blocking its caller.
+
+    Args:
+    work (callable): work(item) processes one item and returns a result.
+    on_done (callable): Optional on_done(item, result), called after each item (result is None on error).
+    executor (Executor): Where the stage runs; defaults to the shared `background_executor`.
+    """
+
+    def __init__(self, work, on_done=None, executor=None):
+        self.work = work
+        self.on_done = on_done
+        self.executor = executor or background_executor
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._running = False
+
+    def __len__(self) -> int:
+        """ Items queued or being processed. """
+        return len(self._items) + (1 if self._running else 0)
+
+    def submit(self, item):
+        with self._cond:
+            self._items.append(item)
+            if not self._running:
+                self._running = True
+                self.executor.submit(self._drain)
+
+    def _drain(self):
+        while True:
+            with self._cond:
+                if not self._items:
+                    self._running = False
+                    self._cond.notify_all()
+                    return
+                item = self._items.popleft()
+            try:
+                result = self.work(item)
+            except Exception as e:
+                print(f"Error in background stage: {e}")
+                result = None
+            if self.on_done is not None:
+                try:
+                    self.on_done(item, result)
+                except Exception as e:
+                    print(f"Error reporting background stage result: {e}")
+
+    def join(self, timeout=None) -> bool:
+        """ Wait until every submitted item has been processed. Returns False on timeout. """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._running and not self._items, timeout)
@@ -1,216 +1,287 @@
+import time
 import socket
-import hashlib
-import sqlite3
+import logging
 import threading
+from outbox import Outbox
+from protocol import FrameReader, FrameTooLarge, CAPABILITIES
+from user_store import UserStore
+from admin import AdminConsole, start_admin_server, stop_admin_server, ADMIN_SOCKET
+from metrics import span, start_metrics_server, METRICS_PORT, STAGE_SECONDS, CONNECTIONS, OUTBOUND_BACKLOG, QUEUE_DEPTH
 
-# Database setup
-db_conn = sqlite3.connect('user.db', check_same_thread=False)
-c = db_conn.cursor()
-c.execute('''CREATE TABLE IF NOT EXISTS users (username TEXT UNIQUE, password_hash TEXT)''')
-db_conn.commit()
+# Database setup: accounts (and sessions) are read and written through a small connection pool
+users = UserStore()
 
 # Server setup
 shutdown_event = threading.Event()
-connections = []  # List to keep track of all active connections
-lock = threading.Lock()  # Lock for managing access to the connections list
+connections = {}  # Active connections: socket -> Outbox that owns all writes to it
+lock = threading.Lock()  # Lock for managing access to the connections dict
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def send_long_data(conn, data):
-    """ Send long data reliably over a socket connection. """
-    data = data.encode('utf-8')  # Ensure the data is in bytes
-    length = len(data)
-    conn.send(length.to_bytes(4, byteorder='big'))  # Send the length of data first
-    conn.send(data)  # Send the data
-
-def broadcast(message):
-    """ Send a message to all connected clients, ensuring full transmission """
+def connection_backlogs():
+    """ Return the number of frames waiting to be sent, per connected client. """
     with lock:
-        for conn in connections:
-            try:
-                send_long_data(conn, message)
-            except Exception as e:
-                print(f"Error sending message: {e}")
-                connections.remove(conn)
-
-def recv_long_data(conn):
-    """ Receive long data reliably from a socket connection. """
-    length_bytes = conn.recv(4)  # First receive 4 bytes for the length
-    if not length_bytes:
-        return None
-    length = int.from_bytes(length_bytes, byteorder='big')  # Convert bytes to int
-    data = b''
-    while len(data) < length:
-        packet = conn.recv(length - len(data))  # Receive the remaining bytes
-        if not packet:
-            break  # Connection closed
-        data += packet
-    return data.decode('utf-8')
-
-action_in_progress = False
-action_lock = threading.Lock()
-
-
-
-
-
-
-import os
-import json
-from keywords import create_graph, spot_keywords, extract_keywords
-from llm import continueStory
-
-# File Path
-GAME_STATE_FILE = "game.txt"
-
-def load_game_state():
-    """ Load the current game state from a file. """
-    if os.path.exists(GAME_STATE_FILE):
-        with open(GAME_STATE_FILE, "r") as file:
-            return json.load(file)
-    return {"overall_context": "", "keywords": {}, "progress": ""}
-
-def save_game_state(state):
-    """ Save the current game state to a file. """
-    with open(GAME_STATE_FILE, "w") as file:
-        json.dump(state, file, indent=4)
-
-
-
-
+        return {outbox.name: outbox.backlog() for outbox in connections.values()}
 
-def continue_story(user_input, user_name) -> str:
-    """ Process user input and update the game state with dynamic context windows based on specified coefficients. """
-    state = load_game_state()
-    keywords = state["keywords"]
-    overall_context = state["overall_context"]
-    full_progress = state["progress"]
-    base_window_size = state.get("text_window_size", 1000)  # Base context window size
-    word_search_depth = state.get("word_search_depth", 2)
 
-    # Load model configuration
-    with open('config.json', 'r') as f:
-        config = json.load(f)
-    story_model = config['models']['story_continuation']
 
-    # Coefficients for various uses of the window
-    coeff_continuation = 1.0
-    coeff_keyword_spotting_continuation = 0.5
-    coeff_keyword_extraction = 1.0  # Since we use the new segment
+from world import WorldRegistry
+from scheduler import QueueFull, configure_pools, MIN_TURN_WORKERS, MAX_TURN_WORKERS, BACKGROUND_WORKERS
+from sessions import SessionStore
 
-    # Calculate window sizes based on coefficients
-    window_for_continuation = int(base_window_size * coeff_continuation)
-    window_for_keyword_spotting = int(base_window_size * coeff_keyword_spotting_continuation)
+HISTORY_PAGE_TURNS = 10  # Turns per "/history" page; a login shows the latest page
 
-    # Truncate the progress for GPT model processing and keyword spotting
-    progress_for_continuation = full_progress[-window_for_continuation:]
-    progress_for_keyword_spotting = full_progress[-window_for_keyword_spotting:]
+# Every game this process hosts; a world's state is loaded when the first player enters it
+worlds = WorldRegistry()
 
-    # Create a graph from current keywords
-    keyword_graph = create_graph(keywords, directed=False)
+# Tokens that let a dropped client resume its session ("S <token> <turn>") without logging in again
+sessions = SessionStore(users)
 
-    # Spot keywords in the context window specifically for keyword spotting
-    relevant_keywords = spot_keywords(progress_for_keyword_spotting + " " + user_input, keywords, depth=word_search_depth, graph=keyword_graph)
+# Gauges read at scrape time (the asyncio server points them at its own connections and worlds)
+CONNECTIONS.set_function(lambda: len(connections))
+OUTBOUND_BACKLOG.set_function(lambda: sum(connection_backlogs().values()))
+QUEUE_DEPTH.set_function(lambda: {(world.name,): len(world.scheduler) for world in worlds.loaded()})
 
-    # Update progress and context using GPT model with filtered keywords
-    new_progress_segment = continueStory(progress_for_continuation, overall_context, user_name, user_input, {k: keywords[k] for k in relevant_keywords if k in keywords}, model=story_model)
-    full_progress += " " + new_progress_segment  # Append new segment to full progress
 
-    # Save the full progress back to state
-    state["progress"] = full_progress
-
-    save_game_state(state)
-
-    # Generate and return response to the server
-    return new_progress_segment
-
-def extract_key_words(new_progress_segment):
-    state = load_game_state()
-    keywords = state["keywords"]
-    overall_context = state["overall_context"]
-    full_progress = state["progress"]
-    base_window_size = state.get("text_window_size", 1000)  # Base context window size
-    
-    keyword_graph = create_graph(keywords, directed=False)
-
-    # Re-run keyword spotting on the new progress segment
-    new_relevant_keywords = spot_keywords(new_progress_segment, keywords, depth=2, graph=keyword_graph)
-
-    # Extract and update keywords from the new story segment using the latest spotted keywords
-    new_keywords = extract_keywords({k: keywords[k] for k in new_relevant_keywords if k in keywords}, new_progress_segment)
-    if new_keywords: 
-        state["keywords"].update(new_keywords)
-
-    # Save the updated game state
-    save_game_state(state)
+def queue_action(world, username, user_input, reply):
+    """ Queue a player's action in their world and tell them where it stands. """
+    try:
+        with span("enqueue"):
+            position = world.scheduler.submit(username, user_input, reply=reply)
+    except QueueFull as e:
+        reply(f"[Your action was not queued: {e}. Please wait.]")
+        return
+    if position:
+        reply(f"[Your action is queued: {position} ahead of it.]")
+
+def handle_stream_command(outbox, command):
+    """ Handle "/stream on|off", which switches a client between whole and streamed story text. """
+    args = command.split()[1:]
+    if args and args[0].lower() in ('on', 'off'):
+        outbox.streaming = args[0].lower() == 'on'
+        outbox.send(f"[Streaming {'enabled' if outbox.streaming else 'disabled'}.]")
+    else:
+        outbox.send("[Usage: /stream on|off]")
+
+def list_worlds(registry, outbox, current):
+    """ Handle "/worlds": list the worlds with the number of players in each loaded one. """
+    loaded = {world.name: world for world in registry.loaded()}
+    lines = []
+    for name in registry.names():
+        players = len(loaded[name].players()) if name in loaded else 0
+        marker = " (you are here)" if name == current.name else ""
+        lines.append(f"  {name}: {players} player(s){marker}")
+    outbox.send("[Worlds:]\n" + "\n".join(lines))
+
+def find_world(registry, name):
+    """ Return the world called `name`, loading it if needed, or None if the name is empty or unknown. """
+    if not name:
+        return None
+    try:
+        return registry.get(name)
+    except KeyError:
+        return None
 
-    return None
+def read_page(world, since=None) -> tuple:
+    """
+    Read the story a player is sent on entering a world: the latest HISTORY_PAGE_TURNS turns, or the turns
+    from `since` on when resuming a session, capped at the same page. Returns (first turn sent, total turns,
+    text). It reads the progress log, so the asyncio server calls it off the event loop.
+    """
+    progress = world.state.progress
+    total = len(progress)
+    start = max(total - HISTORY_PAGE_TURNS, 0)
+    if since is not None:
+        start = max(start, min(max(since, 0), total))
+    return start, total, " ".join(record["text"] for record in progress.read(start, total))
+
+def send_progress(outbox, world, header, since=None, page=None) -> int:
+    """
+    Send the story of a world: the latest page of turns, or the turns from `since` on, at most a page of them.
+    `page` is what read_page returned, if it was read already. Returns the number of turns the client has
+    now been given, the turn to resume from.
+    """
+    start, total, text = page or read_page(world, since)
+    outbox.send(f"{header}\n\n{text}\n")
+    first = 0 if since is None else min(max(since, 0), total)
+    if start > first:
+        missed = "" if since is None else " you missed"
+        outbox.send(f"[Showing the last {total - start} of the {total - first} turns{missed}. Type /history 2 for older ones.]")
+    return total
+
+def send_history(outbox, world, command):
+    """ Handle "/history [page]": page 1 is the latest HISTORY_PAGE_TURNS turns, page 2 the ones before, and so on. """
+    outbox.send(history_page(world, command))
+
+def history_page(world, command) -> str:
+    """ The reply to "/history [page]". Reads the progress log, so the asyncio server calls it off the event loop. """
+    args = command.split()[1:]
+    if args and not args[0].isdigit():
+        return "[Usage: /history [page]]"
+    page = max(int(args[0]) if args else 1, 1)
+    progress = world.state.progress
+    total = len(progress)
+    pages = max((total + HISTORY_PAGE_TURNS - 1) // HISTORY_PAGE_TURNS, 1)
+    end = max(total - (page - 1) * HISTORY_PAGE_TURNS, 0)
+    start = max(end - HISTORY_PAGE_TURNS, 0)
+    lines = []
+    for record in progress.read(start, end):
+        action = f" ({record['author']}: {record['action']})" if record.get("action") else ""
+        lines.append(f"#{record['turn']}{action} {record['text']}")
+    if not lines:
+        return f"[History of {world.name} has {pages} page(s); there is no page {page}.]"
+    return f"[History of {world.name}, page {page} of {pages} (turns {start}-{end - 1}):]\n" + "\n".join(lines)
+
+def send_session(outbox, token, turn):
+    """ Tell the client its session token and how many turns it has; it resumes with "S <token> <turn>". """
+    outbox.send(f"[Session: {token} {turn}]")
+
+def enter_world(world, outbox, username, previous=None, resumed=False, since=None, page=None) -> int:
+    """
+    Move a player into `world` (out of `previous`, if any) and send them its story: the latest page,
+    or, when `resumed` with the turn count of the client, the turns from `since` on (at most a page).
+    `page` is the story as read_page(world, since) returned it, if the caller read it already.
+    Returns the turn the client is at.
+    """
+    if previous is not None:
+        previous.leave(outbox)
+        previous.broadcast(f"[{username} leaves for {world.name}.]")
+        world.join(outbox, username)
+        turn = send_progress(outbox, world, f"[You are now in {world.name}.] Current Progress:", page=page)
+        world.broadcast(f"[{username} arrives from {previous.name}.]")
+        return turn
+
+    world.join(outbox, username)
+    if not resumed:
+        turn = send_progress(outbox, world, "Login successful! Current Progress:", page=page)
+        world.broadcast(f"[{username} logs in.]")
+    else:
+        header = "Session resumed! Current Progress:" if since is None else f"Session resumed! Progress since turn {since}:"
+        turn = send_progress(outbox, world, header, since=since, page=page)
+        world.broadcast(f"[{username} reconnects.]")
+    outbox.send(f"[You are in {world.name}. Type /worlds to list the worlds, /world <name> to move and /history to read back.]")
+    return turn
+
+def open_session(argument):
+    """
+    Look up "S <token> [<turn>]": return (token, username, world name, turn) of the session to resume, or
+    None if the token is unknown or expired. The player is then sent the turns from <turn> on, at most a
+    page of them; without a valid <turn> (None) they get the latest page, as after a login.
+    """
+    token, _, seen = argument.strip().partition(' ')
+    found = sessions.resume(token) if token else None
+    if found is None:
+        return None
+    username, world_name = found
+    seen = seen.strip()
+    return token, username, world_name, int(seen) if seen.isdigit() else None
+
+def negotiate(outbox, argument):
+    """ Answer a client's "C <capabilities>" frame with the ones the server accepts, and turn them on. """
+    accepted = [capability for capability in argument.split() if capability in CAPABILITIES]
+    outbox.send(f"[Capabilities: {' '.join(accepted)}]")
+    outbox.compress = 'zlib' in accepted  # Frames sent from now on may be compressed
+
+def handle_command(registry, outbox, world, command) -> bool:
+    """ Handle the commands that do not change the player's world. Returns False if `command` is not one of them. """
+    if command.startswith('/stream'):
+        handle_stream_command(outbox, command)
+    elif command == '/worlds':
+        list_worlds(registry, outbox, world)
+    elif command == '/history' or command.startswith('/history '):
+        send_history(outbox, world, command)
+    else:
+        return False
+    return True
 
 
 def handle_client(conn):
-    global action_in_progress
+    host, port = conn.getpeername()[:2]
+    outbox = Outbox(conn, name=f"{host}:{port}")
+    reader = FrameReader(conn)  # Every frame from this client is read through one buffer
+    world = None  # The world the player is in once logged in
     with lock:
-        connections.append(conn)
+        connections[conn] = outbox
     try:
-        send_long_data(conn, 'Welcome to the Game! Do you want to [R]egister or [L]ogin?')
-        mode = recv_long_data(conn).strip().upper()
+        outbox.send('Welcome to the Game! Do you want to [R]egister or [L]ogin?')
+        # "L" logs into the default world, "L <world>" into another one, "S <token> <turn>" resumes a session
+        mode, _, argument = (reader.read() or '').strip().partition(' ')
+        if mode.upper() == 'C':  # Optional capability handshake first; older clients go straight to R/L/S
+            negotiate(outbox, argument)
+            mode, _, argument = (reader.read() or '').strip().partition(' ')
+        mode = mode.upper()
 
         if mode == 'R':
-            send_long_data(conn, 'Enter username: ')
-            username = recv_long_data(conn).strip()
-            send_long_data(conn, 'Enter password: ')
-            password = recv_long_data(conn).strip()
-            password_hash = hash_password(password)
-            try:
-                c.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)', (username, password_hash))
-                db_conn.commit()
-                send_long_data(conn, 'Registration successful! You can now login.\n')
-            except sqlite3.IntegrityError:
-                send_long_data(conn, 'Username already exists. Please try again.\n')
+            outbox.send('Enter username: ')
+            username = (reader.read() or '').strip()
+            outbox.send('Enter password: ')
+            password = (reader.read() or '').strip()
+            if users.register(username, password):
+                outbox.send('Registration successful! You can now login.\n')
+            else:
+                outbox.send('Username already exists. Please try again.\n')
             return  # Exit after registration to prompt for login
         elif mode == 'L':
-            send_long_data(conn, 'Enter username: ')
-            username = recv_long_data(conn).strip()
-            send_long_data(conn, 'Enter password: ')
-            password = recv_long_data(conn).strip()
-            password_hash = hash_password(password)
-            c.execute('SELECT * FROM users WHERE username=? AND password_hash=?', (username, password_hash))
-            if c.fetchone():
-                game_state = load_game_state()
-                send_long_data(conn, f"Login successful! Current Progress:\n\n{game_state['progress']}\n")
-                broadcast(f"[{username} logs in.]")
-
-                while True:
-                    user_input = recv_long_data(conn)
-                    if not user_input or user_input.strip() == "quit":
-                        break  # Disconnect if input is empty
-
-                    with action_lock:
-                        if action_in_progress:
-                            send_long_data(conn, "[Another action is currently being processed. Please wait.]")
-                            continue
-
-                        action_in_progress = True
-
-                    # Process action
-                    try:
-                        broadcast(f"[Action taken by {username}: {user_input}]")
-                        feedback = continue_story(user_input, username)
-                        broadcast(feedback)  # Broadcast the feedback from main to all users
-                        broadcast("[Keywords generating...]")
-                        extract_key_words(feedback)
-                        broadcast("[Keywords generation completed.]")
-
-                    finally:
-                        with action_lock:
-                            action_in_progress = False
-            else:
-                send_long_data(conn, 'Login failed. Check your username and password.\n')
+            outbox.send('Enter username: ')
+            username = (reader.read() or '').strip()
+            outbox.send('Enter password: ')
+            password = (reader.read() or '').strip()
+            if not users.verify(username, password):
+                outbox.send('Login failed. Check your username and password.\n')
+                return
+            outbox.name = username
+            world = find_world(worlds, argument.strip())
+            if world is None:
+                if argument.strip():
+                    outbox.send(f"[There is no world called {argument.strip()}.]")
+                world = worlds.get()
+            turn = enter_world(world, outbox, username)
+            token = sessions.create(username, world.name)
+        elif mode == 'S':
+            session = open_session(argument)
+            if session is None:
+                outbox.send('Session expired or unknown. Please login again.\n')
+                return
+            token, username, world_name, since = session
+            outbox.name = username
+            world = find_world(worlds, world_name) or worlds.get()
+            turn = enter_world(world, outbox, username, resumed=True, since=since)
+        else:
+            return
+        send_session(outbox, token, turn)
+
+        while True:
+            user_input = reader.read()
+            if not user_input:
+                break  # Connection dropped: the session can be resumed
+            # Receiving a command is timed from its header arriving, not from when the player started typing
+            STAGE_SECONDS.observe(time.perf_counter() - reader.arrived, stage="receive")
+            command = user_input.strip()
+            if command == "quit":
+                sessions.revoke(token)
+                break
+            if handle_command(worlds, outbox, world, command):
+                continue
+            if command == '/world' or command.startswith('/world '):
+                target = find_world(worlds, command[len('/world'):].strip())
+                if target is None:
+                    outbox.send("[Usage: /world <name>; /worlds lists the worlds.]")
+                elif target is not world:
+                    turn = enter_world(target, outbox, username, previous=world)
+                    world = target
+                    sessions.move(token, world.name)
+                    send_session(outbox, token, turn)
+                continue
+
+            queue_action(world, username, user_input, outbox.send)
+    except FrameTooLarge as e:
+        print(f"Dropping client {outbox.name}: {e}")
+    except ConnectionError:
+        pass  # Reset by the client: handled like a dropped connection
     finally:
+        if world is not None:
+            world.leave(outbox)
         with lock:
-            if conn in connections:
-                connections.remove(conn)
+            connections.pop(conn, None)
+        outbox.close()  # Deliver whatever is still queued for this client
         conn.close()
 
 def start_server():
@@ -220,7 +291,7 @@ def start_server():
     port = 12345
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server_socket.bind((host, port))
-    server_socket.listen(5)
+    server_socket.listen(1024)  # Room for a login storm; with a short queue the kernel drops connections it has already accepted
     print('Server started. Listening for connections...')
 
     while not shutdown_event.is_set():
@@ -235,22 +306,59 @@ def start_server():
 def stop_server():
     shutdown_event.set()
     server_socket.close()
-    db_conn.close()
+    worlds.close()  # Let pending keyword updates land, then flush every world
+    users.close()
     print('Server has been shut down.')
 
-# Optional: Implement a simple CLI to control the server
-def server_control():
+def server_control(stop=None, console=None):
+    """ Read operator commands from stdin: "stop" shuts the server down, anything else goes to the admin console. """
+    stop = stop or stop_server
+    console = console or AdminConsole(worlds, lambda: list(connections.values()))
     while True:
-        cmd = input('Enter "stop" to stop the server: ')
+        cmd = input('Enter "stop" to stop the server, or "help" for admin commands: ').strip()
         if cmd == "stop":
-            stop_server()
+            stop()
             break
-        else:
-            try:
-                exec(cmd)
-            except Exception as e:
-                print(e)
+        if cmd:
+            print(console.execute(cmd))
 
 if __name__ == "__main__":
-    threading.Thread(target=start_server).start()
-    server_control()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="aiMUD game server")
+    parser.add_argument('--mode', choices=['threaded', 'async'], default='threaded',
+                        help="threaded: one OS thread per connection (legacy). async: all connections on one asyncio event loop.")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="Port of the local Prometheus endpoint (GET /metrics on 127.0.0.1); 0 disables it.")
+    parser.add_argument('--admin-socket', default=ADMIN_SOCKET,
+                        help="Unix socket of the admin console (python admin.py --socket PATH help); empty disables it.")
+    parser.add_argument('--min-turn-workers', type=int, default=MIN_TURN_WORKERS,
+                        help="Turn workers available however few worlds are loaded; the pool grows by one per loaded world.")
+    parser.add_argument('--max-turn-workers', type=int, default=MAX_TURN_WORKERS,
+                        help="Turn workers at most, however many worlds are loaded.")
+    parser.add_argument('--background-workers', type=int, default=BACKGROUND_WORKERS,
+                        help="Workers for keyword extraction and story summaries, kept apart from the turns.")
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="DEBUG also logs a sample of the full LLM prompts.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    configure_pools(args.min_turn_workers, args.max_turn_workers, args.background_workers)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+
+    if args.mode == 'async':
+        import async_server
+        threading.Thread(target=async_server.start_server).start()
+        stop = async_server.stop_server
+        console = AdminConsole(async_server.worlds, lambda: list(async_server.outboxes.values()))
+    else:
+        threading.Thread(target=start_server).start()
+        stop = stop_server
+        console = AdminConsole(worlds, lambda: list(connections.values()))
+    admin_server = start_admin_server(console, args.admin_socket) if args.admin_socket else None
+    try:
+        server_control(stop, console)
+    finally:
+        if admin_server is not None:
+            stop_admin_server(admin_server)
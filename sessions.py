@@ -0,0 +1,63 @@
+"""
+Resumable sessions.
+
+After a successful login the server hands the client a session token. A client that loses its
+connection can send "S <token> <turn>" instead of logging in again: it is put back into the world it
+was in and receives only the turns from <turn> on (at most one /history page of them, the latest), instead
+of the whole story. Tokens are stored
+hashed in the user database and expire after SESSION_TTL seconds without use; "quit" revokes them.
+"""
+import time
+import hashlib
+import secrets
+
+SESSION_TTL = 24 * 3600  # Seconds a session can be resumed after it was last used
+
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class SessionStore:
+    """
+    Session tokens in the `sessions` table of the user database.
+
+    Args:
+    users (UserStore): The user database, whose connection pool the sessions share.
+    ttl (float): Seconds a session stays valid after its last use.
+    """
+
+    def __init__(self, users, ttl=SESSION_TTL):
+        self.users = users
+        self.ttl = ttl
+        with self.users.connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS sessions
+                            (token_hash TEXT PRIMARY KEY, username TEXT NOT NULL, world TEXT, expires REAL NOT NULL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+
+    def create(self, username: str, world: str) -> str:
+        """ Start a session for a logged-in user and return its token. """
+        token = secrets.token_urlsafe(24)
+        with self.users.connection() as conn:
+            conn.execute('INSERT INTO sessions (token_hash, username, world, expires) VALUES (?, ?, ?, ?)',
+                         (_hash_token(token), username, world, time.time() + self.ttl))
+        return token
+
+    def resume(self, token: str):
+        """ Return (username, world) of a valid session and extend it, or None if it is unknown or expired. """
+        now = time.time()
+        with self.users.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE expires < ?', (now,))
+            row = conn.execute('SELECT username, world FROM sessions WHERE token_hash = ?', (_hash_token(token),)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE sessions SET expires = ? WHERE token_hash = ?', (now + self.ttl, _hash_token(token)))
+        return row
+
+    def move(self, token: str, world: str):
+        """ Record that the session's player moved to another world. """
+        with self.users.connection() as conn:
+            conn.execute('UPDATE sessions SET world = ? WHERE token_hash = ?', (world, _hash_token(token)))
+
+    def revoke(self, token: str):
+        with self.users.connection() as conn:
+            conn.execute('DELETE FROM sessions WHERE token_hash = ?', (_hash_token(token),))
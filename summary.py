@@ -0,0 +1,126 @@
+"""
+Rolling story summary.
+
+Story prompts only carry the most recent window of progress, so everything older used to fall out of
+the story entirely. A background stage now condenses the turns that have left that window into a
+hierarchical summary, kept in the game state under "story_summary":
+
+    {"turns": 45, "levels": [[{"start": 40, "end": 45, "text": "..."}],
+                             [{"start": 0, "end": 20, "text": "..."}, {"start": 20, "end": 40, "text": "..."}]]}
+
+Each level-0 entry summarizes `chunk_turns` turns. When a level collects `fanout` entries, they are
+merged into one entry of the next level, so every level holds fewer than `fanout` entries. Higher
+levels always cover older turns, and each entry is at most `max_words` long. The summary therefore
+grows with the logarithm of the number of turns played, and build_context caps it at the
+"summary_share" of the prompt budget.
+
+The prompt gets the entries oldest first, followed by the recent window. The progress log itself is
+left alone: it is still the full record behind /history and session resume.
+
+Game file options: "summary_chunk_turns" (turns per level-0 entry, default 5, 0 turns summaries off),
+"summary_fanout" (default 4) and "summary_words" (default 120). The model is "summarization" under
+"models" in config.json, or the keyword extraction model if there is none.
+"""
+from llm import callGPT, llm_client
+
+DEFAULT_CHUNK_TURNS = 5
+DEFAULT_FANOUT = 4
+DEFAULT_MAX_WORDS = 120
+
+TURNS_PROMPT = """Summarize the following part of a text adventure story in at most {max_words} words.
+Keep who is involved, where they are, what the players did and what came of it, important items and open threads;
+leave out style and repetition. Write in the language of the story and answer with the summary only.
+
+{text}"""
+
+MERGE_PROMPT = """The following are consecutive summaries of a text adventure story, oldest first.
+Condense them into one summary of at most {max_words} words that keeps what matters for the rest of the story:
+who is involved, where they are, what happened and what is still unresolved. Write in the language of the story
+and answer with the summary only.
+
+{text}"""
+
+
+def empty_summary() -> dict:
+    return {"turns": 0, "levels": []}
+
+def summary_text(summary: dict) -> str:
+    """ The whole summary as prompt text, oldest story first. """
+    if not summary:
+        return ""
+    return " ".join(entry["text"] for level in reversed(summary["levels"]) for entry in level)
+
+def turns_text(records: list) -> str:
+    """ Progress records as the text handed to the summarizer, with each player action before its outcome. """
+    lines = []
+    for record in records:
+        if record.get("action"):
+            lines.append(f"[{record['author']}: {record['action']}]")
+        lines.append(record["text"])
+    return "\n".join(lines)
+
+
+def summarize(prompt: str, text: str, max_words: int) -> str:
+    """
+    Condense `text` with the summarization model.
+
+    Raises:
+    LLMError: If the model gave no answer; the caller simply tries again later.
+    """
+    models = llm_client.config['models']
+    model = models.get('summarization') or models['keyword_extraction']
+    return callGPT([{'role': 'user', 'content': prompt.format(max_words=max_words, text=text)}], model=model).strip()
+
+def compact(state, boundary: int) -> bool:
+    """
+    Summarize every whole chunk of turns before `boundary` that the summary does not cover yet, and merge
+    full levels. Only one compaction may run per game at a time. Returns True if the summary changed.
+
+    Args:
+    state (GameState): The game; the summary is read from and written to its "story_summary".
+    boundary (int): First turn that is still in the recent window of the story prompt.
+
+    Raises:
+    LLMError: If a summarization call failed; the work done before it is kept.
+    """
+    chunk_turns = state.get("summary_chunk_turns", DEFAULT_CHUNK_TURNS)
+    fanout = max(2, state.get("summary_fanout", DEFAULT_FANOUT))
+    max_words = state.get("summary_words", DEFAULT_MAX_WORDS)
+    if chunk_turns <= 0:
+        return False
+    summary = state.get("story_summary") or empty_summary()
+    changed = False
+    while summary["turns"] + chunk_turns <= boundary:
+        start = summary["turns"]
+        records = state.progress.read(start, start + chunk_turns)
+        entry = {"start": start, "end": start + chunk_turns, "text": summarize(TURNS_PROMPT, turns_text(records), max_words)}
+        summary = _with_entry(summary, 0, entry)
+        state["story_summary"] = summary  # Saved after every step, so a failed merge does not lose the new entry
+        changed = True
+        summary = _merge_full_levels(state, summary, fanout, max_words)
+    return changed
+
+def _with_entry(summary: dict, level: int, entry: dict) -> dict:
+    """ A copy of `summary` with `entry` appended to `level`; the summary in the state is never changed in place. """
+    levels = [list(entries) for entries in summary["levels"]]
+    while len(levels) <= level:
+        levels.append([])
+    levels[level].append(entry)
+    turns = summary["turns"] if level else entry["end"]
+    return {"turns": turns, "levels": levels}
+
+def _merge_full_levels(state, summary: dict, fanout: int, max_words: int) -> dict:
+    """ Merge every full level into the next one, saving the summary in the state after each merge. """
+    level = 0
+    while level < len(summary["levels"]):
+        entries = summary["levels"][level]
+        if len(entries) < fanout:
+            level += 1
+            continue
+        merged = {"start": entries[0]["start"], "end": entries[fanout - 1]["end"],
+                  "text": summarize(MERGE_PROMPT, "\n\n".join(entry["text"] for entry in entries[:fanout]), max_words)}
+        levels = [list(e) for e in summary["levels"]]
+        levels[level] = levels[level][fanout:]
+        summary = _with_entry({"turns": summary["turns"], "levels": levels}, level + 1, merged)
+        state["story_summary"] = summary
+    return summary
@@ -3,28 +3,13 @@
 import socket
 import time
 
-def send_long_data(sock, data):
-    """Send long data reliably over a socket connection."""
-    data = data.encode('utf-8')
-    length = len(data)
-    sock.send(length.to_bytes(4, byteorder='big'))
-    sock.send(data)
-
-def recv_long_data(sock, timeout=10):
-    """Receive long data reliably from a socket connection."""
-    sock.settimeout(timeout)
+from protocol import FrameReader, send_frame
+
+def recv_long_data(reader, timeout=10):
+    """Receive one frame, or None on timeout or once the connection is closed."""
+    reader.sock.settimeout(timeout)
     try:
-        length_bytes = sock.recv(4)
-        if not length_bytes:
-            return None
-        length = int.from_bytes(length_bytes, byteorder='big')
-        data = b''
-        while len(data) < length:
-            packet = sock.recv(length - len(data))
-            if not packet:
-                break
-            data += packet
-        return data.decode('utf-8')
+        return reader.read()
     except socket.timeout:
         return None
 
@@ -42,11 +27,12 @@ def test_game():
     try:
         print(f"\n[1] Connecting to {host}:{port}...")
         client_socket.connect((host, port))
+        reader = FrameReader(client_socket)
         print("✓ Connected successfully!")
 
         # Receive welcome message
         print("\n[2] Receiving welcome message...")
-        response = recv_long_data(client_socket)
+        response = recv_long_data(reader)
         if response:
             print("Server says:")
             print("-" * 60)
@@ -59,29 +45,29 @@ def test_game():
         password = "test123"
 
         # Send 'L' for login
-        send_long_data(client_socket, "L")
+        send_frame(client_socket, "L")
         time.sleep(0.3)
 
         # Receive username prompt
-        response = recv_long_data(client_socket, timeout=5)
+        response = recv_long_data(reader, timeout=5)
         if response:
             print(f"Server: {response.strip()}")
 
         # Send username
-        send_long_data(client_socket, username)
+        send_frame(client_socket, username)
         time.sleep(0.3)
 
         # Receive password prompt
-        response = recv_long_data(client_socket, timeout=5)
+        response = recv_long_data(reader, timeout=5)
         if response:
             print(f"Server: {response.strip()}")
 
         # Send password
-        send_long_data(client_socket, password)
+        send_frame(client_socket, password)
         time.sleep(0.3)
 
         # Receive login response
-        response = recv_long_data(client_socket, timeout=5)
+        response = recv_long_data(reader, timeout=5)
         if response:
             print("\n[4] Server response:")
             print("-" * 60)
@@ -90,11 +76,11 @@ def test_game():
 
         # Send a game command
         print("\n[5] Sending game command: 'look around'...")
-        send_long_data(client_socket, "look around")
+        send_frame(client_socket, "look around")
 
         # Wait for response (this might trigger an API call)
         print("\n[6] Waiting for game response (may take 10-20s for API call)...")
-        response = recv_long_data(client_socket, timeout=30)
+        response = recv_long_data(reader, timeout=30)
         if response:
             print("\nGame Response:")
             print("=" * 60)
@@ -0,0 +1,142 @@
+"""
+User accounts.
+
+The user database is shared by every client thread (and by the asyncio server's executor), so it is
+never used through one shared cursor. UserStore hands out connections from a small pool instead:
+each connection is used by one thread at a time, runs in WAL mode (readers never wait for a writer,
+and writers no longer rewrite a rollback journal), and waits for a busy database instead of failing.
+The SQL text is fixed, so every pooled connection prepares each statement once and reuses it from
+sqlite3's statement cache.
+
+Credentials that were verified recently are kept in memory for AUTH_CACHE_TTL seconds, so a storm of
+logins (e.g. everyone reconnecting after a restart) costs one query per user rather than one per
+attempt. Registering a user drops whatever was cached for that name.
+"""
+import hmac
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+
+USER_DB_FILE = 'user.db'
+POOL_SIZE = 8  # Connections open at most; more threads than this wait for a free one
+BUSY_TIMEOUT = 10.0  # Seconds a connection waits for a lock held by another one
+AUTH_CACHE_TTL = 60.0  # Seconds a verified password is trusted without asking the database again
+AUTH_CACHE_SIZE = 10000  # Users kept in the credential cache; the least recently verified are dropped
+
+CREATE_USERS = 'CREATE TABLE IF NOT EXISTS users (username TEXT UNIQUE, password_hash TEXT)'
+INSERT_USER = 'INSERT INTO users (username, password_hash) VALUES (?, ?)'
+SELECT_PASSWORD = 'SELECT password_hash FROM users WHERE username = ?'
+
+
+def hash_password(password):
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+class UserStore:
+    """
+    User accounts in an SQLite file, with pooled connections and a cache of verified credentials.
+
+    Args:
+    path (str): Path of the user database.
+    pool_size (int): Most connections open at once.
+    cache_ttl (float): Seconds a successful verification is cached.
+    cache_size (int): Most users in the credential cache.
+    """
+
+    def __init__(self, path=USER_DB_FILE, pool_size=POOL_SIZE, cache_ttl=AUTH_CACHE_TTL, cache_size=AUTH_CACHE_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self._idle = queue.LifoQueue()  # Connections not in use; the most recently used is handed out first
+        self._opened = []  # Every connection opened, to close them all on shutdown
+        self._pool_lock = threading.Lock()
+        self._closed = False
+        self._cache = OrderedDict()  # username -> (password hash, monotonic expiry time)
+        self._cache_lock = threading.Lock()
+        with self.connection() as conn:
+            conn.execute(CREATE_USERS)
+
+    def _open(self) -> sqlite3.Connection:
+        # Pooled connections move between threads, but only ever serve one of them at a time
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # Safe with WAL: a crash may lose the last commits, never corrupt
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for one transaction: committed on success, rolled back on error, then returned to the pool.
+
+        Raises:
+        sqlite3.ProgrammingError: If the store has been closed.
+        """
+        if self._closed:
+            raise sqlite3.ProgrammingError("the user store is closed")
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                conn = self._open() if len(self._opened) < self.pool_size else None
+                if conn is not None:
+                    self._opened.append(conn)
+            if conn is None:
+                conn = self._idle.get()  # Pool exhausted: wait for another thread to give one back
+        try:
+            with conn:
+                yield conn
+        finally:
+            if not self._closed:  # A connection borrowed before close() was closed with the others
+                self._idle.put(conn)
+
+    def register(self, username: str, password: str) -> bool:
+        """ Create an account. Returns False if the name is taken. """
+        try:
+            with self.connection() as conn:
+                conn.execute(INSERT_USER, (username, hash_password(password)))
+        except sqlite3.IntegrityError:
+            return False
+        self.invalidate(username)
+        return True
+
+    def verify(self, username: str, password: str) -> bool:
+        """ Check a username and password, answering from the credential cache when it can. """
+        password_hash = hash_password(password)
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(username)
+            if cached is not None and cached[1] > now and hmac.compare_digest(cached[0], password_hash):
+                return True
+        with self.connection() as conn:
+            row = conn.execute(SELECT_PASSWORD, (username,)).fetchone()
+        if row is None or not hmac.compare_digest(row[0], password_hash):
+            return False
+        with self._cache_lock:
+            self._cache[username] = (password_hash, now + self.cache_ttl)
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return True
+
+    def invalidate(self, username: str):
+        """ Forget the cached credentials of a user, e.g. after their account changed. """
+        with self._cache_lock:
+            self._cache.pop(username, None)
+
+    def close(self):
+        """ Close every connection; the store cannot be used afterwards. """
+        with self._pool_lock:
+            self._closed = True
+            opened, self._opened = self._opened, []
+        while True:  # Empty the pool, so no closed connection is ever handed out
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in opened:
+            conn.close()
@@ -0,0 +1,379 @@
+"""
+Hosted games ("worlds").
+
+One server process can run many games at once. A World bundles everything that belongs to one game:
+its GameState (state, progress log, keyword graph, each behind the state's own lock), the
+ActionScheduler that runs its turns one at a time, the background keyword-extraction stage, and its
+broadcast group, the players currently in it. Worlds share nothing but the worker pools and the state
+writer, so turns of different worlds run in parallel and a world costs no thread of its own. The turn
+pool grows with the number of loaded worlds; keyword extraction and summaries run on a pool of their
+own, so they never hold up a turn.
+
+The story turn itself (continue_story / extract_key_words) lives here too and works on any world's state.
+"""
+import os
+import threading
+
+from keywords import spot_keywords, extract_keywords
+from llm import continueStory, llm_client, LLMError
+from context import budget_for, build_context, get_tokenizer, tail_tokens, CHARS_PER_TOKEN, MAX_CHARS_PER_TOKEN
+from protocol import Frame, STREAM_DELTA
+from game_state import GameState
+from metrics import span, TURNS, TURN_ERRORS
+from scheduler import ActionScheduler, PipelineStage, DEFAULT_QUEUE_DEPTH, scale_turn_pool
+from summary import compact, empty_summary, summary_text, DEFAULT_CHUNK_TURNS
+
+# File Path
+GAME_STATE_FILE = "game.txt"  # The default world, where players land unless they ask for another one
+WORLDS_DIR = "games"  # Every <name>.txt in here is a world called <name>
+STATE_FLUSH_INTERVAL = 5.0  # Seconds a change may stay in memory before the writer flushes it
+STATE_FLUSH_DIRTY_THRESHOLD = 20  # Number of changes that triggers an early flush
+STATE_SYNC_INTERVAL = 1.0  # Seconds turns and keyword changes may stay unsynced before the writer fsyncs them
+TURN_FAILED_NOTICE = "[The story could not continue right now. The action was not applied; please try again.]"
+KEYWORDS_FAILED_NOTICE = "[Keywords could not be updated for the last segment.]"
+DEFAULT_MAX_CONTEXT_KEYWORDS = 40  # Cap on keyword notes per prompt when a game does not set "max_context_keywords"
+
+
+def combine_actions(actions):
+    """ Turn queued (player, text) actions into the (player, input) of a single story turn. """
+    if len(actions) == 1:
+        return actions[0][1], actions[0][0]
+    players = list(dict.fromkeys(player for player, _ in actions))
+    user_input = "; ".join(f"{player}: {text}" for player, text in actions)
+    return user_input, ", ".join(players)
+
+def continue_story(state, user_input, user_name, on_delta=None) -> str:
+    """ Process user input and update the game state with dynamic context windows based on specified coefficients.
+    If `on_delta` is given, the story is streamed and every piece of text is passed to it as it is generated. """
+    keywords = state.keywords
+    with state.lock:
+        overall_context = state["overall_context"]
+    base_window_size = state.get("text_window_size", 1000)  # Base context window size, in characters of English text
+    word_search_depth = state.get("word_search_depth", 2)
+    max_context_keywords = state.get("max_context_keywords", DEFAULT_MAX_CONTEXT_KEYWORDS)
+
+    # Model configuration comes from the shared LLM client, which re-reads config.json only when it changes
+    story_model = llm_client.config['models']['story_continuation']
+    budget = budget_for(llm_client.config, story_model)
+    count_tokens = get_tokenizer(budget["tokenizer"])
+
+    # Coefficients for various uses of the window
+    coeff_continuation = 1.0
+    coeff_keyword_spotting_continuation = 0.5
+
+    # Calculate window sizes based on coefficients; windows are measured in tokens, so that a
+    # window holds the same amount of story whatever the language of the game
+    window_for_continuation = int(base_window_size / CHARS_PER_TOKEN * coeff_continuation)
+    window_for_keyword_spotting = int(base_window_size / CHARS_PER_TOKEN * coeff_keyword_spotting_continuation)
+
+    # Read only the tail of the progress log for GPT model processing and keyword spotting
+    recent_progress, progress_limit = recent_window(state, window_for_continuation, count_tokens)
+    progress_for_keyword_spotting = tail_tokens(recent_progress, window_for_keyword_spotting, count_tokens)
+
+    # Spot keywords in the context window specifically for keyword spotting, using the maintained keyword graph
+    # (under the state lock, as background keyword extraction may be updating the graph at the same time)
+    with span("spot_keywords"), state.lock:
+        relevant_keywords = spot_keywords(progress_for_keyword_spotting + " " + user_input, keywords, depth=word_search_depth, graph=state.keyword_graph, matcher=state.keyword_graph.matcher, max_keywords=max_context_keywords)
+        relevant_notes = keywords.get_many(relevant_keywords)
+
+    # Fill the model's token budget: overall context first, then the summary of the older story, then recent progress, then the ranked notes
+    context = build_context(budget, overall_context, recent_progress, relevant_notes,
+                            fixed=user_name + " " + user_input, max_progress_tokens=progress_limit,
+                            summary=summary_text(state.get("story_summary")))
+    if context.trimmed:
+        print(f"Story context for {story_model}: {context.report()}")
+
+    # Update progress and context using GPT model with filtered keywords
+    with span("continue_story"):
+        new_progress_segment = continueStory(context.progress, context.overall_context, user_name, user_input, context.notes, model=story_model, on_delta=on_delta, summary=context.summary)
+
+    # Append the new segment to the progress log as this player's turn
+    with span("progress_append"):
+        state.progress.append(new_progress_segment, author=user_name, action=user_input)
+
+    # Generate and return response to the server
+    return new_progress_segment
+
+def recent_window(state, window: int, count_tokens) -> tuple:
+    """
+    The recent progress for a story prompt and the token cap for it: the last `window` tokens, reaching back to
+    the first turn the rolling summary does not cover yet, so that no turn falls between the summary and the window.
+
+    Returns:
+    tuple: (text, max_tokens).
+    """
+    recent = tail_tokens(state.progress.tail_text(window * MAX_CHARS_PER_TOKEN), window, count_tokens)
+    chunk_turns = state.get("summary_chunk_turns", DEFAULT_CHUNK_TURNS)
+    if chunk_turns <= 0:
+        return recent, window
+    covered = (state.get("story_summary") or empty_summary())["turns"]
+    start = state.progress.tail_start(len(recent))  # Usually cut mid-turn, and the summary only takes whole chunks
+    # Compaction keeps the summary less than a chunk behind the window; one lagging further (its model
+    # failing) catches up in the background, so the window never grows past a chunk
+    first = max(covered, start - chunk_turns)
+    if first > start:
+        return recent, window
+    recent = " ".join(record["text"] for record in state.progress.read(first))
+    return recent, max(window, count_tokens(recent))
+
+def summary_boundary(state) -> int:
+    """ First turn still inside the recent window of a story prompt; the turns before it are due for the rolling summary. """
+    story_model = llm_client.config['models']['story_continuation']
+    count_tokens = get_tokenizer(budget_for(llm_client.config, story_model)["tokenizer"])
+    window = int(state.get("text_window_size", 1000) / CHARS_PER_TOKEN)  # Same window as continue_story
+    recent_progress = tail_tokens(state.progress.tail_text(window * MAX_CHARS_PER_TOKEN), window, count_tokens)
+    return state.progress.tail_start(len(recent_progress))
+
+def summarize_story(state):
+    """ Fold the turns that have left the prompt window into the game's rolling summary. """
+    try:
+        with span("summarize"):
+            compact(state, summary_boundary(state))
+    except LLMError as e:
+        print(f"Story summary postponed: {e}")  # The same turns are tried again after the next turn
+
+def extract_key_words(state, new_progress_segment):
+    keywords = state.keywords
+    max_context_keywords = state.get("max_context_keywords", DEFAULT_MAX_CONTEXT_KEYWORDS)
+
+    # Re-run keyword spotting on the new progress segment
+    with span("spot_keywords"), state.lock:
+        new_relevant_keywords = spot_keywords(new_progress_segment, keywords, depth=2, graph=state.keyword_graph, matcher=state.keyword_graph.matcher, max_keywords=max_context_keywords)
+        relevant_notes = keywords.get_many(new_relevant_keywords)
+
+    # Only as many of the spotted notes as fit the keyword model's token budget go into the prompt
+    keyword_model = llm_client.config['models']['keyword_extraction']
+    context = build_context(budget_for(llm_client.config, keyword_model), progress=new_progress_segment, notes=relevant_notes)
+    if context.trimmed:
+        print(f"Keyword context for {keyword_model}: {context.report()}")
+
+    # Extract and update keywords from the new story segment using the latest spotted keywords
+    with span("extract_keywords"):
+        new_keywords = extract_keywords(context.notes, context.progress)
+    if new_keywords:
+        state.update_keywords(new_keywords)  # Only the changed keys get their graph edges recomputed
+
+    return new_keywords
+
+
+def _call_now(fn, *args):
+    fn(*args)
+
+
+class World:
+    """
+    One hosted game and the players in it.
+
+    Broadcasts only reach the world's own members. Turns run on the shared turn pool, keyword extraction
+    and summaries on the background pool; everything they send to players goes through `call_soon(fn, *args)`, which the asyncio
+    server sets to hand the call over to its event loop (the threaded server calls straight through).
+
+    Args:
+    name (str): Name players use to pick the world.
+    path (str): Path of the world's JSON game file.
+    call_soon (callable): How broadcasts from turn threads reach the outboxes; defaults to a direct call.
+    """
+
+    def __init__(self, name: str, path: str, call_soon=None):
+        self.name = name
+        self.state = GameState(path, flush_interval=STATE_FLUSH_INTERVAL, dirty_threshold=STATE_FLUSH_DIRTY_THRESHOLD,
+                               sync_interval=STATE_SYNC_INTERVAL)
+        self.call_soon = call_soon or _call_now
+        self._members = {}  # Outbox -> username of every player in the world
+        self._lock = threading.Lock()  # Guards the member list
+        # Actions wait here instead of being rejected while a turn is running
+        self.scheduler = ActionScheduler(self.run_turn,
+                                         max_depth=self.state.get("action_queue_depth", DEFAULT_QUEUE_DEPTH),
+                                         merge=self.state.get("merge_actions", False))
+        # Keyword extraction runs as a background stage, one segment at a time and in story order
+        self.keyword_pipeline = PipelineStage(
+            lambda segment: extract_key_words(self.state, segment),
+            on_done=self._keywords_done)
+        # Older turns are condensed into the rolling summary in the background as well
+        self.summary_pipeline = PipelineStage(lambda _: summarize_story(self.state))
+
+    def _keywords_done(self, segment, new_keywords):
+        """ Announce a keyword update only when it changed something; a failed extraction is reported as such. """
+        if new_keywords is None:
+            print(f"Keyword extraction failed in {self.name}; the segment's keywords were not updated.")
+            self.call_soon(self.broadcast, KEYWORDS_FAILED_NOTICE)
+        elif new_keywords:
+            self.call_soon(self.broadcast, "[Keywords generation completed.]")
+
+    def join(self, outbox, username: str):
+        with self._lock:
+            self._members[outbox] = username
+
+    def leave(self, outbox):
+        with self._lock:
+            self._members.pop(outbox, None)
+
+    def players(self) -> list:
+        with self._lock:
+            return list(self._members.values())
+
+    def members(self) -> dict:
+        """ Outbox -> username of every player in the world. """
+        with self._lock:
+            return dict(self._members)
+
+    def _outboxes(self) -> list:
+        with self._lock:
+            return list(self._members)
+
+    def broadcast(self, message):
+        """ Queue a message for every player in the world; each player's writer delivers it on its own. """
+        with span("broadcast"):
+            frame = Frame(message)  # Encode (and compress) once, share the bytes between all queues
+            for outbox in self._outboxes():
+                outbox.put(frame)  # Never blocks; slow or stalled clients get evicted instead
+
+    def broadcast_stream_delta(self, delta):
+        """ Queue the next piece of a story segment that is still being generated for streaming players. """
+        frame = Frame(STREAM_DELTA + delta)
+        for outbox in self._outboxes():
+            if outbox.streaming:
+                outbox.put(frame)
+
+    def broadcast_stream_end(self):
+        """ Queue the end-of-stream marker for streaming players, closing a segment that stopped early. """
+        frame = Frame(STREAM_DELTA)
+        for outbox in self._outboxes():
+            if outbox.streaming:
+                outbox.put(frame)
+
+    def broadcast_story(self, segment):
+        """ Deliver a finished story segment: streaming players get the end-of-stream marker, the others the full text. """
+        with span("broadcast"):
+            full_frame = Frame(segment)
+            end_frame = Frame(STREAM_DELTA)
+            for outbox in self._outboxes():
+                outbox.put(end_frame if outbox.streaming else full_frame)
+
+    def streaming_requested(self) -> bool:
+        return any(outbox.streaming for outbox in self._outboxes())
+
+    def run_turn(self, actions):
+        """ Run one story turn for the queued actions (several of them when the game merges actions). """
+        for username, user_input in actions:
+            self.call_soon(self.broadcast, f"[Action taken by {username}: {user_input}]")
+        user_input, username = combine_actions(actions)
+        streamed = False  # Whether streaming players got part of the segment already
+
+        def stream(delta):
+            nonlocal streamed
+            streamed = True
+            self.call_soon(self.broadcast_stream_delta, delta)
+
+        on_delta = stream if self.streaming_requested() else None
+        try:
+            with span("turn"):
+                feedback = continue_story(self.state, user_input, username, on_delta=on_delta)
+        except LLMError as e:
+            # Nothing was added to the story: tell the players, and let them try again
+            TURN_ERRORS.inc()
+            print(f"Turn failed in {self.name}: {e}")
+            if streamed:
+                self.call_soon(self.broadcast_stream_end)  # Close the partial segment before the notice
+            self.call_soon(self.broadcast, TURN_FAILED_NOTICE)
+            return
+        TURNS.inc(world=self.name)
+        self.call_soon(self.broadcast_story, feedback)  # Broadcast the feedback to everyone in the world
+        self.keyword_pipeline.submit(feedback)  # The next turn can start while keywords are extracted
+        if not len(self.summary_pipeline):
+            self.summary_pipeline.submit(None)  # One pending compaction covers every turn played until it runs
+
+    def close(self, timeout=60):
+        """ Let pending keyword updates land, then flush and close the world's state. """
+        self.keyword_pipeline.join(timeout=timeout)
+        self.summary_pipeline.join(timeout=timeout)
+        self.state.close()
+
+
+class WorldRegistry:
+    """
+    The worlds a server can host: the default game file plus every <name>.txt in `worlds_dir`.
+
+    Worlds are loaded on first use and then stay open, so a server with hundreds of world files
+    only pays for the ones players actually enter. The directory is re-scanned on lookup, so a
+    world file dropped in while the server runs becomes available right away.
+
+    Args:
+    default_path (str): Game file of the default world, named after its file stem.
+    worlds_dir (str): Directory holding the other worlds.
+    call_soon (callable): Passed on to every World.
+    """
+
+    def __init__(self, default_path=GAME_STATE_FILE, worlds_dir=WORLDS_DIR, call_soon=None):
+        self.default_path = default_path
+        self.worlds_dir = worlds_dir
+        self.call_soon = call_soon
+        self.default_name = os.path.splitext(os.path.basename(default_path))[0]
+        self._worlds = {}  # name -> loaded World
+        self._loading = {}  # name -> lock held while that world loads, so only its own callers wait for it
+        self._lock = threading.Lock()  # Guards the two dicts; never held while a world loads
+
+    def paths(self) -> dict:
+        """ Map every available world name to its game file. """
+        paths = {}
+        if os.path.isdir(self.worlds_dir):
+            for file_name in sorted(os.listdir(self.worlds_dir)):
+                stem, ext = os.path.splitext(file_name)
+                if ext == ".txt":
+                    paths[stem] = os.path.join(self.worlds_dir, file_name)
+        paths[self.default_name] = self.default_path
+        return paths
+
+    def names(self) -> list:
+        names = sorted(self.paths(), key=str.lower)
+        names.remove(self.default_name)
+        return [self.default_name] + names
+
+    def resolve(self, name: str):
+        """ Return the exact name of the world called `name` (case-insensitive), or None if there is none. """
+        if not name:
+            return self.default_name
+        paths = self.paths()
+        if name in paths:
+            return name
+        return next((n for n in paths if n.lower() == name.lower()), None)
+
+    def get(self, name: str = None) -> World:
+        """
+        Return the world called `name` (the default world if empty), loading it on first use.
+
+        Raises:
+        KeyError: If there is no such world.
+        """
+        resolved = self.resolve(name)
+        if resolved is None:
+            raise KeyError(name)
+        with self._lock:
+            world = self._worlds.get(resolved)
+            if world is not None:
+                return world
+            loading = self._loading.setdefault(resolved, threading.Lock())
+        with loading:
+            with self._lock:
+                world = self._worlds.get(resolved)
+            if world is not None:
+                return world  # Loaded by the caller we waited for
+            world = World(resolved, self.paths()[resolved], call_soon=self.call_soon)
+            world.state.start()
+            with self._lock:
+                self._worlds[resolved] = world
+                self._loading.pop(resolved, None)
+                scale_turn_pool(len(self._worlds))  # So every loaded world can run a turn at the same time
+            print(f"World loaded: {resolved}")
+            return world
+
+    def loaded(self) -> list:
+        with self._lock:
+            return list(self._worlds.values())
+
+    def close(self, timeout=60):
+        """ Close every loaded world. """
+        with self._lock:
+            worlds, self._worlds = list(self._worlds.values()), {}
+        for world in worlds:
+            world.close(timeout=timeout)